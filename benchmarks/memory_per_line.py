@@ -0,0 +1,51 @@
+"""
+Measure the memory used per recorded line.
+
+$ python benchmarks/memory_per_line.py --nlines 100000
+"""
+import argparse
+import gc
+import tracemalloc
+
+import numpy as np
+
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def _record(macro: NapariMacro, nlines: int) -> None:
+    @macro.record
+    def gaussian_filter(image: np.ndarray, sigma: float = 1.0) -> np.ndarray:
+        return image
+
+    @macro.record
+    def threshold(image: np.ndarray, value: float, dark: bool = False):
+        pass
+
+    images = [np.zeros((2, 2)) for _ in range(4)]
+    for i in range(nlines // 2):
+        out = gaussian_filter(images[i % 4], sigma=float(i % 3))
+        threshold(out, value=0.5)
+
+
+def bytes_per_line(nlines: int, compact: bool) -> float:
+    gc.collect()
+    tracemalloc.start()
+    macro = NapariMacro(compact=compact)
+    _record(macro, nlines)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / len(macro)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nlines", type=int, default=20000)
+    args = parser.parse_args()
+    for compact in [False, True]:
+        nbytes = bytes_per_line(args.nlines, compact)
+        print(f"compact={compact!s:<5}: {nbytes:8.1f} bytes/line")
+
+
+if __name__ == "__main__":
+    main()
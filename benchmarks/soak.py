@@ -0,0 +1,187 @@
+"""
+Soak test of a long session to find slow memory leaks.
+
+Calls with array outputs are recorded into a long-living macro (which is
+cleared in every cycle) and into temporary macros, while the macro tabs are
+opened and closed. After a warm-up, the traced memory and the number of
+objects of each type must stay flat. The largest retainers are reported.
+
+$ python benchmarks/soak.py --ncalls 200000
+
+With the default arguments the run takes several minutes, mostly spent in
+highlighting the recorded lines. The exit code is 1 if a leak is suspected.
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from collections import Counter
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np  # noqa: E402
+from macrokit import Mock, Symbol, register_type  # noqa: E402
+from napari.components import ViewerModel  # noqa: E402
+from napari.layers import Image  # noqa: E402
+from qtpy.QtCore import QEvent  # noqa: E402
+from qtpy.QtWidgets import QApplication  # noqa: E402
+
+from napari_macrokit import QMacroView, get_macro, temp_macro  # noqa: E402
+from napari_macrokit._widgets._highlight import (  # noqa: E402
+    highlight_segments,
+)
+
+_viewer = Mock(Symbol.var("viewer"))
+register_type(Image, lambda layer: _viewer.layers[layer.name].expr)
+
+
+def _process_events(app: QApplication) -> None:
+    app.processEvents()
+    # run deleteLater of the closed tabs
+    app.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+
+
+def _clear_caches() -> None:
+    # bounded caches are filled during the first cycles, which is not a leak
+    highlight_segments.cache_clear()
+    gc.collect()
+
+
+def _count_objects() -> Counter:
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class Soak:
+    def __init__(self, calls_per_cycle: int):
+        self._app = QApplication.instance() or QApplication([])
+        self._view = QMacroView()
+        self._viewer = ViewerModel()
+        self._viewer.add_image(np.zeros((8, 8)), name="image")
+        self._macro = get_macro("soak")
+        self._calls_per_cycle = calls_per_cycle
+        self.ncalls = 0
+
+    def cycle(self) -> None:
+        tabs = self._view._tabwidget
+        layer = self._viewer.layers["image"]
+        _record_calls(self._macro, layer, self._calls_per_cycle // 2)
+        self._macro.clear()
+
+        with temp_macro("soak-temp") as macro:
+            _record_calls(macro, layer, self._calls_per_cycle // 2)
+        # detached tabs of temporary macros can be closed
+        for i in reversed(range(tabs.count())):
+            if tabs.widget(i)._macro is None:
+                tabs.remove_editor(i)
+
+        index = tabs.index_of(self._macro)
+        if index >= 0:
+            tabs.remove_macro(index)
+        tabs.add_macro(self._macro, "soak")
+        _process_events(self._app)
+        self.ncalls += self._calls_per_cycle
+
+
+def gaussian_filter(image: Image, sigma: float = 1.0) -> np.ndarray:
+    return np.zeros(16)
+
+
+def threshold(data: np.ndarray, value: float) -> np.ndarray:
+    return data > value
+
+
+def _record_calls(macro, layer: Image, ncalls: int) -> None:
+    # functions are defined once as in plugins, and recorded by each macro
+    gaussian_filter = macro.record(globals()["gaussian_filter"])
+    threshold = macro.record(globals()["threshold"])
+    for i in range(ncalls // 2):
+        out = gaussian_filter(layer, sigma=float(i % 3))
+        threshold(out, value=0.5)
+
+
+def _measure(soak: Soak, ncycles: int):
+    """Run cycles and return the number of calls and the snapshots."""
+    _clear_caches()
+    # objects are counted while one snapshot is alive on both sides
+    snapshot0 = tracemalloc.take_snapshot()
+    counts0 = _count_objects()
+    ncalls0 = soak.ncalls
+    for i in range(ncycles):
+        soak.cycle()
+        print(f"\rcycle {i + 1}/{ncycles}", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    _clear_caches()
+    # the counters are released so that they are not traced as growth
+    diff = _count_objects() - counts0
+    del counts0
+    snapshot1 = tracemalloc.take_snapshot()
+    return soak.ncalls - ncalls0, (snapshot0, snapshot1), diff
+
+
+def run(
+    ncalls: int,
+    ncycles: int,
+    warmup: int,
+    top: int,
+    max_bytes_per_call: float,
+) -> bool:
+    soak = Soak(max(ncalls // ncycles, 4))
+    for _ in range(warmup):
+        soak.cycle()
+    tracemalloc.start()
+    # objects created once (such as the widgets of new tabs) are allocated in
+    # the first half, so only the second half is checked.
+    _measure(soak, ncycles // 2)
+    ncalls, (snapshot0, snapshot1), diff = _measure(
+        soak, ncycles - ncycles // 2
+    )
+    tracemalloc.stop()
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = snapshot1.filter_traces(filters).compare_to(
+        snapshot0.filter_traces(filters), "lineno"
+    )
+    growth = sum(stat.size_diff for stat in stats)
+    print(f"calls: {ncalls}, growth: {growth} bytes")
+    print(f"growth per call: {growth / ncalls:.3f} bytes")
+
+    print(f"\nlargest retainers (top {top}):")
+    for stat in stats[:top]:
+        if stat.size_diff <= 0:
+            continue
+        frame = stat.traceback[0]
+        print(f"  {stat.size_diff:+10d} B  {frame.filename}:{frame.lineno}")
+
+    print("\nobject count changes:")
+    for name, n in diff.most_common(top):
+        print(f"  {n:+8d}  {name}")
+
+    # memory is flat if the growth does not scale with the number of calls
+    return (
+        growth / ncalls < max_bytes_per_call
+        and sum(diff.values()) < ncalls / 100
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ncalls", type=int, default=200000)
+    parser.add_argument("--ncycles", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-bytes-per-call", type=float, default=1.0)
+    args = parser.parse_args()
+    ok = run(
+        args.ncalls,
+        args.ncycles,
+        args.warmup,
+        args.top,
+        args.max_bytes_per_call,
+    )
+    print("\nOK" if ok else "\nLEAK SUSPECTED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,31 @@ register_all()
 
 del register_all
 
+from ._checkpoint import Checkpoint
+from ._events import (
+    EventSink,
+    JSONLinesSink,
+    RecordEvent,
+    add_event_sink,
+    remove_event_sink,
+)
 from ._macrokit_ext import set_unlinked, set_unlinked_context
+from ._parallel import ParallelExecutor
+from ._result_cache import ResultCache
+from ._sidecar import SidecarStore, load_literal
 from ._widgets import QMacroView
 from .core import (
     available_keys,
     collect_macro,
     get_macro,
+    load_macro,
     symbol_of,
     temp_macro,
 )
 
 __all__ = [
     "get_macro",
+    "load_macro",
     "available_keys",
     "collect_macro",
     "temp_macro",
@@ -24,4 +37,14 @@ __all__ = [
     "QMacroView",
     "set_unlinked",
     "set_unlinked_context",
+    "Checkpoint",
+    "RecordEvent",
+    "EventSink",
+    "JSONLinesSink",
+    "add_event_sink",
+    "remove_event_sink",
+    "SidecarStore",
+    "load_literal",
+    "ParallelExecutor",
+    "ResultCache",
 ]
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import keyword
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Iterator
+
+import numpy as np
+from macrokit import Expr, Head, Symbol
+
+from napari_macrokit._dependency import iter_dependencies
+from napari_macrokit._execution import EventLoop, execute_line
+from napari_macrokit._result_cache import argument_id, function_fingerprint
+
+_REMOVE_AT_EXIT: set[Path] = set()
+
+
+def _default_cache_dir() -> Path:
+    path = Path(tempfile.gettempdir()) / "napari-macrokit" / str(os.getpid())
+    # the directory of this session is removed when the interpreter exits
+    if path not in _REMOVE_AT_EXIT:
+        _REMOVE_AT_EXIT.add(path)
+        atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+class Checkpoint:
+    """
+    On-disk cache of the outputs of assign lines.
+
+    The key of each assign line is computed from the line itself, the keys
+    of the lines that produced the variables it refers to and the inputs from
+    the namespace. When a macro is executed again after an edit, only the
+    lines whose key has changed, that is, the edited lines and their
+    downstream, are executed. Arrays are saved as ``.npy`` files and
+    memory-mapped on reload. Other picklable outputs are pickled.
+
+    Inputs from the namespace are identified in the same way as the arguments
+    of ``ResultCache``. Attributes and items such as
+    ``viewer.layers['image'].data`` are evaluated and identified by their
+    content, and functions by their source code. Lines that refer to inputs
+    that cannot be identified, and their downstream, are always executed.
+
+    Assign lines are regarded as pure. If the output of a line is loaded from
+    the cache, the line is not executed, so its side effects, such as adding
+    a layer to the viewer, do not happen. Lines without output are always
+    executed.
+
+    Parameters
+    ----------
+    path : path-like, optional
+        Directory to save the outputs. A directory in the temporary directory
+        of this session is used by default, which is removed when the
+        session ends.
+    """
+
+    def __init__(self, path: str | Path | None = None):
+        if path is None:
+            path = _default_cache_dir()
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({str(self._path)!r})"
+
+    @property
+    def path(self) -> Path:
+        """Path to the cache directory."""
+        return self._path
+
+    def clear(self) -> None:
+        """Remove all the cached outputs."""
+        shutil.rmtree(self._path, ignore_errors=True)
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    def load(self, key: str) -> Any:
+        """Load a cached output. Raise KeyError if not found."""
+        if (npy := self._path / f"{key}.npy").exists():
+            return np.load(npy, mmap_mode="c", allow_pickle=False)
+        if (pkl := self._path / f"{key}.pkl").exists():
+            with open(pkl, "rb") as f:
+                return pickle.load(f)
+        raise KeyError(key)
+
+    def save(self, key: str, value: Any) -> bool:
+        """Save an output and return true if succeeded."""
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            # write to a temporary file first so that a broken file is never
+            # loaded.
+            tmp = self._path / f"{key}.{os.getpid()}.tmp.npy"
+            np.save(tmp, value, allow_pickle=False)
+            os.replace(tmp, self._path / f"{key}.npy")
+            return True
+        try:
+            data = pickle.dumps(value)
+        except Exception:
+            return False
+        tmp = self._path / f"{key}.{os.getpid()}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, self._path / f"{key}.pkl")
+        return True
+
+    def execute(
+        self,
+        lines: list[Symbol | Expr],
+        prepared: list[Symbol | Expr],
+        _globals: dict[str, Any],
+        loop: EventLoop | None = None,
+    ) -> list[bool]:
+        """
+        Execute prepared lines using the cached outputs.
+
+        Returns a list of boolean that indicates whether each line is
+        actually executed.
+        """
+        # None if the line is not cached
+        keys: list[str | None] = []
+        assigned: set[str] = set()
+        executed: list[bool] = []
+        for orig, line, (upstream, names) in zip(
+            lines, prepared, iter_dependencies(lines)
+        ):
+            key = None
+            if names:
+                key = _line_key(orig, line, upstream, keys, _globals, assigned)
+            keys.append(key)
+            assigned.update(names)
+            if key is None:
+                # lines without output may have side effects
+                execute_line(line, _globals, loop)
+                executed.append(True)
+                continue
+            try:
+                value = self.load(key)
+            except KeyError:
+                execute_line(line, _globals, loop)
+                if len(names) == 1:
+                    value = _globals[names[0]]
+                else:
+                    value = tuple(_globals[name] for name in names)
+                self.save(key, value)
+                executed.append(True)
+            else:
+                if len(names) == 1:
+                    _globals[names[0]] = value
+                else:
+                    _globals.update(zip(names, value))
+                executed.append(False)
+        return executed
+
+
+def _line_key(
+    line: Symbol | Expr,
+    prepared: Symbol | Expr,
+    upstream: set[int],
+    keys: list[str | None],
+    _globals: dict[str, Any],
+    assigned: set[str],
+) -> str | None:
+    """Compute the key of a line, or None if it cannot be cached."""
+    hasher = hashlib.sha1(str(line).encode())
+    for i in sorted(upstream):
+        if (key := keys[i]) is None:
+            return None
+        hasher.update(key.encode())
+    if isinstance(prepared, Expr) and prepared.head is Head.assign:
+        prepared = prepared.args[1]
+    for expr in _iter_inputs(prepared, assigned):
+        if isinstance(expr, Symbol):
+            if expr.name not in _globals:
+                continue  # builtins
+            value = _globals[expr.name]
+        else:
+            try:
+                value = eval(str(expr), _globals)
+            except Exception:
+                return None
+        if (input_id := _input_id(value)) is None:
+            return None
+        hasher.update(f"{expr}={input_id};".encode())
+    return hasher.hexdigest()
+
+
+def _iter_inputs(
+    expr: Symbol | Expr, assigned: set[str]
+) -> Iterator[Symbol | Expr]:
+    """Iterate over the names and attribute chains from the namespace."""
+    if isinstance(expr, Symbol):
+        if _is_name(expr) and expr.name not in assigned:
+            yield expr
+        return
+    if not isinstance(expr, Expr):
+        return
+    if expr.head in (Head.getattr, Head.getitem) and _is_chain(expr, assigned):
+        yield expr
+    elif expr.head is Head.kw:
+        yield from _iter_inputs(expr.args[1], assigned)
+    elif expr.head is Head.getattr:
+        yield from _iter_inputs(expr.args[0], assigned)
+    else:
+        for arg in expr.args:
+            yield from _iter_inputs(arg, assigned)
+
+
+def _is_chain(expr: Symbol | Expr, assigned: set[str]) -> bool:
+    # such as "viewer.layers['image'].data"
+    while isinstance(expr, Expr):
+        if expr.head is Head.getitem:
+            key = expr.args[1]
+            if not isinstance(key, Symbol) or _is_name(key):
+                return False
+        elif expr.head is not Head.getattr:
+            return False
+        expr = expr.args[0]
+    return _is_name(expr) and expr.name not in assigned
+
+
+def _is_name(sym: Symbol) -> bool:
+    # symbols of parsed lines are not distinguished from literals by the
+    # "constant" flag
+    return sym.name.isidentifier() and not keyword.iskeyword(sym.name)
+
+
+def _input_id(value: Any) -> str | None:
+    if (arg_id := argument_id(value)) is not None:
+        return arg_id
+    if isinstance(value, ModuleType):
+        return f"module:{value.__name__}"
+    if callable(value):
+        try:
+            return function_fingerprint(value)
+        except (AttributeError, TypeError):
+            # such as builtin functions
+            module = getattr(value, "__module__", None)
+            qualname = getattr(value, "__qualname__", None)
+            if module is None or qualname is None:
+                return None
+            return f"{module}.{qualname}"
+    return None
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+from typing import Any, Hashable, Iterable, Iterator, MutableSequence
+
+from macrokit import Expr, Head, Symbol
+
+_Line = "Symbol | Expr"
+
+
+class _Node:
+    """An immutable, slotted counterpart of ``Expr``."""
+
+    __slots__ = ("head", "args")
+
+    def __init__(self, head: Head, args: tuple[Symbol | _Node, ...]):
+        self.head = head
+        self.args = args
+
+
+class CompactCall:
+    """A compact record of ``f(...)`` or ``out = f(...)``."""
+
+    __slots__ = ("output", "callee", "args")
+
+    def __init__(
+        self,
+        output: Symbol | None,
+        callee: Symbol | _Node,
+        args: tuple[Symbol | _Node, ...],
+    ):
+        self.output = output
+        self.callee = callee
+        self.args = args
+
+
+class LinePool:
+    """
+    Pool of the interned symbols and sub-expressions of compact lines.
+
+    Callees, layer expressions such as ``viewer.layers['a']`` and literals
+    that appear in many lines are stored only once. Objects are reference
+    counted and removed when no line refers to them anymore.
+    """
+
+    def __init__(self):
+        self._table: dict[Hashable, Symbol | _Node] = {}
+        self._counts: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def freeze(self, line: Symbol | Expr) -> Symbol | Expr | CompactCall:
+        """Convert a call line into a compact record if possible."""
+        if not isinstance(line, Expr):
+            return line
+        output = None
+        call = line
+        if line.head is Head.assign and isinstance(line.args[0], Symbol):
+            output, call = line.args
+        if not isinstance(call, Expr) or call.head is not Head.call:
+            return line
+        callee, *args = (self._intern(arg)[1] for arg in call.args)
+        return CompactCall(output, callee, tuple(args))
+
+    def thaw(self, item: Symbol | Expr | CompactCall) -> Symbol | Expr:
+        """Convert a compact record into a new expression."""
+        if not isinstance(item, CompactCall):
+            return item
+        call = Expr(
+            Head.call, [_thaw(item.callee), *(_thaw(a) for a in item.args)]
+        )
+        if item.output is None:
+            return call
+        return Expr(Head.assign, [item.output, call])
+
+    def release(self, item: Symbol | Expr | CompactCall) -> None:
+        """Release the interned objects of a line that is removed."""
+        if isinstance(item, CompactCall):
+            self._release(item.callee)
+            for arg in item.args:
+                self._release(arg)
+
+    def _intern(self, obj: Symbol | Expr) -> tuple[Hashable, Symbol | _Node]:
+        if isinstance(obj, Symbol):
+            key = _symbol_key(obj)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            return key, self._table.setdefault(key, obj)
+        if not isinstance(obj, Expr):
+            raise TypeError(f"Cannot intern {type(obj)}.")
+        keys, nodes = [], []
+        for arg in obj.args:
+            k, n = self._intern(arg)
+            keys.append(k)
+            nodes.append(n)
+        key = (obj.head, tuple(keys))
+        self._counts[key] = self._counts.get(key, 0) + 1
+        node = self._table.get(key)
+        if node is None:
+            node = self._table[key] = _Node(obj.head, tuple(nodes))
+        return key, node
+
+    def _release(self, node: Symbol | _Node) -> Hashable:
+        if isinstance(node, _Node):
+            key: Hashable = (
+                node.head,
+                tuple(self._release(arg) for arg in node.args),
+            )
+        else:
+            key = _symbol_key(node)
+        if (count := self._counts[key] - 1) > 0:
+            self._counts[key] = count
+        else:
+            del self._counts[key]
+            del self._table[key]
+        return key
+
+
+def _symbol_key(sym: Symbol) -> Hashable:
+    if sym.constant and not sym.name.isidentifier():
+        # literals are pooled by their representation
+        return ("literal", sym.name)
+    return ("symbol", sym.name, sym.object_id, sym.constant)
+
+
+def _thaw(node: Symbol | _Node) -> Symbol | Expr:
+    if isinstance(node, _Node):
+        return Expr(node.head, [_thaw(arg) for arg in node.args])
+    return node
+
+
+class CompactLines(MutableSequence[_Line]):
+    """
+    A list of macro lines that stores function calls as compact records.
+
+    Records are converted into new ``Expr`` objects each time they are
+    obtained, so a line modified in place has to be set back to update the
+    record, such as ``lines[i] = line``.
+    """
+
+    def __init__(
+        self, lines: Iterable[Symbol | Expr] = (), pool: LinePool | None = None
+    ):
+        self._pool = pool if pool is not None else LinePool()
+        self._items: list[Symbol | Expr | CompactCall] = [
+            self._pool.freeze(line) for line in lines
+        ]
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+    @property
+    def pool(self) -> LinePool:
+        """The pool of the interned objects."""
+        return self._pool
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._pool.thaw(item) for item in self._items[key]]
+        return self._pool.thaw(self._items[key])
+
+    def __setitem__(self, key, value):
+        pool = self._pool
+        if isinstance(key, slice):
+            old = self._items[key]
+            self._items[key] = [pool.freeze(line) for line in value]
+            for item in old:
+                pool.release(item)
+        else:
+            old = self._items[key]
+            self._items[key] = pool.freeze(value)
+            pool.release(old)
+
+    def __delitem__(self, key) -> None:
+        old = self._items[key]
+        del self._items[key]
+        for item in old if isinstance(key, slice) else [old]:
+            self._pool.release(item)
+
+    def __iter__(self) -> Iterator[Symbol | Expr]:
+        thaw = self._pool.thaw
+        return (thaw(item) for item in self._items)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (list, CompactLines)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def insert(self, index: int, value: Symbol | Expr) -> None:
+        self._items.insert(index, self._pool.freeze(value))
+
+    def copy(self) -> list[Symbol | Expr]:
+        return list(self)
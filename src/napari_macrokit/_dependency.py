@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from typing import Iterator
+
+from macrokit import Expr, Head, Symbol
+
+
+def assigned_names(line: Symbol | Expr) -> list[str]:
+    """Return the variable names assigned in the line."""
+    if not isinstance(line, Expr) or line.head is not Head.assign:
+        return []
+    target = line.args[0]
+    if isinstance(target, Symbol):
+        return [target.name]
+    if target.head is Head.tuple:
+        return [a.name for a in target.args if isinstance(a, Symbol)]
+    return []
+
+
+def referenced_names(line: Symbol | Expr) -> set[str]:
+    """Return the variable names that the line refers to."""
+    if isinstance(line, Expr) and line.head is Head.assign:
+        return set(_iter_names(line.args[1]))
+    return set(_iter_names(line))
+
+
+def _iter_names(expr: Symbol | Expr) -> Iterator[str]:
+    if isinstance(expr, Symbol):
+        if expr.name.isidentifier():
+            yield expr.name
+        return
+    if not isinstance(expr, Expr):
+        return
+    if expr.head is Head.kw:
+        # keyword name is not a reference
+        yield from _iter_names(expr.args[1])
+    elif expr.head is Head.getattr:
+        # attribute name is not a reference
+        yield from _iter_names(expr.args[0])
+    else:
+        for arg in expr.args:
+            yield from _iter_names(arg)
+
+
+def iter_dependencies(
+    lines: list[Symbol | Expr],
+) -> Iterator[tuple[set[int], list[str]]]:
+    """
+    Iterate over the upstream line indices and the assigned names of each line.
+
+    Only the lines that assign the referred names are regarded as upstream.
+    Names that are not assigned in the macro, such as ``viewer``, are treated
+    as external inputs.
+    """
+    producers: dict[str, int] = {}
+    for i, line in enumerate(lines):
+        upstream = {
+            producers[name]
+            for name in referenced_names(line)
+            if name in producers
+        }
+        assigned = assigned_names(line)
+        yield upstream, assigned
+        for name in assigned:
+            producers[name] = i
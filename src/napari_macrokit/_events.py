@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import json
+import queue
+import threading
+from pathlib import Path
+from typing import Any, NamedTuple, TextIO
+
+_SINKS: list[EventSink] = []
+
+
+class RecordEvent(NamedTuple):
+    """An event emitted when a function call is recorded."""
+
+    qualname: str
+    macro_name: str | None
+    arguments: tuple[str, ...]
+    output: str | None
+    output_type: str | None
+    started: float
+    duration: float
+    thread_id: int
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert the event into a JSON-serializable dict."""
+        out = self._asdict()
+        out["arguments"] = list(self.arguments)
+        return out
+
+
+class EventSink:
+    """
+    Base class of the sinks of recording events.
+
+    Events are put in a bounded queue without blocking and handled by
+    ``handle`` in a background thread. Events are dropped and counted in
+    ``dropped`` if the queue is full, so that recording is never slowed down
+    by a slow sink. Subclasses should override ``handle``.
+
+    Parameters
+    ----------
+    maxsize : int, default is 4096
+        Maximum number of events waiting in the queue.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self._queue: queue.Queue[RecordEvent | None] = queue.Queue(maxsize)
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        self.dropped = 0
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(dropped={self.dropped})"
+
+    def handle(self, event: RecordEvent) -> None:
+        """Handle an event in the background thread."""
+
+    def put(self, event: RecordEvent) -> None:
+        """Put an event in the queue without blocking."""
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """Block until all the queued events are handled."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Handle all the queued events and stop the background thread."""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _start(self) -> None:
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._drain, daemon=True)
+            self._thread.start()
+
+    def _drain(self) -> None:
+        while (event := self._queue.get()) is not None:
+            try:
+                self.handle(event)
+            except Exception:
+                # a broken sink must not affect recording
+                pass
+            self._queue.task_done()
+        self._queue.task_done()
+
+
+class JSONLinesSink(EventSink):
+    """
+    A sink that appends events to a file as JSON lines.
+
+    Parameters
+    ----------
+    path : path-like
+        Path to the output file.
+    maxsize : int, default is 4096
+        Maximum number of events waiting in the queue.
+    """
+
+    def __init__(self, path: str | Path, maxsize: int = 4096):
+        super().__init__(maxsize)
+        self._path = Path(path)
+        self._file: TextIO | None = None
+
+    @property
+    def path(self) -> Path:
+        """Path to the output file."""
+        return self._path
+
+    def handle(self, event: RecordEvent) -> None:
+        if self._file is None:
+            self._file = open(self._path, mode="a")
+        self._file.write(json.dumps(event.to_dict()) + "\n")
+        if self._queue.empty():
+            self._file.flush()
+
+    def close(self) -> None:
+        super().close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def add_event_sink(sink: EventSink) -> EventSink:
+    """Start sending the recording events to the sink."""
+    if sink not in _SINKS:
+        _SINKS.append(sink)
+    return sink
+
+
+def remove_event_sink(sink: EventSink) -> None:
+    """Stop sending the recording events to the sink and close it."""
+    if sink in _SINKS:
+        _SINKS.remove(sink)
+    sink.close()
+
+
+def has_event_sinks() -> bool:
+    return len(_SINKS) > 0
+
+
+def emit(event: RecordEvent) -> None:
+    """Send an event to all the sinks."""
+    for sink in list(_SINKS):
+        sink.put(event)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import ast
+import asyncio
+import inspect
+from typing import TYPE_CHECKING, Any, Iterable
+
+from macrokit import Expr, Symbol
+from macrokit.expression import _STORED_VALUES
+
+from napari_macrokit._dependency import assigned_names
+
+if TYPE_CHECKING:  # pragma: no cover
+    from napari_macrokit._checkpoint import Checkpoint
+
+
+def prepare_lines(
+    lines: Iterable[Symbol | Expr], namespace: dict[str, Any] | None = None
+) -> tuple[list[Symbol | Expr], dict[str, Any]]:
+    """
+    Prepare lines and the global namespace for execution.
+
+    Stored objects such as recorded functions are renamed to unique variables
+    and added to the namespace, in the same way as ``Expr.eval``.
+    """
+    _glb: dict[str, Any] = {}
+    if namespace is not None:
+        _glb.update({str(k): v for k, v in namespace.items()})
+    format_dict: dict[Symbol, Symbol] = {}
+    for id_, (sym, obj) in list(_STORED_VALUES.items()):
+        if isinstance(sym, Expr):
+            continue
+        vstr = Symbol.symbol_str_for_id(id_)
+        format_dict[sym] = Symbol(vstr)
+        _glb[vstr] = obj
+    out: list[Symbol | Expr] = []
+    for line in lines:
+        if isinstance(line, Expr):
+            out.append(line.format(format_dict))
+        else:
+            out.append(format_dict.get(line, line))
+    return out, _glb
+
+
+class EventLoop:
+    """An event loop created on the first awaitable line and shared."""
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def run(self, coro) -> Any:
+        """Run a coroutine until it completes."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def close(self) -> None:
+        """Close the event loop if created."""
+        if self._loop is None:
+            return
+        try:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        finally:
+            self._loop.close()
+            self._loop = None
+
+
+def execute_line(
+    line: Symbol | Expr,
+    _globals: dict[str, Any],
+    loop: EventLoop | None = None,
+) -> None:
+    """
+    Execute a prepared line in the given namespace.
+
+    Awaitable lines are run in ``loop``, or in a new event loop if not given.
+    """
+    code = compile(
+        str(line), "<macro>", "exec", flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    )
+    if code.co_flags & inspect.CO_COROUTINE:
+        # lines recorded from async functions, such as "x = await f()"
+        if loop is None:
+            asyncio.run(eval(code, _globals))
+        else:
+            loop.run(eval(code, _globals))
+    else:
+        exec(code, _globals)
+
+
+def execute(
+    lines: Iterable[Symbol | Expr],
+    namespace: dict[str, Any] | None = None,
+    checkpoint: Checkpoint | None = None,
+) -> dict[str, Any]:
+    """Execute lines and return the assigned variables."""
+    lines = list(lines)
+    prepared, _glb = prepare_lines(lines, namespace)
+    loop = EventLoop()
+    try:
+        if checkpoint is None:
+            for line in prepared:
+                execute_line(line, _glb, loop)
+        else:
+            checkpoint.execute(lines, prepared, _glb, loop)
+    finally:
+        loop.close()
+    return {
+        name: _glb[name]
+        for line in lines
+        for name in assigned_names(line)
+        if name in _glb
+    }
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+from typing import Iterable, Sequence
+
+from macrokit import Expr, Head, Symbol
+from macrokit.expression import _STORED_VALUES
+
+from napari_macrokit._dependency import assigned_names, referenced_names
+
+_IN = Symbol.var("in")
+_DEFAULT_LOOP_VAR = "_x"
+
+
+def fold_loops(
+    lines: Sequence[Symbol | Expr], min_repeat: int = 3
+) -> list[Symbol | Expr]:
+    """
+    Fold repetitive lines into for-loops.
+
+    Consecutive calls without output that differ only in one literal, such as
+    a layer name, an index or a scalar argument, are folded into a for-loop
+    over a list of the literals. Assign lines are not folded, as the outputs
+    would be overwritten in the loop.
+
+    >>> f(viewer.layers['a'])
+    >>> f(viewer.layers['b'])
+    >>> f(viewer.layers['c'])
+
+    will be folded into
+
+    >>> for _x in ['a', 'b', 'c']:
+    ...     f(viewer.layers[_x])
+    """
+    if min_repeat < 2:
+        raise ValueError(f"min_repeat must be >= 2, got {min_repeat}.")
+    reserved = _reserved_names(lines)
+    out: list[Symbol | Expr] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        j = i + 1
+        path = None
+        if _is_foldable(line):
+            while j < len(lines):
+                p = _single_literal_diff(line, lines[j])
+                if p is None or (path is not None and p != path):
+                    break
+                path = p
+                j += 1
+        if path is not None and j - i >= min_repeat:
+            out.append(_make_loop(lines[i:j], path, reserved))
+        else:
+            out.extend(lines[i:j])
+        i = j
+    return out
+
+
+def fold_with_tail(
+    tail: Sequence[Symbol | Expr],
+    new: Symbol | Expr,
+    min_repeat: int = 3,
+    lines: Iterable[Symbol | Expr] = (),
+) -> tuple[int, Expr] | None:
+    """
+    Try to fold a new line with the last lines.
+
+    Returns the number of the last lines to be replaced and the folded loop,
+    or None if the new line cannot be folded. ``lines`` are all the lines of
+    the macro, whose names are not used as the loop variable.
+    """
+    if not _is_foldable(new) or len(tail) == 0:
+        return None
+    last = tail[-1]
+    if _is_folded_loop(last):
+        cond, block = last.args
+        loopvar, values = cond.args[1], cond.args[2]
+        body = block.args[0]
+        path = _single_literal_diff(body, new, loopvar)
+        if path is not None and _is_symbol_named(
+            _get_at(body, path), loopvar.name
+        ):
+            literal = _get_at(new, path)
+            new_values = Expr(Head.list, values.args + [literal])
+            new_cond = Expr(Head.binop, [_IN, loopvar, new_values])
+            return 1, Expr(Head.for_, [new_cond, block])
+    if len(tail) < min_repeat - 1:
+        return None
+    candidates = list(tail[-(min_repeat - 1) :]) + [new]
+    path = None
+    for line in candidates[1:]:
+        p = _single_literal_diff(candidates[0], line)
+        if p is None or (path is not None and p != path):
+            return None
+        path = p
+    reserved = _reserved_names([*lines, *tail, new])
+    return min_repeat - 1, _make_loop(candidates, path, reserved)
+
+
+def _reserved_names(lines: Iterable[Symbol | Expr]) -> set[str]:
+    """Names that a loop variable must not shadow."""
+    reserved = {
+        name
+        for line in lines
+        for name in (*referenced_names(line), *assigned_names(line))
+    }
+    # stored objects are added to the namespace on execution
+    reserved.update(Symbol.symbol_str_for_id(id_) for id_ in _STORED_VALUES)
+    return reserved
+
+
+def _is_foldable(line: Symbol | Expr) -> bool:
+    return isinstance(line, Expr) and line.head is Head.call
+
+
+def _is_folded_loop(line: Symbol | Expr) -> bool:
+    if not isinstance(line, Expr) or line.head is not Head.for_:
+        return False
+    cond, block = line.args
+    return (
+        isinstance(cond, Expr)
+        and cond.head is Head.binop
+        and cond.args[0] == _IN
+        and isinstance(cond.args[1], Symbol)
+        and isinstance(cond.args[2], Expr)
+        and cond.args[2].head is Head.list
+        and len(block.args) == 1
+        and _is_foldable(block.args[0])
+    )
+
+
+def _is_literal(sym: Symbol | Expr) -> bool:
+    if not isinstance(sym, Symbol):
+        return False
+    name = sym.name
+    return not name.isidentifier() or name in ("True", "False", "None")
+
+
+def _diff(
+    a: Symbol | Expr, b: Symbol | Expr, path: tuple[int, ...] = ()
+) -> list[tuple[int, ...]] | None:
+    """Return paths to the different symbols, or None if not comparable."""
+    if isinstance(a, Expr) and isinstance(b, Expr):
+        if a.head is not b.head or len(a.args) != len(b.args):
+            return None
+        out = []
+        for i, (x, y) in enumerate(zip(a.args, b.args)):
+            d = _diff(x, y, path + (i,))
+            if d is None:
+                return None
+            out.extend(d)
+        return out
+    if isinstance(a, Symbol) and isinstance(b, Symbol):
+        # compare names because same literals may have different IDs
+        return [] if a.name == b.name else [path]
+    return None
+
+
+def _single_literal_diff(
+    a: Symbol | Expr, b: Symbol | Expr, placeholder: Symbol | None = None
+) -> tuple[int, ...] | None:
+    """Return the path if a and b differ only in one literal."""
+    diff = _diff(a, b)
+    if diff is None or len(diff) != 1:
+        return None
+    path = diff[0]
+    x, y = _get_at(a, path), _get_at(b, path)
+    if placeholder is not None:
+        ok = _is_symbol_named(x, placeholder.name)
+    else:
+        ok = _is_literal(x)
+    if ok and _is_literal(y):
+        return path
+    return None
+
+
+def _is_symbol_named(sym: Symbol | Expr, name: str) -> bool:
+    return isinstance(sym, Symbol) and sym.name == name
+
+
+def _get_at(expr: Symbol | Expr, path: tuple[int, ...]) -> Symbol | Expr:
+    for i in path:
+        expr = expr.args[i]
+    return expr
+
+
+def _replace_at(
+    expr: Symbol | Expr, path: tuple[int, ...], new: Symbol | Expr
+) -> Symbol | Expr:
+    if len(path) == 0:
+        return new
+    i, *rest = path
+    args = list(expr.args)
+    args[i] = _replace_at(args[i], tuple(rest), new)
+    return Expr(expr.head, args)
+
+
+def _loop_var_name(
+    template: Expr, path: tuple[int, ...], reserved: set[str]
+) -> str:
+    parent = _get_at(template, path[:-1])
+    if isinstance(parent, Expr) and parent.head is Head.kw:
+        name = parent.args[0].name
+        if name not in reserved:
+            return name
+    name = _DEFAULT_LOOP_VAR
+    i = 0
+    while name in reserved:
+        name = f"{_DEFAULT_LOOP_VAR}{i}"
+        i += 1
+    return name
+
+
+def _make_loop(
+    lines: Sequence[Expr], path: tuple[int, ...], reserved: set[str]
+) -> Expr:
+    template = lines[0]
+    loopvar = Symbol.var(_loop_var_name(template, path, reserved))
+    values = Expr(Head.list, [_get_at(line, path) for line in lines])
+    body = _replace_at(template, path, loopvar)
+    cond = Expr(Head.binop, [_IN, loopvar, values])
+    return Expr(Head.for_, [cond, Expr(Head.block, [body])])
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import importlib
+import inspect
+import sys
+import textwrap
+from functools import lru_cache
+from types import CodeType
+from typing import Any, Callable, Iterable, Mapping, NamedTuple
+
+from macrokit import Expr, Head, Symbol, parse
+
+from napari_macrokit._dependency import assigned_names, referenced_names
+from napari_macrokit._execution import prepare_lines
+from napari_macrokit._index import _layer_name
+
+
+class MacroFunction:
+    """
+    A Python function compiled from macro lines.
+
+    The source is compiled once into a cached code object, and the function
+    is picklable if the objects it refers to, such as the recorded functions,
+    are picklable. It can be submitted to ``concurrent.futures`` executors or
+    wrapped by ``dask.delayed``.
+
+    >>> func = macro.to_function(inputs=["arr0"], outputs=["arr2"])
+    >>> print(func.source)
+    >>> func(np.zeros((10, 10)))
+    """
+
+    def __init__(self, source: str, name: str, namespace: dict[str, Any]):
+        self._source = source
+        self._name = name
+        self._namespace = namespace
+        self._func: Callable | None = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self._name}{self.__signature__}>"
+
+    def __call__(self, *args, **kwargs):
+        if (func := self._func) is None:
+            func = self._func = self._build()
+        return func(*args, **kwargs)
+
+    def __reduce__(self):
+        # the compiled function is rebuilt from the source after unpickling
+        namespace = {k: _by_reference(v) for k, v in self._namespace.items()}
+        return self.__class__, (self._source, self._name, namespace)
+
+    @property
+    def __name__(self) -> str:
+        return self._name
+
+    @property
+    def __signature__(self) -> inspect.Signature:
+        if self._func is None:
+            self._func = self._build()
+        return inspect.signature(self._func)
+
+    @property
+    def source(self) -> str:
+        """Source code of the function."""
+        return self._source
+
+    def _build(self) -> Callable:
+        _glb = {
+            k: v.resolve() if isinstance(v, _GlobalRef) else v
+            for k, v in self._namespace.items()
+        }
+        exec(_compile(self._source), _glb)
+        return _glb[self._name]
+
+
+class _GlobalRef(NamedTuple):
+    """
+    Reference to a function that is only importable through its wrapper.
+
+    A module-level function decorated with ``@macro.record`` cannot be
+    pickled by reference, because the module attribute is the wrapper.
+    """
+
+    module: str
+    qualname: str
+
+    def resolve(self) -> Callable:
+        """Import the wrapper and return the recorded function."""
+        obj: Any = importlib.import_module(self.module)
+        for attr in self.qualname.split("."):
+            obj = getattr(obj, attr)
+        return _unwrap_recorded(obj)
+
+
+def _unwrap_recorded(obj: Any) -> Any:
+    # the wrapped function is called so that the lines are not recorded
+    while getattr(obj, "_macro", None) is not None and hasattr(
+        obj, "__wrapped__"
+    ):
+        obj = obj.__wrapped__
+    return obj
+
+
+def _by_reference(obj: Any) -> Any:
+    """Convert a recorded function into a reference to its wrapper."""
+    module = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    if not (
+        isinstance(module, str)
+        and isinstance(qualname, str)
+        and "<locals>" not in qualname
+        and module in sys.modules
+    ):
+        return obj
+    target: Any = sys.modules[module]
+    for attr in qualname.split("."):
+        if (target := getattr(target, attr, None)) is None:
+            return obj
+    if target is not obj and _unwrap_recorded(target) is obj:
+        return _GlobalRef(module, qualname)
+    return obj
+
+
+@lru_cache(maxsize=256)
+def _compile(source: str) -> CodeType:
+    return compile(source, "<macro function>", "exec")
+
+
+def make_function(
+    lines: Iterable[Symbol | Expr],
+    inputs: Iterable[Any] | Mapping[str, Any],
+    outputs: Iterable[Any] | None,
+    namespace: Mapping[str, Any] | None = None,
+    name: str = "macro_function",
+    as_text: Callable[[Any], str] = str,
+) -> MacroFunction:
+    """
+    Make a function from macro lines.
+
+    ``as_text`` converts the inputs and the outputs into their text in the
+    macro, such as ``"arr0"`` or ``"viewer.layers['image']"``.
+    """
+    if not name.isidentifier():
+        raise ValueError(f"Function name must be an identifier, got {name!r}")
+    if isinstance(inputs, Mapping):
+        params = {as_text(v): k for k, v in inputs.items()}
+    else:
+        params = {}
+        for inp in inputs:
+            text = as_text(inp)
+            params[text] = _param_name(text)
+    for param in params.values():
+        if not param.isidentifier():
+            raise ValueError(f"Invalid parameter name {param!r}.")
+    if len(set(params.values())) < len(params):
+        raise ValueError(
+            f"Duplicated parameter names: {list(params.values())}"
+        )
+
+    lines = [_substitute(line, params) for line in lines]
+    if outputs is None:
+        outputs = next(
+            (
+                names
+                for line in reversed(lines)
+                if (names := assigned_names(line))
+            ),
+            [],
+        )
+    else:
+        outputs = [as_text(out) for out in outputs]
+    lines = _prune(lines, set(params.values()), outputs)
+
+    prepared, _glb = prepare_lines(lines)
+    used: set[str] = set()
+    for line in prepared:
+        used.update(referenced_names(line))
+    _ns = {k: v for k, v in _glb.items() if k in used}
+    if namespace is not None:
+        _ns.update({str(k): v for k, v in namespace.items()})
+
+    body = [textwrap.indent(str(line), "    ") for line in prepared]
+    if len(outputs) == 1:
+        body.append(f"    return {outputs[0]}")
+    elif outputs:
+        body.append(f"    return {', '.join(outputs)}")
+    if not body:
+        body.append("    return None")
+    source = "\n".join([f"def {name}({', '.join(params.values())}):", *body])
+    return MacroFunction(source + "\n", name, _ns)
+
+
+def _param_name(text: str) -> str:
+    """Parameter name of an input given as a text in the macro."""
+    if text.isidentifier():
+        return text
+    try:
+        expr = parse(text)
+    except SyntaxError:
+        expr = None
+    if (
+        isinstance(expr, Expr)
+        and expr.head is Head.getitem
+        and (name := _layer_name(expr))
+    ):
+        if name.isidentifier():
+            return name
+    raise ValueError(
+        f"Cannot make a parameter name for {text!r}. Give the inputs as a "
+        "dict of parameter names."
+    )
+
+
+def _substitute(line: Symbol | Expr, params: dict[str, str]) -> Symbol | Expr:
+    """Replace the symbols or expressions with the parameters."""
+    if (param := params.get(str(line))) is not None:
+        return Symbol(param)
+    if isinstance(line, Expr):
+        return Expr(line.head, [_substitute(arg, params) for arg in line.args])
+    return line
+
+
+def _prune(
+    lines: list[Symbol | Expr], params: set[str], outputs: list[str]
+) -> list[Symbol | Expr]:
+    """
+    Remove the lines that assign the parameters or are not needed.
+
+    Lines that do not assign any variable, such as ``viewer.add_image(...)``,
+    are kept for their side effects.
+    """
+    needed = set(outputs)
+    out: list[Symbol | Expr] = []
+    for line in reversed(lines):
+        names = assigned_names(line)
+        if names and (params.issuperset(names) or needed.isdisjoint(names)):
+            continue
+        needed.difference_update(names)
+        needed.update(referenced_names(line))
+        out.append(line)
+    out.reverse()
+    return out
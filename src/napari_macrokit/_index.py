@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import ast
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from macrokit import Expr, Head, Symbol, symbol
+
+from napari_macrokit._dependency import assigned_names, referenced_names
+
+if TYPE_CHECKING:  # pragma: no cover
+    from napari_macrokit._macrokit_ext import NapariMacro
+
+# heads of the lines that may span several lines in the text
+_COMPOUND_HEADS = frozenset(
+    [
+        Head.block,
+        Head.for_,
+        Head.while_,
+        Head.if_,
+        Head.function,
+        Head.decorator,
+        Head.class_,
+        Head.with_,
+        Head.try_,
+        Head.match,
+    ]
+)
+
+
+class MacroIndex:
+    """
+    Indexes of the lines of a macro for queries.
+
+    Lines are indexed lazily when a query is made, and the indexes are updated
+    incrementally as lines are appended and popped. Other modifications, such
+    as inserting lines, invalidate the indexes and they are rebuilt by the
+    next query. Lines modified in place are not tracked; call ``reset`` after
+    such modifications.
+
+    >>> macro.query.calls("threshold")  # indices of the lines
+    >>> macro.query.definition("labels3")
+    >>> macro.query.usages("labels3")
+    >>> macro.query.layer("image")
+    """
+
+    def __init__(self, macro: NapariMacro):
+        self._macro = macro
+        self._nindexed = 0
+        self._calls: dict[str, list[int]] = {}
+        self._definitions: dict[str, list[int]] = {}
+        self._usages: dict[str, list[int]] = {}
+        self._layers: dict[str, list[int]] = {}
+        # (line index, number of extra text lines) of multi-line lines
+        self._extra_lines: list[tuple[int, int]] = []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(nlines={self._nindexed})"
+
+    def calls(self, func: str | Callable) -> list[int]:
+        """Return the indices of the lines calling the function."""
+        name = func if isinstance(func, str) else str(symbol(func))
+        return list(self._get(self._calls, name))
+
+    def definition(self, name: str | Symbol) -> int | None:
+        """Return the index of the last line that assigns the name."""
+        found = self._get(self._definitions, str(name))
+        return found[-1] if found else None
+
+    def definitions(self, name: str | Symbol) -> list[int]:
+        """Return the indices of all the lines that assign the name."""
+        return list(self._get(self._definitions, str(name)))
+
+    def usages(self, name: str | Symbol) -> list[int]:
+        """Return the indices of the lines that refer to the name."""
+        return list(self._get(self._usages, str(name)))
+
+    def layer(self, name: str) -> list[int]:
+        """Return the indices of the lines using ``viewer.layers[name]``."""
+        return list(self._get(self._layers, name))
+
+    def text_line(self, index: int) -> int:
+        """Return the line number in the text of the ``index``-th line."""
+        self.update()
+        pos = bisect_left(self._extra_lines, (index, 0))
+        return index + sum(n for _, n in self._extra_lines[:pos])
+
+    def line_of_text(self, lineno: int) -> int:
+        """Return the index of the line at the line number in the text."""
+        self.update()
+        offset = 0
+        for i, n in self._extra_lines:
+            start = i + offset
+            if lineno <= start:
+                break
+            if lineno <= start + n:
+                return i
+            offset += n
+        return lineno - offset
+
+    def reset(self) -> None:
+        """Clear the indexes, which will be rebuilt by the next query."""
+        self._nindexed = 0
+        self._calls.clear()
+        self._definitions.clear()
+        self._usages.clear()
+        self._layers.clear()
+        self._extra_lines.clear()
+
+    def update(self) -> None:
+        """Index the lines that are not indexed yet."""
+        macro = self._macro
+        with macro._lock:
+            start, nlines = self._nindexed, len(macro)
+            if start == nlines:
+                return None
+            # slicing does not convert compact records into expressions in
+            # place
+            for i, line in enumerate(macro._args[start:nlines], start):
+                self._add(i, line)
+            self._nindexed = nlines
+
+    def _get(self, table: dict[str, list[int]], key: str) -> list[int]:
+        self.update()
+        return table.get(key, [])
+
+    def _add(self, index: int, line: Symbol | Expr) -> None:
+        for table, keys in zip(self._tables(), _line_keys(line)):
+            for key in keys:
+                table.setdefault(key, []).append(index)
+        if isinstance(line, Expr) and line.head in _COMPOUND_HEADS:
+            if extra := str(line).count("\n"):
+                self._extra_lines.append((index, extra))
+
+    def _tables(self) -> tuple[dict[str, list[int]], ...]:
+        return self._calls, self._definitions, self._usages, self._layers
+
+    def _on_popped(self, index: int, line: Symbol | Expr) -> None:
+        if index >= self._nindexed:
+            return
+        if index < self._nindexed - 1:
+            return self.reset()
+        for table, keys in zip(self._tables(), _line_keys(line)):
+            for key in keys:
+                indices = table[key]
+                indices.pop()
+                if not indices:
+                    del table[key]
+        if self._extra_lines and self._extra_lines[-1][0] == index:
+            self._extra_lines.pop()
+        self._nindexed -= 1
+
+    def _on_deleted(self, start: int, stop: int) -> None:
+        if start >= self._nindexed:
+            return
+        if stop < self._nindexed:
+            return self.reset()
+        # the indices are sorted, so the tail can be truncated
+        for table in self._tables():
+            for key in list(table):
+                indices = table[key]
+                del indices[bisect_left(indices, start) :]
+                if not indices:
+                    del table[key]
+        del self._extra_lines[bisect_left(self._extra_lines, (start, 0)) :]
+        self._nindexed = start
+
+
+def _line_keys(
+    line: Symbol | Expr,
+) -> tuple[set[str], list[str], set[str], set[str]]:
+    """Return the callees, assigned names, used names and layer names."""
+    calls: set[str] = set()
+    layers: set[str] = set()
+    for expr in _iter_exprs(line):
+        if expr.head is Head.call:
+            calls.add(str(expr.args[0]))
+        elif expr.head is Head.getitem and (name := _layer_name(expr)):
+            layers.add(name)
+    return calls, assigned_names(line), referenced_names(line), layers
+
+
+def _iter_exprs(expr: Symbol | Expr) -> Iterator[Expr]:
+    if isinstance(expr, Expr):
+        yield expr
+        for arg in expr.args:
+            yield from _iter_exprs(arg)
+
+
+def _layer_name(expr: Expr) -> str | None:
+    """Return "a" if the expression is ``viewer.layers['a']``."""
+    target, key = expr.args
+    if not (
+        isinstance(target, Expr)
+        and target.head is Head.getattr
+        and isinstance(key, Symbol)
+        and str(target.args[1]) == "layers"
+    ):
+        return None
+    try:
+        name = ast.literal_eval(key.name)
+    except (ValueError, SyntaxError):
+        return None
+    return name if isinstance(name, str) else None
@@ -1,9 +1,29 @@
 from __future__ import annotations
 
 import inspect
+import threading
+import time
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from contextlib import contextmanager
-from functools import wraps
-from typing import Any, Callable, Literal, Sequence, TypeVar, Union, overload
+from contextvars import ContextVar
+from functools import partial, wraps
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    Literal,
+    Mapping,
+    Sequence,
+    TypeVar,
+    Union,
+    overload,
+)
 
 from macrokit import (
     BaseMacro,
@@ -16,10 +36,28 @@ from macrokit import (
 )
 from magicgui.widgets import FunctionGui
 
-from napari_macrokit._literals import get_id_safe_class
+from napari_macrokit._events import RecordEvent, emit, has_event_sinks
+from napari_macrokit._index import MacroIndex
+from napari_macrokit._process import call_in_process
 from napari_macrokit._rename import SymbolGenerator
+from napari_macrokit._scalars import ScalarOutputs, is_scalar
+from napari_macrokit._streaming import iter_blocked
+from napari_macrokit._threading import OrderedCommitter
 from napari_macrokit._type_resolution import resolve_single_type
 
+if TYPE_CHECKING:  # pragma: no cover
+    import napari
+    from napari.layers import Image
+
+    from napari_macrokit._checkpoint import Checkpoint
+    from napari_macrokit._function import MacroFunction
+    from napari_macrokit._output_store import OutputStore
+    from napari_macrokit._parallel import ParallelExecutor
+    from napari_macrokit._provenance import ProvenanceStore
+    from napari_macrokit._result_cache import ResultCache
+    from napari_macrokit._sidecar import SidecarStore
+    from napari_macrokit._sweep import SweepResult
+
 _NEW_TYPES: dict[type, Callable[[Any], str]] = {}
 _F = TypeVar("_F", bound=Callable)
 _F1 = TypeVar("_F1", bound=Callable[[Any], str])
@@ -28,6 +66,22 @@ _Symbolizer = Callable[[Any], Union[Symbol, Expr]]
 
 SymbolGen = SymbolGenerator()
 
+_AWAIT = Symbol._reserved("await ")
+
+# IDs of the macros whose recording is blocked in the current context
+_BLOCKED: ContextVar[frozenset[int]] = ContextVar(
+    "_BLOCKED", default=frozenset()
+)
+
+# symbol generator used to symbolize arguments of the ongoing function call
+_CURRENT_GENERATOR: ContextVar[SymbolGenerator] = ContextVar(
+    "_CURRENT_GENERATOR", default=SymbolGen
+)
+# sidecar store of large literals used by the ongoing function call
+_CURRENT_SIDECAR: ContextVar[SidecarStore | None] = ContextVar(
+    "_CURRENT_SIDECAR", default=None
+)
+
 
 @overload
 def register_new_type(tp: Callable, function: _F1) -> _F1:
@@ -50,11 +104,39 @@ def register_new_type(tp, function=None):
 
 
 class NapariMacro(BaseMacro):
-    def __init__(self):
+    def __init__(
+        self,
+        args: Iterable[Expr] = (),
+        *,
+        symbol_generator: SymbolGenerator | None = None,
+        compact: bool = False,
+    ):
         import datetime
 
-        super().__init__()
+        super().__init__(args)
+        if compact:
+            from napari_macrokit._compact import CompactLines
+
+            # store function calls as compact records to save memory
+            self._args = CompactLines(self._args)
+        if symbol_generator is None:
+            symbol_generator = SymbolGen
+        self._symbol_generator = symbol_generator
+        self._scalars = ScalarOutputs()
+        symbol_generator.add_scalar_table(self._scalars)
         self._created_time = datetime.datetime.now()
+        self._lock = threading.RLock()
+        self._committer = OrderedCommitter()
+        self._last_output: tuple[Symbol, type] | None = None
+        self._output_store: OutputStore | None = None
+        self._auto_fold: int | None = None
+        self._stream_to_layer: Callable[..., Image] | None = None
+        self._name: str | None = None
+        self._sidecar: SidecarStore | None = None
+        self._provenance: ProvenanceStore | None = None
+        self._on_deleted: list[Callable[[int, list[Symbol | Expr]], Any]] = []
+        self._on_deleting: list[Callable[[int, int], Any]] = []
+        self._index = MacroIndex(self)
 
     def __repr__(self) -> str:
         out = []
@@ -67,17 +149,538 @@ class NapariMacro(BaseMacro):
                 out.append(f">>> {line}")
         return "\n".join(out)
 
+    @property
+    def is_compact(self) -> bool:
+        """True if lines are stored as compact records."""
+        from napari_macrokit._compact import CompactLines
+
+        return isinstance(self._args, CompactLines)
+
+    @property
+    def name(self) -> str | None:
+        """Name of the macro if created by `get_macro`."""
+        return self._name
+
+    @property
+    def symbol_generator(self) -> SymbolGenerator:
+        """The symbol generator (namespace) used by this macro."""
+        return self._symbol_generator
+
+    def append(self, expr: Symbol | Expr | str):
+        with self._lock:
+            if self._auto_fold is not None and isinstance(expr, Expr):
+                from napari_macrokit._folding import fold_with_tail
+
+                tail = self._args[-(self._auto_fold - 1) :]
+                folded = fold_with_tail(
+                    tail, expr, self._auto_fold, lines=self._args
+                )
+                if folded:
+                    nlines, expr = folded
+                    for _ in range(nlines):
+                        self.pop()
+            return super().append(expr)
+
+    def pop(self, index: int = -1) -> Symbol | Expr:
+        with self._lock:
+            index = range(len(self._args))[index]
+            for cb in self._on_deleting:
+                cb(index, index + 1)
+            return super().pop(index)
+
+    def insert(self, key: int, expr: Symbol | Expr | str):
+        with self._lock:
+            nlines = len(self._args)
+            super().insert(key, expr)
+            # "append" also inserts the line by this method. Lines appended
+            # at the end are indexed by the next query.
+            if key < nlines:
+                self._index.reset()
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self._index.reset()
+
+    def __delitem__(self, key: int | slice) -> None:
+        # "pop" also deletes the line by this method
+        with self._lock:
+            if isinstance(key, slice):
+                indices = range(len(self._args))[key]
+                super().__delitem__(key)
+                if indices.step == 1 and len(indices) > 0:
+                    self._index._on_deleted(indices.start, indices.stop)
+                elif len(indices) > 0:
+                    self._index.reset()
+            else:
+                index = range(len(self._args))[key]
+                line = self._args[index]
+                super().__delitem__(index)
+                self._index._on_popped(index, line)
+
+    @property
+    def query(self) -> MacroIndex:
+        """
+        Query lines using the indexes, which return the line indices.
+
+        >>> macro.query.calls("threshold")  # lines calling threshold
+        >>> macro.query.definition("labels3")  # line that assigns labels3
+        >>> macro.query.usages("labels3")  # lines that refer to labels3
+        >>> macro.query.layer("image")  # lines using viewer.layers["image"]
+        """
+        return self._index
+
+    @property
+    def on_deleted(self) -> list[Callable[[int, list[Symbol | Expr]], Any]]:
+        """
+        Callback functions when lines are deleted at once.
+
+        Callbacks are called with the index of the first deleted line and the
+        list of the deleted lines, after the lines are removed.
+        """
+        return self._on_deleted
+
+    @property
+    def on_deleting(self) -> list[Callable[[int, int], Any]]:
+        """
+        Callback functions before lines are removed by ``pop`` or ``delete``.
+
+        Callbacks are called with the start and the stop indices of the lines
+        to be removed, such as for ``QAbstractItemModel.beginRemoveRows``.
+        """
+        return self._on_deleting
+
+    def delete(self, key: int | slice) -> list[Symbol | Expr]:
+        """
+        Delete contiguous lines and return them.
+
+        Unlike calling ``pop`` repeatedly, ``on_deleted`` callbacks are called
+        only once and the output symbols of the deleted lines are released
+        from the symbol generator at once. Note that ``on_popped`` callbacks
+        are not called.
+        """
+        with self._lock:
+            if isinstance(key, slice):
+                indices = range(len(self._args))[key]
+            else:
+                index = range(len(self._args))[key]
+                indices = range(index, index + 1)
+            if len(indices) == 0:
+                return []
+            if len(indices) > 1 and indices.step != 1:
+                raise ValueError("Only contiguous lines can be deleted.")
+            start, stop = indices[0], indices[-1] + 1
+            deleted = list(self._args[start:stop])
+            for cb in self._on_deleting:
+                cb(start, stop)
+            del self._args[start:stop]
+            self._index._on_deleted(start, stop)
+            self._release_outputs(deleted, self._args[start:])
+            for cb in self._on_deleted:
+                cb(start, deleted)
+            return deleted
+
+    def truncate(self, n: int) -> list[Symbol | Expr]:
+        """
+        Keep the first ``n`` lines and delete the rest.
+
+        Negative ``n`` counts from the end, so ``truncate(-50)`` deletes the
+        last 50 lines.
+        """
+        return self.delete(slice(n, None))
+
+    def clear(self) -> None:
+        """Delete all the lines."""
+        self.delete(slice(None))
+
+    def _release_outputs(
+        self, deleted: list[Symbol | Expr], rest: Sequence[Symbol | Expr]
+    ) -> None:
+        self._last_output = None
+        outputs = [
+            line.args[0]
+            for line in deleted
+            if isinstance(line, Expr)
+            and line.head is Head.assign
+            and isinstance(line.args[0], Symbol)
+        ]
+        if not outputs:
+            return
+        if len(rest) > 0:
+            # symbols still referenced by the remaining lines are kept
+            used: set[Symbol] = set()
+            for line in rest:
+                if isinstance(line, Expr):
+                    used.update(line.iter_args())
+            outputs = [sym for sym in outputs if sym not in used]
+        self._symbol_generator.discard_symbols(outputs)
+        self._scalars.discard(outputs)
+        if self._output_store is not None:
+            for sym in outputs:
+                self._output_store.discard(sym.name)
+
+    def _remove_lines(self, lines: Iterable[Symbol | Expr]) -> None:
+        """Remove the lines forwarded from another macro."""
+        with self._lock:
+            lines = list(lines)
+            positions = {id(line): i for i, line in enumerate(self._args)}
+            indices: set[int] = set()
+            for line in lines:
+                i = positions.get(id(line))
+                if i is None:
+                    # lines of compact macros are not identical
+                    i = next(
+                        (
+                            j
+                            for j in reversed(range(len(self._args)))
+                            if j not in indices and self._args[j] == line
+                        ),
+                        None,
+                    )
+                if i is not None:
+                    indices.add(i)
+            # delete contiguous runs from the end, so that a single event is
+            # emitted if the lines are not interleaved with others.
+            runs: list[list[int]] = []
+            for i in sorted(indices):
+                if runs and runs[-1][-1] == i - 1:
+                    runs[-1].append(i)
+                else:
+                    runs.append([i])
+            for run in reversed(runs):
+                start, stop = run[0], run[-1] + 1
+                deleted = list(self._args[start:stop])
+                for cb in self._on_deleting:
+                    cb(start, stop)
+                del self._args[start:stop]
+                self._index._on_deleted(start, stop)
+                self._last_output = None
+                for cb in self._on_deleted:
+                    cb(start, deleted)
+
+    @contextmanager
+    def blocked(self):
+        """
+        Block macro recording within this context.
+
+        Blocking is local to the current thread or asyncio task.
+        """
+        token = _BLOCKED.set(_BLOCKED.get() | {id(self)})
+        try:
+            yield
+        finally:
+            _BLOCKED.reset(token)
+
+    def _is_blocked(self) -> bool:
+        return id(self) in _BLOCKED.get()
+
+    def fold_loops(self, min_repeat: int = 3) -> NapariMacro:
+        """
+        Return a new macro with repetitive lines folded into for-loops.
+
+        Consecutive calls that differ only in one literal, such as a layer
+        name, an index or a scalar argument, are folded into a for-loop over
+        a list of the literals, if repeated at least ``min_repeat`` times.
+        Assign lines are not folded, as the outputs would be overwritten in
+        the loop.
+        """
+        from napari_macrokit._folding import fold_loops
+
+        return self.__class__(
+            fold_loops(self._args, min_repeat),
+            symbol_generator=self._symbol_generator,
+            compact=self.is_compact,
+        )
+
+    def set_auto_fold(self, min_repeat: int | None = 3) -> None:
+        """
+        Fold repetitive lines into for-loops as they are appended.
+
+        Set ``None`` to disable folding.
+        """
+        if min_repeat is not None and min_repeat < 2:
+            raise ValueError(f"min_repeat must be >= 2, got {min_repeat}.")
+        self._auto_fold = min_repeat
+
+    @property
+    def output_store(self) -> OutputStore | None:
+        """The store of the recorded outputs, if enabled."""
+        return self._output_store
+
+    def keep_outputs(
+        self,
+        budget: int = 1 << 30,
+        threshold: int = 16 << 20,
+        path: str | Path | None = None,
+    ) -> OutputStore:
+        """
+        Keep the recorded outputs so that they can be accessed by `value_of`.
+
+        Arrays larger than ``threshold`` will be spilled to memory-mapped files
+        if the outputs kept in memory exceed ``budget`` bytes, followed by the
+        other outputs if needed. See ``OutputStore`` for details.
+        """
+        from napari_macrokit._output_store import OutputStore
+
+        self._output_store = OutputStore(budget, threshold, path)
+        return self._output_store
+
+    @property
+    def sidecar(self) -> SidecarStore | None:
+        """The sidecar store of large literal arguments, if enabled."""
+        return self._sidecar
+
+    def use_sidecar(
+        self, path: str | Path | None = None, threshold: int = 1024
+    ) -> SidecarStore:
+        """
+        Save large literal arguments to a sidecar directory.
+
+        Literal arguments longer than ``threshold`` characters will be
+        recorded as a short loader expression instead of being inlined. See
+        ``SidecarStore`` for details.
+        """
+        from napari_macrokit._sidecar import SidecarStore
+
+        self._sidecar = SidecarStore(path, threshold)
+        return self._sidecar
+
+    @property
+    def provenance(self) -> ProvenanceStore | None:
+        """The provenance store of the input arrays, if enabled."""
+        return self._provenance
+
+    def track_provenance(
+        self, path: str | Path | None = None, max_pending: int = 8
+    ) -> ProvenanceStore:
+        """
+        Snapshot the input arrays of the recorded calls.
+
+        Each distinct array given as an argument, or as the data of a layer
+        argument, is saved to a content-addressed directory in a background
+        thread. The content IDs are written to the script by `save`. See
+        ``ProvenanceStore`` for details.
+        """
+        from napari_macrokit._provenance import ProvenanceStore
+
+        if self._provenance is not None:
+            self._provenance.close()
+        self._provenance = ProvenanceStore(path, max_pending)
+        return self._provenance
+
+    def save(self, path: str | Path) -> None:
+        """
+        Save the macro as a Python script.
+
+        If provenance is tracked, the content IDs of the inputs are written at
+        the top of the script as comments.
+        """
+        text = str(self)
+        if self._provenance is not None:
+            text = self._provenance.header() + "\n" + text
+        Path(path).write_text(text + "\n")
+
+    def value_of(self, symbol: Symbol | str) -> Any:
+        """Get the recorded output value of the given symbol."""
+        if self._output_store is None:
+            raise ValueError(
+                "Outputs are not kept. Call `keep_outputs` before recording."
+            )
+        if isinstance(symbol, Symbol):
+            symbol = symbol.name
+        try:
+            return self._output_store.get(symbol)
+        except KeyError:
+            raise ValueError(f"No output recorded as {symbol!r}.") from None
+
+    def execute(
+        self,
+        namespace: dict[str, Any] | None = None,
+        *,
+        checkpoint: Checkpoint | str | Path | None = None,
+        parallel: bool | ParallelExecutor = False,
+    ) -> dict[str, Any]:
+        """
+        Execute the macro line by line.
+
+        >>> macro.execute({"viewer": viewer})
+
+        Parameters
+        ----------
+        namespace : dict, optional
+            Variables used in the macro, such as ``viewer``.
+        checkpoint : Checkpoint or path-like, optional
+            If given, outputs of assign lines are cached in the directory, and
+            only the lines downstream of the changed lines will be executed in
+            the next call.
+        parallel : bool or ParallelExecutor, default is False
+            If true, independent lines are executed concurrently on a thread
+            pool. Give a ``ParallelExecutor`` to configure the number of
+            threads or to see the timing of each line after execution.
+
+        Returns
+        -------
+        dict
+            Mapping from the assigned variable names to the values.
+        """
+        from napari_macrokit._checkpoint import Checkpoint
+        from napari_macrokit._execution import execute
+        from napari_macrokit._parallel import ParallelExecutor
+
+        if parallel is not False:
+            if checkpoint is not None:
+                raise ValueError(
+                    "checkpoint cannot be used with parallel execution."
+                )
+            if not isinstance(parallel, ParallelExecutor):
+                parallel = ParallelExecutor()
+            return parallel.run(self, namespace)
+        if checkpoint is not None and not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint(checkpoint)
+        return execute(self, namespace, checkpoint=checkpoint)
+
+    def to_function(
+        self,
+        inputs: Iterable[Any] | Mapping[str, Any] = (),
+        outputs: Iterable[Any] | None = None,
+        *,
+        namespace: dict[str, Any] | None = None,
+        name: str = "macro_function",
+    ) -> MacroFunction:
+        """
+        Compile the macro into a Python function.
+
+        >>> func = macro.to_function(inputs=["arr0"], outputs=["arr2"])
+        >>> func(np.zeros((10, 10)))  # returns arr2
+        >>> macro[3:8].to_function(...)  # a slice of the macro
+
+        The function is compiled once and is picklable, so that it can be
+        used in process pools. Lines that assign the inputs and lines not
+        needed for the outputs are removed, except for lines without any
+        assignment, which are kept for their side effects.
+
+        Parameters
+        ----------
+        inputs : iterable or dict
+            Symbols replaced by the parameters, such as ``"arr0"`` or
+            ``"viewer.layers['image']"``. Recorded objects can also be given.
+            Parameters are named after the symbols or the layer names. Give a
+            dict to name the parameters.
+        outputs : iterable, optional
+            Symbols returned by the function. A tuple is returned for more
+            than one output. By default, the variables assigned in the last
+            assign line are returned.
+        namespace : dict, optional
+            Other variables used in the macro, such as ``viewer``.
+        name : str, default is "macro_function"
+            Name of the function.
+        """
+        from napari_macrokit._function import make_function
+
+        with self._lock:
+            lines = list(self._args)
+        return make_function(
+            lines,
+            inputs,
+            outputs,
+            namespace=namespace,
+            name=name,
+            as_text=self._as_text,
+        )
+
+    def sweep(
+        self,
+        params: Mapping[tuple[int | str, int | str], Iterable[Any]],
+        outputs: Iterable[str] | None = None,
+        *,
+        namespace: dict[str, Any] | None = None,
+        executor: Literal["thread", "process"] = "thread",
+        max_workers: int | None = None,
+    ) -> SweepResult:
+        """
+        Run the macro over a grid of the arguments of recorded calls.
+
+        >>> result = macro.sweep(
+        ...     {("image1", "sigma"): [1, 2], ("labels0", 1): [0.3, 0.5]}
+        ... )
+        >>> result.table  # pandas.DataFrame of the parameters and outputs
+        >>> result.to_macro(result.table["score"].idxmax())
+
+        Each line is executed once for each combination of the values that
+        it depends on, so that lines upstream of the swept arguments are
+        shared by all the rows. Only the lines needed for the outputs are
+        executed.
+
+        Parameters
+        ----------
+        params : dict
+            Mapping from ``(line, argument)`` to the values. The line is the
+            index of the line or the variable assigned by the line, and the
+            argument is the keyword name or the position in the call.
+        outputs : iterable of str, optional
+            Variables to be collected. By default, the variables assigned in
+            the last assign line are collected.
+        namespace : dict, optional
+            Variables used in the macro, such as ``viewer``.
+        executor : "thread" or "process", default is "thread"
+            Run the lines on a thread pool, or in worker processes. In the
+            latter case, recorded functions must be defined at the top level
+            of a module, and lines referring to the namespace are executed in
+            this process.
+        max_workers : int, optional
+            Maximum number of lines executed concurrently.
+        """
+        from napari_macrokit._sweep import sweep
+
+        return sweep(
+            self,
+            params,
+            outputs,
+            namespace=namespace,
+            executor=executor,
+            max_workers=max_workers,
+        )
+
+    def _as_text(self, obj: Any) -> str:
+        if isinstance(obj, str):
+            return obj
+        if isinstance(obj, (Symbol, Expr)):
+            return str(obj)
+        gen = self._symbol_generator
+        if is_scalar(obj) or gen.has_renamed(obj):
+            return str(gen.as_renamed_symbol(obj))
+        return str(symbol(obj))
+
     @overload
-    def record(self, obj: _F, *, merge: bool = False) -> _F:
+    def record(
+        self,
+        obj: _F,
+        *,
+        merge: bool = False,
+        process: bool = False,
+        cache: bool | ResultCache = False,
+    ) -> _F:
         ...
 
     @overload
     def record(
-        self, obj: Literal[None], *, merge: bool = False
+        self,
+        obj: Literal[None],
+        *,
+        merge: bool = False,
+        process: bool = False,
+        cache: bool | ResultCache = False,
     ) -> Callable[[_F], _F]:
         ...
 
-    def record(self, obj=None, *, merge: bool = False):
+    def record(
+        self,
+        obj=None,
+        *,
+        merge: bool = False,
+        process: bool = False,
+        cache: bool | ResultCache = False,
+    ):
         """
         Record input function.
 
@@ -88,15 +691,74 @@ class NapariMacro(BaseMacro):
         merge : bool, default is False
             If true, and the last function call was from the same function,
             then overwrite the last line of the macro.
+        process : bool, default is False
+            If true, the function is called in a persistent worker process,
+            which is useful for GIL-bound functions. Large arrays are passed
+            through shared memory instead of being pickled. The function
+            must be defined at the top level of a module, and the arguments
+            and the output must be picklable.
+        cache : bool or ResultCache, default is False
+            If true, outputs are cached on disk across sessions, keyed by the
+            source of the function and the content of the arguments. Give a
+            ``ResultCache`` to use other than the default directory. Only
+            functions without side effects should be cached.
         """
 
         def wrapper(f):
             if isinstance(f, Callable) and not isinstance(f, type):
-                return _record_function(f, macro=self, merge=merge)
+                return _record_function(
+                    f, macro=self, merge=merge, process=process, cache=cache
+                )
             raise TypeError(f"Cannot record {type(f)}")
 
         return wrapper if obj is None else wrapper(obj)
 
+    def map(
+        self,
+        func: Callable[..., _R],
+        *iterables: Iterable[Any],
+        executor: Executor | Literal["thread", "process"] | None = "thread",
+        max_workers: int | None = None,
+    ) -> list[_R]:
+        """
+        Call a function over the iterables and record it as a single line.
+
+        >>> out = macro.map(func, images)
+
+        is recorded as
+
+        >>> out = [func(_x) for _x in images]
+
+        The function is recorded if it is not recorded by this macro yet. See
+        ``map`` attribute of the recorded functions for the parameters.
+        """
+        if getattr(func, "_macro", None) is not self:
+            func = self.record(func)
+        return func.map(*iterables, executor=executor, max_workers=max_workers)
+
+    def stream_to_layer(
+        self,
+        chunks: Iterable[Any],
+        viewer: napari.Viewer | None = None,
+        name: str | None = None,
+    ) -> Image:
+        """
+        Stack streamed chunks into an image layer incrementally and record it.
+
+        >>> stream = func(stack)  # func is a recorded generator function
+        >>> macro.stream_to_layer(stream, viewer)
+
+        is recorded as
+
+        >>> generator0 = func(stack)
+        >>> image0 = stream_to_layer(generator0, viewer)
+        """
+        from napari_macrokit._streaming import stream_to_layer
+
+        if self._stream_to_layer is None:
+            self._stream_to_layer = self.record(stream_to_layer)
+        return self._stream_to_layer(chunks, viewer, name)
+
     @overload
     def magicgui(
         self, function: Callable[..., _R], **kwargs
@@ -191,10 +853,40 @@ def set_unlinked_context(*types: type):
         _TYPES_NOT_TO_RECORD.update(_old_state)
 
 
-def _record_function(_func_: _F, macro: NapariMacro, merge: bool) -> _F:
+def _record_function(
+    _func_: _F,
+    macro: NapariMacro,
+    merge: bool,
+    process: bool = False,
+    cache: bool | ResultCache = False,
+) -> _F:
     """Convert a function into a macro recordable one."""
     if hasattr(_func_, "func"):  # partial
-        return _record_function(_func_.func, macro)
+        return _record_function(_func_.func, macro, merge, process, cache)
+    if process and (
+        inspect.iscoroutinefunction(_func_)
+        or inspect.isgeneratorfunction(_func_)
+    ):
+        raise TypeError(
+            "Coroutine and generator functions cannot run in a process."
+        )
+    result_cache: ResultCache | None = None
+    if cache is not False:
+        from napari_macrokit._result_cache import (
+            function_fingerprint,
+            get_default_result_cache,
+        )
+
+        if inspect.iscoroutinefunction(_func_) or inspect.isgeneratorfunction(
+            _func_
+        ):
+            raise TypeError(
+                "Coroutine and generator functions cannot be cached."
+            )
+        if cache is True:
+            cache = get_default_result_cache()
+        result_cache = cache
+        fingerprint = function_fingerprint(_func_)
 
     sig = inspect.signature(_func_)
     symbolizers: dict[str, _Symbolizer] = {}
@@ -203,61 +895,333 @@ def _record_function(_func_: _F, macro: NapariMacro, merge: bool) -> _F:
         ann = param.annotation
         symbolizers[name] = _get_symbolizer(ann)
     if sig.return_annotation is not inspect.Parameter.empty:
-        tp = resolve_single_type(sig.return_annotation)
-        return_type = get_id_safe_class(tp, tp)
+        return_type = resolve_single_type(sig.return_annotation)
     else:
         return_type = None
 
-    @wraps(_func_)
-    def wrapper(*args, **kwargs):
-        nonlocal sig, symbolizers, _func_, merge, return_type
+    def _start(args, kwargs) -> tuple[int, Expr]:
+        # Reserve the position in the macro before calling the function, so
+        # that lines are ordered by call start even if the function is called
+        # from several threads or tasks.
+        ticket = macro._committer.reserve()
+        try:
+            with _symbolizing(macro):
+                macro_args, macro_kwargs = _get_macro_arguments(
+                    sig, symbolizers, *args, **kwargs
+                )
+            if macro._provenance is not None:
+                _snapshot_inputs(
+                    macro._provenance,
+                    sig,
+                    args,
+                    kwargs,
+                    macro_args,
+                    macro_kwargs,
+                )
+            expr = Expr.parse_call(_func_, macro_args, macro_kwargs)
+        except BaseException:
+            macro._committer.cancel(ticket)
+            raise
+        return ticket, expr
 
-        macro_args, macro_kwargs = _get_macro_arguments(
-            sig, symbolizers, *args, **kwargs
-        )
-        # Run function with macro blocked (otherwise recorded macro
-        # will call the inner function twice).
-        with macro.blocked():
-            out = _func_(*args, **kwargs)
-        expr = Expr.parse_call(_func_, macro_args, macro_kwargs)
-
-        # If the last function call is the same function, merge with the last
-        if merge and _get_last_call_name(macro) == expr.args[0]:
-            macro.pop()
-            SymbolGen.discard_last()
-
-        for tp in _TYPES_NOT_TO_RECORD:
-            if isinstance(out, tp):
-                break
-        else:
-            # If the function returned a value that is needed to be recorded,
-            # then interpret the output and record as "var = func(...)"
-            if (
-                isinstance(out, Sequence)
-                and not isinstance(out, str)
-                and len(out) < 10
-            ):
-                sym_out = store_sequence(out)
-            else:
-                # NOTE: Python literals usually have the same ID, which
-                # causes some fatal bugs in macro recording. As a workaround,
-                # we convert them into custom int/bool type.
-                if _cls := get_id_safe_class(type(out), None):
-                    out = _cls(out)
-                sym_out = Symbol.asvar(out)
-
-            if return_type is None:
-                return_type = type(out)
-
-            sym_out = SymbolGen.generate(out, return_type, sym_out)
-            expr = Expr(Head.assign, [sym_out, expr])
-        macro.append(expr)
+    def _finish(ticket: int, expr: Expr, out, started: float, duration: float):
+        thread_id = threading.get_ident()
+        linked = not any(isinstance(out, tp) for tp in _TYPES_NOT_TO_RECORD)
+
+        def _commit():
+            nonlocal return_type
+
+            _expr = expr
+            # If the last function call is the same function, merge with
+            # the last
+            if merge and _get_last_call_name(macro) == _func_symbol(_expr):
+                macro.pop()
+                if macro._last_output is not None:
+                    macro.symbol_generator.discard(*macro._last_output)
+                    macro._scalars.discard([macro._last_output[0]])
+            macro._last_output = None
+
+            if linked:
+                # If the function returned a value that is needed to be
+                # recorded, then interpret the output and record as
+                # "var = func(...)"
+                if return_type is None:
+                    return_type = type(out)
+
+                if is_scalar(out):
+                    # NOTE: Python literals usually have the same ID, so
+                    # scalars are tracked in a side table of the macro
+                    # instead of the symbol generator.
+                    sym_out = macro.symbol_generator.generate_scalar(
+                        return_type
+                    )
+                    macro._scalars.put(out, sym_out)
+                    macro._last_output = sym_out, return_type
+                else:
+                    if _is_short_sequence(out):
+                        sym_out = store_sequence(out)
+                    else:
+                        sym_out = Symbol.asvar(out)
+                    macro._last_output = sym_out, return_type
+                    sym_out = macro.symbol_generator.generate(
+                        out, return_type, sym_out
+                    )
+                _expr = Expr(Head.assign, [sym_out, _expr])
+                if macro._output_store is not None and not is_generator:
+                    macro._output_store.put(sym_out.name, out)
+            macro.append(_expr)
+            macro._scalars.tick()
+
+            if has_event_sinks():
+                emit(
+                    RecordEvent(
+                        qualname=_func_.__qualname__,
+                        macro_name=macro.name,
+                        arguments=tuple(
+                            str(arg) for arg in _call_expr(expr).args[1:]
+                        ),
+                        output=sym_out.name if linked else None,
+                        output_type=(
+                            _type_name(return_type) if linked else None
+                        ),
+                        started=started,
+                        duration=duration,
+                        thread_id=thread_id,
+                    )
+                )
+
+        macro._committer.commit(ticket, _commit)
         return out
 
+    is_generator = inspect.isgeneratorfunction(_func_)
+    if inspect.iscoroutinefunction(_func_):
+
+        @wraps(_func_)
+        async def wrapper(*args, **kwargs):
+            if macro._is_blocked():
+                return await _func_(*args, **kwargs)
+
+            ticket, expr = _start(args, kwargs)
+            try:
+                # blocking is context-local, so it does not affect other
+                # tasks running concurrently.
+                started, t0 = time.time(), time.perf_counter()
+                with macro.blocked():
+                    out = await _func_(*args, **kwargs)
+                duration = time.perf_counter() - t0
+            except BaseException:
+                macro._committer.cancel(ticket)
+                raise
+            expr = Expr(Head.unop, [_AWAIT, expr])
+            return _finish(ticket, expr, out, started, duration)
+
+    else:
+
+        def _call(args, kwargs):
+            if process:
+                return call_in_process(wrapper, args, kwargs)
+            with macro.blocked():
+                return _func_(*args, **kwargs)
+
+        @wraps(_func_)
+        def wrapper(*args, **kwargs):
+            if macro._is_blocked():
+                return _func_(*args, **kwargs)
+
+            ticket, expr = _start(args, kwargs)
+            try:
+                # Run function with macro blocked (otherwise recorded macro
+                # will call the inner function twice).
+                started, t0 = time.time(), time.perf_counter()
+                if result_cache is None:
+                    out = _call(args, kwargs)
+                else:
+                    out = result_cache.call(
+                        fingerprint,
+                        sig.bind(*args, **kwargs).arguments,
+                        partial(_call, args, kwargs),
+                    )
+                duration = time.perf_counter() - t0
+            except BaseException:
+                macro._committer.cancel(ticket)
+                raise
+            if is_generator:
+                # chunks are streamed without recording the calls inside
+                out = iter_blocked(macro, out)
+            return _finish(ticket, expr, out, started, duration)
+
+    def _map(
+        *iterables: Iterable[Any],
+        executor: Executor | Literal["thread", "process"] | None = "thread",
+        max_workers: int | None = None,
+    ) -> list[Any]:
+        if len(iterables) == 0:
+            raise TypeError("map() requires at least one iterable.")
+        if inspect.iscoroutinefunction(_func_):
+            raise TypeError("map() does not support coroutine functions.")
+        if macro._is_blocked():
+            return _run_map(wrapper, iterables, executor, max_workers)
+
+        ticket = macro._committer.reserve()
+        try:
+            with _symbolizing(macro):
+                columns, sym_iters = _symbolize_iterables(
+                    sig, symbolizers, iterables
+                )
+            results = _run_map(wrapper, columns, executor, max_workers)
+        except BaseException:
+            macro._committer.cancel(ticket)
+            raise
+
+        if len(results) == 0:
+            macro._committer.cancel(ticket)
+            return results
+
+        unlinked = tuple(_TYPES_NOT_TO_RECORD)
+        linked = any(not isinstance(out, unlinked) for out in results)
+
+        def _commit():
+            macro._last_output = None
+            _expr = _make_map_expr(_func_, sym_iters, linked)
+            if linked:
+                sym_out = macro.symbol_generator.generate(
+                    results, list, Symbol.asvar(results)
+                )
+                _expr = Expr(Head.assign, [sym_out, _expr])
+                if macro._output_store is not None:
+                    macro._output_store.put(sym_out.name, results)
+            macro.append(_expr)
+
+        macro._committer.commit(ticket, _commit)
+        return results
+
+    _map.__doc__ = _MAP_DOC
+    wrapper.map = _map
+    wrapper._macro = macro
     store(_func_)
     return wrapper
 
 
+_MAP_DOC = """
+Call the function over the iterables and record it as a single line.
+
+>>> out = func.map(images)
+
+is recorded as
+
+>>> out = [func(_x) for _x in images]
+
+Parameters
+----------
+*iterables : iterable
+    Iterables of the positional arguments, as the builtin ``map``.
+executor : Executor, "thread" or "process", default is "thread"
+    Executor to run the function. Thread or process pool is created if a
+    string is given. The function is called in the current thread if None.
+max_workers : int, optional
+    Number of workers of the pool created from a string ``executor``.
+
+Returns
+-------
+list
+    List of the outputs.
+"""
+
+
+def _call_unrecorded(func, *args):
+    """Call a recorded function without recording (used in the pools)."""
+    with func._macro.blocked():
+        return func.__wrapped__(*args)
+
+
+def _run_map(
+    func,
+    iterables: Sequence[Iterable[Any]],
+    executor: Executor | Literal["thread", "process"] | None,
+    max_workers: int | None,
+) -> list[Any]:
+    fn = partial(_call_unrecorded, func)
+    if executor is None:
+        return list(map(fn, *iterables))
+    if isinstance(executor, str):
+        if executor == "thread":
+            pool = ThreadPoolExecutor(max_workers)
+        elif executor == "process":
+            pool = ProcessPoolExecutor(max_workers)
+        else:
+            raise ValueError(
+                "executor must be 'thread', 'process', an Executor or None, "
+                f"got {executor!r}."
+            )
+        with pool:
+            return list(pool.map(fn, *iterables))
+    return list(executor.map(fn, *iterables))
+
+
+def _symbolize_iterables(
+    sig: inspect.Signature,
+    symbolizers: dict[str, _Symbolizer],
+    iterables: Sequence[Iterable[Any]],
+) -> tuple[list[list[Any]], list[Symbol | Expr]]:
+    """Convert iterables into lists and symbolize them."""
+    params = list(sig.parameters.values())
+    columns: list[list[Any]] = []
+    sym_iters: list[Symbol | Expr] = []
+    for i, it in enumerate(iterables):
+        if isinstance(it, (list, tuple)) or iter(it) is it:
+            # symbolize each distinct element only once
+            if i < len(params) and params[i].kind in (
+                inspect.Parameter.POSITIONAL_ONLY,
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            ):
+                symbolizer = symbolizers[params[i].name]
+            else:
+                symbolizer = _readable_symbol_from_object
+            items = list(it)
+            cache: dict[int, Symbol | Expr] = {}
+            syms = []
+            for item in items:
+                if (sym := cache.get(id(item))) is None:
+                    sym = cache[id(item)] = symbolizer(item)
+                syms.append(sym)
+            sym_iters.append(Expr(Head.list, syms))
+        else:
+            # such as an array or a range
+            items = list(it)
+            sym_iters.append(_readable_symbol_from_object(it))
+        columns.append(items)
+    return columns, sym_iters
+
+
+def _make_map_expr(
+    func: Callable, sym_iters: list[Symbol | Expr], linked: bool
+) -> Expr:
+    """Make "[f(_x) for _x in xs]" or "for _x in xs: f(_x)"."""
+    if len(sym_iters) == 1:
+        loopvars = [Symbol.var("_x")]
+        sym_iter = sym_iters[0]
+        target = loopvars[0]
+    else:
+        loopvars = [Symbol.var(f"_x{i}") for i in range(len(sym_iters))]
+        sym_iter = Expr(Head.call, [Symbol.var("zip"), *sym_iters])
+        target = Expr(Head.tuple, loopvars)
+    call = Expr.parse_call(func, tuple(loopvars), {})
+    if linked:
+        return Expr(
+            Head.list, [Expr(Head.generator, [call, target, sym_iter])]
+        )
+    cond = Expr(Head.binop, [Symbol.var("in"), target, sym_iter])
+    return Expr(Head.for_, [cond, Expr(Head.block, [call])])
+
+
+def _is_short_sequence(obj) -> bool:
+    return (
+        isinstance(obj, Sequence)
+        and not isinstance(obj, str)
+        and len(obj) < 10
+    )
+
+
 def _get_symbolizer(ann):
     if isinstance(ann, type) or ann is inspect.Parameter.empty:
         out = _readable_symbol_from_object
@@ -268,25 +1232,48 @@ def _get_symbolizer(ann):
             out = _readable_symbol_from_object
     else:
         tp = resolve_single_type(ann)
-        out = _get_symbolizer(tp)
+        if tp == ann:  # generic aliases and unions
+            out = _readable_symbol_from_object
+        else:
+            out = _get_symbolizer(tp)
     return out
 
 
+@contextmanager
+def _symbolizing(macro: NapariMacro):
+    """Symbolize arguments for the given macro within this context."""
+    token_gen = _CURRENT_GENERATOR.set(macro.symbol_generator)
+    token_sidecar = _CURRENT_SIDECAR.set(macro._sidecar)
+    try:
+        yield
+    finally:
+        _CURRENT_SIDECAR.reset(token_sidecar)
+        _CURRENT_GENERATOR.reset(token_gen)
+
+
 def _readable_symbol_from_object(obj):
+    if is_scalar(obj):
+        gen = _CURRENT_GENERATOR.get()
+        if sym := gen.scalar_symbol(obj):
+            return sym
     sym = symbol(obj)
+    if sidecar := _CURRENT_SIDECAR.get():
+        if loader := sidecar.externalize(sym):
+            return loader
     if isinstance(sym, Symbol) and sym.constant:
         return sym
     if isinstance(sym, Expr):
         return Expr(sym.head, [_rename_one(a) for a in sym.args])
     else:
-        return SymbolGen.rename_or_generate(obj, type(obj), sym)
+        gen = _CURRENT_GENERATOR.get()
+        return gen.rename_or_generate(obj, type(obj), sym)
 
 
 def _rename_one(arg: Symbol | Expr):
     if isinstance(arg, Expr):
         return Expr(arg.head, [_rename_one(a) for a in arg.args])
     else:
-        return SymbolGen.rename_symbol(arg)
+        return _CURRENT_GENERATOR.get().rename_symbol(arg)
 
 
 def _get_macro_arguments(
@@ -306,14 +1293,54 @@ def _get_macro_arguments(
     return macro_args, macro_kwargs
 
 
+def _snapshot_inputs(
+    provenance: ProvenanceStore,
+    sig: inspect.Signature,
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+    macro_args: tuple[Symbol | Expr, ...],
+    macro_kwargs: dict[str, Symbol | Expr],
+) -> None:
+    """Snapshot the array arguments and layer data given by the caller."""
+    import numpy as np
+    from napari.layers import Layer
+
+    arguments = sig.bind(*args, **kwargs).arguments
+    syms = {**dict(zip(arguments, macro_args)), **macro_kwargs}
+    for name, value in arguments.items():
+        if name not in syms:
+            continue
+        if isinstance(value, np.ndarray):
+            provenance.snapshot(str(syms[name]), value)
+        elif isinstance(value, Layer) and isinstance(value.data, np.ndarray):
+            provenance.snapshot(f"{syms[name]}.data", value.data)
+
+
 def _get_last_call_name(macro: NapariMacro):
     if len(macro) == 0:
         return None
-    last_expr = macro[-1]
-    if last_expr.head is Head.assign:
-        last_call_expr = last_expr.args[1]
-    else:
-        last_call_expr = last_expr
-    if last_call_expr.head is Head.call:
-        return last_call_expr.args[0]
+    return _func_symbol(macro[-1])
+
+
+def _call_expr(expr: Symbol | Expr) -> Expr | None:
+    """Return the call of "f(...)", "x = f(...)" or "await f(...)"."""
+    if not isinstance(expr, Expr):
+        return None
+    if expr.head is Head.assign:
+        expr = expr.args[1]
+    if expr.head is Head.unop and expr.args[0] == _AWAIT:
+        expr = expr.args[1]
+    if expr.head is Head.call:
+        return expr
     return None
+
+
+def _func_symbol(expr: Symbol | Expr) -> Symbol | Expr | None:
+    """Return the called function of "f(...)", "x = f(...)" or "await f()"."""
+    if call := _call_expr(expr):
+        return call.args[0]
+    return None
+
+
+def _type_name(tp: Any) -> str:
+    return getattr(tp, "__qualname__", None) or repr(tp)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+
+class OutputStore:
+    """
+    A memory-budgeted store of the recorded outputs.
+
+    Outputs are kept in memory as long as their total size does not exceed
+    ``budget``. When the budget is exceeded, the least recently used arrays
+    larger than ``threshold`` are spilled to ``.npy`` files and will be
+    re-opened as read-only memory maps on access. If it is not enough, the
+    other outputs are spilled from the least recently used one as well.
+    Smaller arrays are saved as ``.npy`` files and other objects are pickled,
+    so they are loaded as copies. Outputs that cannot be pickled are evicted.
+
+    Sizes of objects other than arrays are estimated by ``sys.getsizeof``,
+    including the items of lists, tuples and dicts.
+
+    Parameters
+    ----------
+    budget : int, default is 1 GiB
+        Maximum number of bytes of outputs kept in memory.
+    threshold : int, default is 16 MiB
+        Arrays smaller than this size are spilled only after all the larger
+        arrays are spilled.
+    path : path-like, optional
+        Directory to save the spilled arrays. A temporary directory that will
+        be removed with the store is used by default.
+    """
+
+    def __init__(
+        self,
+        budget: int = 1 << 30,
+        threshold: int = 16 << 20,
+        path: str | Path | None = None,
+    ):
+        if path is None:
+            path = tempfile.mkdtemp(prefix="napari-macrokit-")
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, path, ignore_errors=True
+            )
+        else:
+            Path(path).mkdir(parents=True, exist_ok=True)
+            self._finalizer = None
+        self._path = Path(path)
+        self._budget = budget
+        self._threshold = threshold
+        self._in_memory: OrderedDict[str, Any] = OrderedDict()
+        # sizes at the time the outputs are stored
+        self._sizes: dict[str, int] = {}
+        self._spilled: dict[str, Path] = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(in_memory={len(self._in_memory)}, "
+            f"spilled={len(self._spilled)}, nbytes={self._nbytes})"
+        )
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._in_memory or name in self._spilled
+
+    def __len__(self) -> int:
+        return len(self._in_memory) + len(self._spilled)
+
+    @property
+    def path(self) -> Path:
+        """Directory of the spilled arrays."""
+        return self._path
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes of the outputs kept in memory."""
+        return self._nbytes
+
+    def put(self, name: str, value: Any) -> None:
+        """Store a value."""
+        with self._lock:
+            self._discard(name)
+            self._in_memory[name] = value
+            size = self._sizes[name] = _nbytes(value)
+            self._nbytes += size
+            self._spill_if_needed()
+
+    def get(self, name: str) -> Any:
+        """
+        Get a value.
+
+        Spilled arrays are returned as memory maps and other spilled values
+        are unpickled.
+        """
+        with self._lock:
+            if name in self._in_memory:
+                self._in_memory.move_to_end(name)
+                return self._in_memory[name]
+            if (path := self._spilled.get(name)) is not None:
+                if path.suffix == ".npy":
+                    return np.load(path, mmap_mode="r")
+                with open(path, "rb") as f:
+                    return pickle.load(f)
+        raise KeyError(name)
+
+    def is_spilled(self, name: str) -> bool:
+        """True if the value is spilled to the disk."""
+        return name in self._spilled
+
+    def discard(self, name: str) -> None:
+        """Discard a value if exists."""
+        with self._lock:
+            self._discard(name)
+
+    def clear(self) -> None:
+        """Discard all the values."""
+        with self._lock:
+            for name in list(self._in_memory) + list(self._spilled):
+                self._discard(name)
+
+    def _discard(self, name: str) -> None:
+        if name in self._in_memory:
+            del self._in_memory[name]
+            self._nbytes -= self._sizes.pop(name)
+        elif name in self._spilled:
+            self._spilled.pop(name).unlink(missing_ok=True)
+
+    def _spill_if_needed(self) -> None:
+        if self._nbytes <= self._budget:
+            return
+        # large arrays first, from the least recently used one
+        for name, value in list(self._in_memory.items()):
+            if self._nbytes <= self._budget:
+                return
+            size = self._sizes[name]
+            if size > 0 and size >= self._threshold and _is_plain(value):
+                self._spill(name)
+        for name in list(self._in_memory):
+            if self._nbytes <= self._budget:
+                return
+            if self._sizes[name] > 0:
+                self._spill(name)
+
+    def _spill(self, name: str) -> None:
+        value = self._in_memory.pop(name)
+        self._nbytes -= self._sizes.pop(name)
+        if _is_plain(value):
+            path = self._path / f"{name}.npy"
+            np.save(path, value, allow_pickle=False)
+        else:
+            try:
+                data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                return  # evicted
+            path = self._path / f"{name}.pkl"
+            path.write_bytes(data)
+        self._spilled[name] = path
+
+
+def _is_plain(value: Any) -> bool:
+    return isinstance(value, np.ndarray) and value.dtype != object
+
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, np.memmap):
+        return 0  # backed by a file
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(_nbytes(v) for v in value)
+    elif isinstance(value, dict):
+        size += sum(_nbytes(k) + _nbytes(v) for k, v in value.items())
+    return size
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from typing import Any, Iterable, NamedTuple
+
+from macrokit import Expr, Head, Symbol
+
+from napari_macrokit._dependency import assigned_names, referenced_names
+from napari_macrokit._execution import execute_line, prepare_lines
+
+
+class LineTiming(NamedTuple):
+    """Timing of a line executed by ``ParallelExecutor``."""
+
+    index: int
+    line: str
+    started: float
+    duration: float
+    thread_id: int
+
+
+class ParallelExecutor:
+    """
+    Execute macro lines concurrently following their dependencies.
+
+    Lines are scheduled as a DAG of the variables they read and write, and
+    independent lines, such as several filters applied to the same input, run
+    on a thread pool. Lines that refer to the namespace (such as ``viewer``)
+    run on the calling thread in the recorded order, so that side effects on
+    the viewer are never reordered. Bare calls are regarded as modifying the
+    variables they refer to.
+
+    >>> executor = ParallelExecutor(max_workers=4)
+    >>> macro.execute({"viewer": viewer}, parallel=executor)
+    >>> print(executor.report())
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Maximum number of threads.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self._max_workers = max_workers
+        self._timings: list[LineTiming] = []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(max_workers={self._max_workers})"
+
+    @property
+    def timings(self) -> list[LineTiming]:
+        """Timings of the lines in the last run, in the order of lines."""
+        return sorted(self._timings, key=lambda t: t.index)
+
+    def report(self) -> str:
+        """Return the timings of the last run as a table."""
+        out = [f"{'#':>4} {'start':>9} {'time':>9} {'thread':>15}  line"]
+        for t in self.timings:
+            code = t.line.split("\n")[0]
+            out.append(
+                f"{t.index:>4} {t.started:>9.4f} {t.duration:>9.4f} "
+                f"{t.thread_id:>15}  {code}"
+            )
+        return "\n".join(out)
+
+    def run(
+        self,
+        lines: Iterable[Symbol | Expr],
+        namespace: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """Execute lines and return the assigned variables."""
+        lines = list(lines)
+        prepared, _glb = prepare_lines(lines, namespace)
+        external = {str(k) for k in namespace} if namespace else set()
+        stored = set(_glb) - external
+        upstreams, on_caller = _schedule(prepared, external, stored)
+        self._timings = []
+        self._run_dag(
+            prepared, [str(line) for line in lines], _glb, upstreams, on_caller
+        )
+        return {
+            name: _glb[name]
+            for line in lines
+            for name in assigned_names(line)
+            if name in _glb
+        }
+
+    def _run_dag(
+        self,
+        lines: list[Symbol | Expr],
+        codes: list[str],
+        _glb: dict[str, Any],
+        upstreams: list[set[int]],
+        on_caller: list[bool],
+    ) -> None:
+        remaining = [len(up) for up in upstreams]
+        downstreams: list[list[int]] = [[] for _ in lines]
+        for i, up in enumerate(upstreams):
+            for j in up:
+                downstreams[j].append(i)
+        ready = [i for i, n in enumerate(remaining) if n == 0]
+        caller_queue: list[int] = []
+        running: dict[Future, int] = {}
+        t0 = time.perf_counter()
+
+        def _execute(i: int) -> None:
+            start = time.perf_counter()
+            execute_line(lines[i], _glb)
+            self._timings.append(
+                LineTiming(
+                    i,
+                    codes[i],
+                    start - t0,
+                    time.perf_counter() - start,
+                    threading.get_ident(),
+                )
+            )
+
+        def _done(i: int) -> None:
+            for j in downstreams[i]:
+                remaining[j] -= 1
+                if remaining[j] == 0:
+                    ready.append(j)
+
+        with ThreadPoolExecutor(self._max_workers) as pool:
+            try:
+                ndone = 0
+                while ndone < len(lines):
+                    for i in ready:
+                        if on_caller[i]:
+                            caller_queue.append(i)
+                        else:
+                            running[pool.submit(_execute, i)] = i
+                    ready.clear()
+                    if caller_queue:
+                        # lines on the caller thread are kept in order
+                        caller_queue.sort()
+                        i = caller_queue.pop(0)
+                        _execute(i)
+                    else:
+                        done, _ = wait_futures(
+                            running, return_when=FIRST_COMPLETED
+                        )
+                        fut = next(iter(done))
+                        i = running.pop(fut)
+                        fut.result()
+                    _done(i)
+                    ndone += 1
+            finally:
+                for fut in running:
+                    fut.cancel()
+
+
+def _schedule(
+    lines: list[Symbol | Expr], external: set[str], stored: set[str]
+) -> tuple[list[set[int]], list[bool]]:
+    """
+    Return the upstream line indices of each line and whether each line has to
+    be executed on the caller thread.
+    """
+    last_writer: dict[str, int] = {}
+    readers: dict[str, list[int]] = {}
+    upstreams: list[set[int]] = []
+    on_caller: list[bool] = []
+    for i, line in enumerate(lines):
+        assigned = assigned_names(line)
+        reads = referenced_names(line)
+        if (
+            isinstance(line, Expr)
+            and line.head is Head.assign
+            and not assigned
+        ):
+            # such as "viewer.layers['a'].visible = False"
+            reads |= referenced_names(line.args[0])
+        if assigned:
+            writes = set(assigned) | (reads & external)
+        else:
+            writes = reads - stored
+        up: set[int] = set()
+        for name in reads | writes:
+            if name in last_writer:
+                up.add(last_writer[name])
+        for name in writes:
+            up.update(readers.pop(name, ()))
+        for name in reads - writes:
+            readers.setdefault(name, []).append(i)
+        for name in writes:
+            last_writer[name] = i
+        up.discard(i)
+        upstreams.append(up)
+        on_caller.append(bool(reads & external))
+    return upstreams, on_caller
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, NamedTuple
+
+import numpy as np
+
+# arrays smaller than this are pickled as usual
+_MIN_SHARED_NBYTES = 1 << 16
+# The first byte of an output block is set by the caller when the array is
+# copied out. The array starts at this offset.
+_HEADER_NBYTES = 64
+
+# output blocks kept open by the worker until the caller copies them out
+_PENDING: list[SharedMemory] = []
+_PENDING_LOCK = threading.Lock()
+_PENDING_WATCHER: threading.Thread | None = None
+
+_POOL: ProcessPoolExecutor | None = None
+_POOL_LOCK = threading.Lock()
+
+
+class SharedArray(NamedTuple):
+    """A picklable handle of an array in a shared memory block."""
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+    offset: int = 0
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the worker process pool, which is created on the first call."""
+    global _POOL
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            # workers must share the resource tracker of this process, so
+            # that shared memory blocks are not unlinked by the workers.
+            resource_tracker.ensure_running()
+            _POOL = ProcessPoolExecutor(mp_context=mp.get_context("spawn"))
+        return _POOL
+
+
+def shutdown_process_pool() -> None:
+    """Shutdown the worker process pool if exists."""
+    global _POOL
+
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown()
+            _POOL = None
+
+
+def call_in_process(func: Callable, args: tuple, kwargs: dict[str, Any]):
+    """
+    Call a function in a worker process without recording.
+
+    Large arrays in the arguments and the output are copied through shared
+    memory blocks instead of being pickled. The output is copied out of its
+    block, so the returned array does not depend on the worker.
+    """
+    blocks: list[SharedMemory] = []
+    try:
+        args = tuple(_share(arg, blocks) for arg in args)
+        kwargs = {k: _share(v, blocks) for k, v in kwargs.items()}
+        future = get_process_pool().submit(_run_in_worker, func, args, kwargs)
+        del args, kwargs
+        out = future.result()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return _receive(out)
+
+
+def _share(obj: Any, blocks: list[SharedMemory], offset: int = 0) -> Any:
+    """Copy a large array into a new shared memory block."""
+    if (
+        not isinstance(obj, np.ndarray)
+        or obj.dtype == object
+        or obj.nbytes < _MIN_SHARED_NBYTES
+    ):
+        return obj
+    shm = SharedMemory(create=True, size=offset + obj.nbytes)
+    blocks.append(shm)
+    shm.buf[:offset] = bytes(offset)
+    view = np.ndarray(
+        obj.shape, dtype=obj.dtype, buffer=shm.buf, offset=offset
+    )
+    view[...] = obj
+    del view
+    return SharedArray(shm.name, obj.shape, obj.dtype.str, offset)
+
+
+def _attach(obj: Any, blocks: list[SharedMemory]) -> Any:
+    if not isinstance(obj, SharedArray):
+        return obj
+    shm = SharedMemory(name=obj.name)
+    blocks.append(shm)
+    return np.ndarray(
+        obj.shape, dtype=np.dtype(obj.dtype), buffer=shm.buf, offset=obj.offset
+    )
+
+
+def _receive(out: Any) -> Any:
+    """Copy an output array out of its shared memory block."""
+    if not isinstance(out, SharedArray):
+        return out
+    blocks: list[SharedMemory] = []
+    try:
+        view = _attach(out, blocks)
+        arr = np.array(view, copy=True)
+        del view
+    finally:
+        for shm in blocks:
+            # let the worker close its handle
+            shm.buf[0] = 1
+            shm.close()
+            shm.unlink()
+    return arr
+
+
+def _keep_until_received(shm: SharedMemory) -> None:
+    """
+    Keep an output block open until the caller copies it out.
+
+    On Windows, a block is freed when its last handle is closed, so the
+    worker must not close it before the caller attaches to it.
+    """
+    global _PENDING_WATCHER
+
+    with _PENDING_LOCK:
+        _PENDING.append(shm)
+        if _PENDING_WATCHER is None:
+            _PENDING_WATCHER = threading.Thread(
+                target=_watch_pending, daemon=True
+            )
+            _PENDING_WATCHER.start()
+
+
+def _release_received() -> bool:
+    """Close the received output blocks and return true if none is left."""
+    for shm in list(_PENDING):
+        if shm.buf[0]:
+            _PENDING.remove(shm)
+            shm.close()
+    return not _PENDING
+
+
+def _watch_pending() -> None:
+    global _PENDING_WATCHER
+
+    while True:
+        time.sleep(0.01)
+        with _PENDING_LOCK:
+            if _release_received():
+                _PENDING_WATCHER = None
+                return
+
+
+def _run_in_worker(func: Callable, args: tuple, kwargs: dict[str, Any]):
+    blocks: list[SharedMemory] = []
+    try:
+        args = tuple(_attach(arg, blocks) for arg in args)
+        kwargs = {k: _attach(v, blocks) for k, v in kwargs.items()}
+        if (macro := getattr(func, "_macro", None)) is not None:
+            with macro.blocked():
+                out = func.__wrapped__(*args, **kwargs)
+        else:
+            # such as a function compiled from a macro
+            out = func(*args, **kwargs)
+        del args, kwargs
+        if isinstance(out, np.ndarray) and out.dtype != object:
+            if out.nbytes >= _MIN_SHARED_NBYTES:
+                # the block is unlinked by the caller
+                shared: list[SharedMemory] = []
+                out = _share(out, shared, offset=_HEADER_NBYTES)
+                _keep_until_received(shared[0])
+            else:
+                # the output may be a view of an input block
+                out = np.array(out, copy=True)
+        return out
+    finally:
+        for shm in blocks:
+            try:
+                shm.close()
+            except BufferError:  # pragma: no cover
+                # the function keeps a reference to the input array
+                pass
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import queue
+import tempfile
+import threading
+import weakref
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ProvenanceRecord(NamedTuple):
+    """An input referenced by a recorded line and its content ID."""
+
+    expr: str
+    content_id: str
+
+
+def content_id(arr: np.ndarray) -> str:
+    """Return the content ID of an array."""
+    arr = np.ascontiguousarray(arr)
+    hasher = hashlib.sha256(f"{arr.dtype.str}{arr.shape}".encode())
+    hasher.update(arr.reshape(-1).view(np.uint8))
+    return f"sha256:{hasher.hexdigest()}"
+
+
+# the writer thread exits after being idle for this number of seconds
+_IDLE_TIMEOUT = 0.5
+
+
+class _Snapshot(NamedTuple):
+    """The last snapshot of an array, kept by the writer thread."""
+
+    ref: weakref.ref
+    layout: tuple
+    checksum: int | None
+    content_id: str
+
+
+class ProvenanceStore:
+    """
+    A content-addressed directory of the input arrays of recorded lines.
+
+    Arrays referenced by the arguments of recorded calls, such as
+    ``viewer.layers['Image'].data``, are handed to a background thread that
+    copies them and saves them as ``<hash>.npy``. The caller neither copies
+    nor hashes the arrays, so an array modified in place before the thread
+    reads it is saved with the modification. Call `flush` before modifying
+    an input in place to save the state at record time. Arrays of the same
+    content are saved only once, and an array that is given again is not
+    copied if it is not modified since the last snapshot. Recording blocks
+    only when more than ``max_pending`` arrays are waiting to be saved.
+
+    The background thread is started on demand and stops when there is
+    nothing to save for a while.
+
+    Parameters
+    ----------
+    path : path-like, optional
+        Directory to save the arrays. A new temporary directory is used by
+        default.
+    max_pending : int, default is 8
+        Maximum number of arrays waiting to be saved.
+    """
+
+    def __init__(self, path: str | Path | None = None, max_pending: int = 8):
+        if path is None:
+            path = tempfile.mkdtemp(prefix="napari-macrokit-provenance-")
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._queue: queue.Queue[tuple[str, np.ndarray]] = queue.Queue(
+            max_pending
+        )
+        # ID of an array -> the last snapshot
+        self._snapshots: dict[int, _Snapshot] = {}
+        self._records: list[ProvenanceRecord] = []
+        self._known: set[ProvenanceRecord] = set()
+        self._saved: set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({str(self._path)!r})"
+
+    @property
+    def path(self) -> Path:
+        """Path to the directory."""
+        return self._path
+
+    def snapshot(self, expr: str, value: np.ndarray) -> bool:
+        """
+        Snapshot an input array referenced by ``expr``.
+
+        Returns false if the array cannot be snapshotted.
+        """
+        if value.dtype == object:
+            return False
+        self._queue.put((expr, value))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return True
+
+    def flush(self) -> None:
+        """Block until all the snapshots are saved."""
+        self._queue.join()
+
+    def records(self) -> list[ProvenanceRecord]:
+        """Return the distinct records in the order of recording."""
+        self.flush()
+        with self._lock:
+            return list(self._records)
+
+    def load(self, content_id: str) -> np.ndarray:
+        """Load an array by its content ID as a read-only memory map."""
+        return np.load(self._file_of(content_id), mmap_mode="r")
+
+    def close(self) -> None:
+        """Save all the snapshots and wait for the background thread."""
+        self.flush()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _file_of(self, content_id: str) -> Path:
+        return self._path / f"{content_id.split(':')[-1]}.npy"
+
+    def _forget(self, key: int, ref: weakref.ref) -> None:
+        with self._lock:
+            if (entry := self._snapshots.get(key)) and entry.ref is ref:
+                del self._snapshots[key]
+
+    def _run(self) -> None:
+        while True:
+            try:
+                expr, value = self._queue.get(timeout=_IDLE_TIMEOUT)
+            except queue.Empty:
+                with self._lock:
+                    # snapshot() starts a new thread if an array is put after
+                    # this check
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                self._save(expr, value)
+            except Exception:
+                # keep saving the other snapshots, or recording blocks
+                # forever once the queue is full
+                logger.exception("Failed to save the snapshot of %s", expr)
+            finally:
+                del value
+                self._queue.task_done()
+
+    def _save(self, expr: str, value: np.ndarray) -> None:
+        key = id(value)
+        layout = _layout(value)
+        with self._lock:
+            entry = self._snapshots.get(key)
+        if (
+            entry is not None
+            and entry.ref() is value
+            and entry.layout == layout
+            and entry.checksum is not None
+            and _checksum(value) == entry.checksum
+        ):
+            # not modified since the last snapshot
+            cid = entry.content_id
+        else:
+            arr = np.array(value, copy=True)
+            cid = self._write(arr)
+            try:
+                ref = weakref.ref(value, lambda r: self._forget(key, r))
+            except TypeError:
+                pass
+            else:
+                snapshot = _Snapshot(ref, layout, _checksum(arr), cid)
+                with self._lock:
+                    self._snapshots[key] = snapshot
+        record = ProvenanceRecord(expr, cid)
+        with self._lock:
+            if record not in self._known:
+                self._known.add(record)
+                self._records.append(record)
+
+    def _write(self, arr: np.ndarray) -> str:
+        cid = content_id(arr)
+        if cid not in self._saved:
+            path = self._file_of(cid)
+            if not path.exists():
+                tmp = self._path / f"{path.stem}.{os.getpid()}.tmp.npy"
+                np.save(tmp, arr, allow_pickle=False)
+                os.replace(tmp, path)
+            self._saved.add(cid)
+        return cid
+
+    def header(self) -> str:
+        """Return the comment lines that describe the inputs."""
+        lines = [f"# Inputs at record time (saved in {str(self._path)!r}):"]
+        for record in self.records():
+            lines.append(f"#   {record.expr}: {record.content_id}")
+        return "\n".join(lines)
+
+
+def _layout(arr: np.ndarray) -> tuple:
+    return (
+        arr.__array_interface__["data"][0],
+        arr.shape,
+        arr.strides,
+        arr.dtype.str,
+    )
+
+
+def _checksum(arr: np.ndarray) -> int | None:
+    """Checksum of the buffer, or None if the array is not contiguous."""
+    if not (arr.flags.c_contiguous or arr.flags.f_contiguous):
+        return None
+    return zlib.crc32(arr.ravel(order="K").view(np.uint8))
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+import sys
+import threading
+import weakref
+from collections import OrderedDict
 from keyword import iskeyword
-from typing import Any, Iterator, MutableMapping
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, MutableMapping
 
 import numpy as np
 import pandas as pd
-from macrokit import Symbol
+from macrokit import Symbol, symbol
 from napari import layers, types
 
+from napari_macrokit._scalars import is_scalar
+
+if TYPE_CHECKING:  # pragma: no cover
+    from napari_macrokit._scalars import ScalarOutputs
+
 
 class PrefixInfo:
     def __init__(self, prefix: str, count: int = 0):
@@ -19,6 +28,9 @@ class PrefixInfo:
         self.count += 1
         return name
 
+    def last_name(self) -> str:
+        return f"{self.prefix}{self.count - 1}"
+
 
 _DEFAULT_PREFIX: dict[str, str] = {
     np.ndarray: "arr",
@@ -45,6 +57,9 @@ class TypeInfoMap(MutableMapping[type, PrefixInfo]):
     def __init__(self) -> None:
         self._info_map: dict[type, PrefixInfo] = {}
         self._existing_prefixes: set[str] = set()
+        self._stem_counts: dict[str, int] = {}
+        # minimum counts of prefixes, reserved by the names already in use
+        self._reserved: dict[str, int] = {}
 
     def __getitem__(self, key: str) -> PrefixInfo:
         return self._info_map[key]
@@ -61,15 +76,21 @@ class TypeInfoMap(MutableMapping[type, PrefixInfo]):
         return len(self._info_map)
 
     def __iter__(self) -> Iterator[type]:
-        return super().__iter__()
+        return iter(self._info_map)
 
     def coerce_prefix(self, pref: str) -> str:
         """Find an unique prefix string."""
+        if pref not in self._existing_prefixes:
+            return pref
+        # Counters are stored for each stem, so that a free prefix is usually
+        # found at the first trial.
         pref_stem = pref
-        i = 0
+        i = self._stem_counts.get(pref_stem, 0)
+        pref = f"{pref_stem}{i}_"
         while pref in self._existing_prefixes:
-            pref = f"{pref_stem}{i}_"
             i += 1
+            pref = f"{pref_stem}{i}_"
+        self._stem_counts[pref_stem] = i + 1
         return pref
 
     def new_prefix(self, objtype: type, default: str | None = None):
@@ -81,44 +102,222 @@ class TypeInfoMap(MutableMapping[type, PrefixInfo]):
                 # some type names are not valid as an identifier.
                 if not default.isidentifier():
                     default = _remove_bad_chars(default)
-        info = PrefixInfo(self.coerce_prefix(default))
+        prefix = self.coerce_prefix(default)
+        info = PrefixInfo(prefix, self._reserved.get(prefix, 0))
         self[objtype] = info
         return info
 
+    def reserve(self, name: str) -> None:
+        """Reserve a name so that it will never be generated."""
+        start = len(name)
+        while start > 0 and name[start - 1].isdigit():
+            start -= 1
+        # "float640" may be the first name of prefix "float64" or the 641st
+        # name of prefix "float".
+        for i in range(max(start, 1), len(name)):
+            num = name[i:]
+            if len(num) > 1 and num[0] == "0":
+                continue
+            prefix = name[:i]
+            count = int(num) + 1
+            if self._reserved.get(prefix, 0) < count:
+                self._reserved[prefix] = count
+
+    def apply_reserved(self) -> None:
+        """Skip the reserved names in the existing prefixes."""
+        for info in self._info_map.values():
+            info.count = max(info.count, self._reserved.get(info.prefix, 0))
+
     def decrement_prefix(self, objtype: type):
         info = self[objtype]
         info.count -= 1
 
 
 class SymbolGenerator:
-    def __init__(self):
+    """
+    Generator of the output symbols.
+
+    Outputs are forgotten when they are deleted. Outputs that cannot be
+    weakly referenced, such as lists and dicts, are kept alive so that their
+    IDs are not reused by other objects, and the oldest one is forgotten when
+    more than ``maxsize`` of them are kept.
+    """
+
+    def __init__(self, maxsize: int = 4096):
         self._type_infos = TypeInfoMap()
         self._rename_map: dict[Symbol, Symbol] = {}
+        self._refs: dict[Symbol, weakref.ref] = {}
+        # outputs that cannot be weakly referenced
+        self._kept: OrderedDict[Symbol, Any] = OrderedDict()
+        self._maxsize = maxsize
+        # scalar outputs of the macros using this generator
+        self._scalar_tables: weakref.WeakSet[ScalarOutputs] = weakref.WeakSet()
         self._last_renamed: tuple[Symbol, type] | None = None
+        self._lock = threading.RLock()
 
     def generate(self, obj: object, objtype: type, old: Symbol) -> Symbol:
         """Generate an unique symbol."""
-        if renamed := self._rename_map.get(old, None):
-            return renamed
-        info = self._type_infos.get(objtype, None)
-        if info is None:
-            info = self._type_infos.new_prefix(objtype)
-        name = info.get_name()
-        if iskeyword(name):
-            out = self._rename_map[old] = old
-        else:
-            out = self._rename_map[old] = Symbol(name, id(obj))
-        self._last_renamed = old, objtype
-        return out
+        with self._lock:
+            if renamed := self._rename_map.get(old, None):
+                return renamed
+            info = self._type_infos.get(objtype, None)
+            if info is None:
+                info = self._type_infos.new_prefix(objtype)
+            name = info.get_name()
+            if iskeyword(name):
+                out = self._rename_map[old] = old
+            else:
+                out = self._rename_map[old] = Symbol(name, id(obj))
+                self._watch(obj, old)
+            self._last_renamed = old, objtype
+            return out
 
-    def discard_last(self):
-        if self._last_renamed is None:
+    def generate_scalar(self, objtype: type) -> Symbol:
+        """
+        Generate an unique symbol for a scalar output.
+
+        The output is not stored in the generator but in the side table of
+        the macro.
+        """
+        with self._lock:
+            info = self._type_infos.get(objtype, None)
+            if info is None:
+                info = self._type_infos.new_prefix(objtype)
+            name = info.get_name()
+            # equal scalars may share the ID, so the name is used instead
+            return Symbol(name, hash(name))
+
+    def add_scalar_table(self, table: ScalarOutputs) -> None:
+        """Look up the scalar outputs in the table."""
+        self._scalar_tables.add(table)
+
+    def scalar_symbol(self, obj: Any) -> Symbol | None:
+        """
+        Return the symbol of a scalar output, or None if not found.
+
+        The last output is returned if found in several tables.
+        """
+        if not is_scalar(obj):
+            return None
+        out: tuple[int, Symbol] | None = None
+        for table in self._scalar_tables:
+            found = table.lookup(obj)
+            if found is not None and (out is None or found[0] > out[0]):
+                out = found
+        return None if out is None else out[1]
+
+    def _watch(self, obj: Any, old: Symbol) -> None:
+        # Forget the symbol when the object is deleted. Otherwise the map
+        # grows forever and a new object that happens to have the same ID
+        # will be given the name of the deleted one.
+        try:
+            self._refs[old] = weakref.ref(
+                obj, lambda ref: self._forget(old, ref)
+            )
+        except TypeError:
+            # such as list and dict
+            self._kept[old] = obj
+            self._kept.move_to_end(old)
+            while len(self._kept) > self._maxsize:
+                evicted, _ = self._kept.popitem(last=False)
+                self._rename_map.pop(evicted, None)
+                Symbol._variables.discard(evicted.object_id)
+
+    def _forget(self, old: Symbol, ref: weakref.ref) -> None:
+        if sys.is_finalizing():
             return
-        sym, objtype = self._last_renamed
-        self._rename_map.pop(sym)
-        self._type_infos.decrement_prefix(objtype)
+        try:
+            with self._lock:
+                if self._refs.get(old) is ref:
+                    del self._refs[old]
+                    self._rename_map.pop(old, None)
+                # macrokit regards any object at this address as a variable
+                Symbol._variables.discard(old.object_id)
+        except (AttributeError, TypeError):
+            # module globals may already be cleared at interpreter shutdown
+            pass
+
+    def discard_last(self):
+        with self._lock:
+            if self._last_renamed is None:
+                return
+            sym, objtype = self._last_renamed
+            self.discard(sym, objtype)
+
+    def discard(self, old: Symbol, objtype: type):
+        """
+        Discard a generated symbol.
+
+        ``old`` is the symbol renamed by the generator, or the generated
+        symbol itself if the object is not stored, such as a scalar.
+        """
+        with self._lock:
+            renamed = self._rename_map.pop(old, old)
+            self._refs.pop(old, None)
+            self._kept.pop(old, None)
+            if self._last_renamed is not None and self._last_renamed[0] == old:
+                self._last_renamed = None
+            info = self._type_infos.get(objtype, None)
+            # the counter can be decremented only if no other symbol of the
+            # same type is generated after this one.
+            if info is not None and info.last_name() == renamed.name:
+                self._type_infos.decrement_prefix(objtype)
+
+    def discard_symbols(self, symbols: Iterable[Symbol]):
+        """
+        Discard generated symbols and roll back the counters at once.
+
+        Symbols are the generated ones, such as the outputs in the macro.
+        """
+        with self._lock:
+            symbols = set(symbols)
+            if not symbols:
+                return
+            # names of scalars and forgotten objects are also rolled back
+            names = {sym.name for sym in symbols}
+            for old, renamed in list(self._rename_map.items()):
+                if renamed in symbols:
+                    del self._rename_map[old]
+                    self._refs.pop(old, None)
+                    self._kept.pop(old, None)
+            if (
+                self._last_renamed is not None
+                and self._last_renamed[0] not in self._rename_map
+            ):
+                self._last_renamed = None
+            for info in self._type_infos.values():
+                # Roll back over the discarded names only. Names of forgotten
+                # objects may still be used in the macro.
+                while info.count > 0 and info.last_name() in names:
+                    info.count -= 1
+
+    def reserve_names(self, names: Iterable[str]) -> None:
+        """Reserve names already in use, such as those in a loaded script."""
+        with self._lock:
+            for name in names:
+                self._type_infos.reserve(name)
+            self._type_infos.apply_reserved()
+
+    def bind(self, obj: Any, name: str) -> Symbol:
+        """Bind an object to an existing name."""
+        with self._lock:
+            old = Symbol.asvar(obj)
+            out = self._rename_map[old] = Symbol(name, id(obj))
+            self._watch(obj, old)
+            self._type_infos.reserve(name)
+            self._type_infos.apply_reserved()
+            return out
+
+    def has_renamed(self, obj: Any) -> bool:
+        """True if a symbol is generated for the object."""
+        if is_scalar(obj):
+            return self.scalar_symbol(obj) is not None
+        return Symbol.asvar(obj) in self._rename_map
 
     def as_renamed_symbol(self, obj: Any) -> Symbol:
+        if is_scalar(obj):
+            # Symbol.asvar would make macrokit regard the value as a variable
+            return self.scalar_symbol(obj) or symbol(obj)
         old_sym = Symbol.asvar(obj)
         return self._rename_map.get(old_sym, old_sym)
 
@@ -133,8 +332,8 @@ class SymbolGenerator:
         self, obj: object, objtype: type, old: Symbol
     ) -> Symbol:
         if isinstance(old, Symbol):
-            if old in self._rename_map:
-                return self._rename_map[old]
+            if renamed := self._rename_map.get(old, None):
+                return renamed
         return self.generate(obj, objtype, old)
 
 
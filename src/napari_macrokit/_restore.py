@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from macrokit import Expr, Head, Symbol, parse
+
+from napari_macrokit._dependency import assigned_names
+from napari_macrokit._rename import _DEFAULT_PREFIX, SymbolGenerator
+
+if TYPE_CHECKING:  # pragma: no cover
+    import napari
+
+
+def read_lines(path: str | Path) -> list[Symbol | Expr]:
+    """
+    Read a saved script or a JSON lines journal of record events.
+
+    The whole source is parsed at once, so that even a long session is loaded
+    quickly.
+    """
+    path = Path(path)
+    text = path.read_text()
+    if path.suffix in (".jsonl", ".ndjson"):
+        text = "\n".join(_journal_to_code(line) for line in text.splitlines())
+    if text.strip() == "":
+        return []
+    block = parse(text, squeeze=False)
+    if isinstance(block, Expr) and block.head is Head.block:
+        return list(block.args)
+    return [block]
+
+
+def _journal_to_code(line: str) -> str:
+    if line.strip() == "":
+        return ""
+    event: dict[str, Any] = json.loads(line)
+    funcname = event["qualname"].rsplit(".", 1)[-1]
+    code = f"{funcname}({', '.join(event['arguments'])})"
+    if output := event.get("output"):
+        code = f"{output} = {code}"
+    return code
+
+
+def restore_symbols(
+    generator: SymbolGenerator,
+    lines: list[Symbol | Expr],
+    viewer: napari.Viewer | None = None,
+) -> None:
+    """
+    Reserve the names assigned in the lines, and bind the layers to them.
+
+    Layers whose names are the same as the assigned names are bound to the
+    names. Layer objects are bound to names such as ``layer_image0`` and
+    layer data are bound to the other names.
+    """
+    names = {name for line in lines for name in assigned_names(line)}
+    generator.reserve_names(names)
+    if viewer is None:
+        return
+    from napari.layers import Layer
+
+    types = {prefix: tp for tp, prefix in _DEFAULT_PREFIX.items()}
+    for layer in viewer.layers:
+        if layer.name not in names:
+            continue
+        tp = types.get(layer.name.rstrip("0123456789"))
+        if isinstance(tp, type) and issubclass(tp, Layer):
+            generator.bind(layer, layer.name)
+        else:
+            generator.bind(layer.data, layer.name)
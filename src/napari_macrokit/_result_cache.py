@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+from napari.layers import Layer
+
+from napari_macrokit._provenance import content_id
+from napari_macrokit._scalars import is_scalar
+
+# temporary files older than this are regarded as left by killed processes
+_STALE_SECONDS = 3600
+
+
+def _default_cache_dir() -> Path:
+    root = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(root) / "napari-macrokit" / "results"
+
+
+class ResultCache:
+    """
+    Persistent on-disk cache of the outputs of recorded functions.
+
+    >>> @macro.record(cache=True)
+    >>> def denoise(img: ImageData, sigma: float = 1.0) -> ImageData:
+    >>>     ...
+
+    The key of a call is computed from the source code of the function, the
+    literal arguments and the content of the array arguments (including the
+    data of layers), so the cache is valid across sessions. Files given as
+    path objects or strings are identified by the path, size and mtime.
+    Calls with other arguments are not cached. Arrays are saved as ``.npy``
+    files and memory-mapped on reload. Other picklable outputs are pickled.
+
+    Files are written atomically, so that the directory can be shared by
+    several processes. The least recently used files are removed when the
+    total size exceeds ``max_bytes``.
+
+    Parameters
+    ----------
+    path : path-like, optional
+        Directory to save the outputs. ``~/.cache/napari-macrokit/results``
+        is used by default.
+    max_bytes : int, default is 4 GiB
+        Maximum total size of the cached files.
+    """
+
+    def __init__(
+        self, path: str | Path | None = None, max_bytes: int = 1 << 32
+    ):
+        if path is None:
+            path = _default_cache_dir()
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._nbytes = sum(size for _, size, _ in self._scan())
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}({str(self._path)!r}, "
+            f"max_bytes={self._max_bytes})"
+        )
+
+    @property
+    def path(self) -> Path:
+        """Path to the cache directory."""
+        return self._path
+
+    @property
+    def max_bytes(self) -> int:
+        """Maximum total size of the cached files."""
+        return self._max_bytes
+
+    def clear(self) -> None:
+        """Remove all the cached outputs."""
+        for file, _, _ in self._scan():
+            _unlink(file)
+        with self._lock:
+            self._nbytes = 0
+
+    def key(self, fingerprint: str, arguments: dict[str, Any]) -> str | None:
+        """Return the key of a call, or None if it cannot be cached."""
+        hasher = hashlib.sha256(fingerprint.encode())
+        for name, value in arguments.items():
+            if (arg_id := argument_id(value)) is None:
+                return None
+            hasher.update(f"{name}={arg_id};".encode())
+        return hasher.hexdigest()
+
+    def call(
+        self,
+        fingerprint: str,
+        arguments: dict[str, Any],
+        compute: Callable[[], Any],
+    ) -> Any:
+        """Return the cached output, or compute and save it."""
+        if (key := self.key(fingerprint, arguments)) is None:
+            return compute()
+        try:
+            return self.load(key)
+        except KeyError:
+            out = compute()
+            self.save(key, out)
+            return out
+
+    def load(self, key: str) -> Any:
+        """Load a cached output. Raise KeyError if not found."""
+        npy = self._path / f"{key}.npy"
+        pkl = self._path / f"{key}.pkl"
+        try:
+            if npy.exists():
+                # memory-mapped, but not an instance of np.memmap
+                out = np.load(npy, mmap_mode="c", allow_pickle=False)
+                out = out.view(np.ndarray)
+                _touch(npy)
+                return out
+            if pkl.exists():
+                with open(pkl, "rb") as f:
+                    out = pickle.load(f)
+                _touch(pkl)
+                return out
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            pass  # removed by another process
+        raise KeyError(key)
+
+    def save(self, key: str, value: Any) -> bool:
+        """Save an output and return true if succeeded."""
+        # write to a temporary file first so that a broken file is never
+        # loaded by other threads or processes.
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if isinstance(value, np.ndarray) and value.dtype != object:
+                dest = self._path / f"{key}.npy"
+                tmp = self._path / f"{key}.{suffix}.npy"
+                np.save(tmp, value, allow_pickle=False)
+            else:
+                try:
+                    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    return False
+                dest = self._path / f"{key}.pkl"
+                tmp = self._path / f"{key}.{suffix}"
+                tmp.write_bytes(data)
+            nbytes = tmp.stat().st_size
+            os.replace(tmp, dest)
+        except OSError:
+            # such as the file being mapped by another process on Windows
+            _unlink(tmp)
+            return False
+        with self._lock:
+            self._nbytes += nbytes
+            if self._nbytes <= self._max_bytes:
+                return True
+        self._evict()
+        return True
+
+    def _scan(self) -> list[tuple[Path, int, float]]:
+        """Return the files with their size and last access time."""
+        out: list[tuple[Path, int, float]] = []
+        now = time.time()
+        for entry in os.scandir(self._path):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if ".tmp" in entry.name:
+                if now - stat.st_mtime > _STALE_SECONDS:
+                    _unlink(Path(entry.path))
+                continue
+            out.append((Path(entry.path), stat.st_size, stat.st_mtime))
+        return out
+
+    def _evict(self) -> None:
+        # other processes may have added or removed files
+        files = sorted(self._scan(), key=lambda x: x[2])
+        total = sum(size for _, size, _ in files)
+        # remove down to 90% so that eviction does not run on every save
+        limit = self._max_bytes * 0.9
+        for file, size, _ in files:
+            if total <= limit:
+                break
+            # mapped files stay readable until unmapped on POSIX
+            if _unlink(file):
+                total -= size
+        with self._lock:
+            self._nbytes = total
+
+
+_DEFAULT: ResultCache | None = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_default_result_cache() -> ResultCache:
+    """Return the default cache, which is created on the first call."""
+    global _DEFAULT
+
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = ResultCache()
+        return _DEFAULT
+
+
+def function_fingerprint(func: Callable) -> str:
+    """Return a fingerprint of the function from its source code."""
+    func = inspect.unwrap(func)
+    hasher = hashlib.sha256(f"{func.__module__}.{func.__qualname__}".encode())
+    try:
+        hasher.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+        # such as functions defined in an interactive session
+        code = func.__code__
+        hasher.update(code.co_code)
+        hasher.update(repr(code.co_consts).encode())
+    return hasher.hexdigest()
+
+
+def argument_id(value: Any) -> str | None:
+    """Return an ID of the argument value, or None if not supported."""
+    if isinstance(value, str) and os.path.isfile(value):
+        # strings naming files are identified like path objects
+        if (file_id := _file_id(value)) is not None:
+            return f"str:{file_id}"
+    if value is None or is_scalar(value):
+        return f"{type(value).__name__}:{value!r}"
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return None
+        return content_id(value)
+    if isinstance(value, Layer):
+        if not isinstance(value.data, np.ndarray):
+            return None  # such as multiscale or lazy arrays
+        return f"{type(value).__name__}:{argument_id(value.data)}"
+    if isinstance(value, os.PathLike):
+        return _file_id(value)
+    if isinstance(value, (list, tuple)):
+        ids = [argument_id(v) for v in value]
+        if None in ids:
+            return None
+        return f"{type(value).__name__}({','.join(ids)})"
+    if isinstance(value, dict):
+        ids = [(argument_id(k), argument_id(v)) for k, v in value.items()]
+        if any(None in pair for pair in ids):
+            return None
+        return "dict(" + ",".join(f"{k}:{v}" for k, v in ids) + ")"
+    return None
+
+
+def _file_id(path: str | os.PathLike) -> str | None:
+    # files are regarded as unchanged if the size and mtime are the same
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"path:{os.fspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _touch(path: Path) -> None:
+    # mtime is used as the last access time for eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _unlink(path: Path) -> bool:
+    try:
+        path.unlink()
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import itertools
+from collections import OrderedDict
+from typing import Any, Iterable
+
+import numpy as np
+from macrokit import Symbol
+
+_SCALAR_TYPES: set[type] = {int, bool, float, complex, str, bytes}
+
+# order of the outputs in all the tables
+_STAMPS = itertools.count()
+
+
+def is_scalar(obj: Any) -> bool:
+    """True if the object is a Python or numpy scalar."""
+    tp = type(obj)
+    return tp in _SCALAR_TYPES or issubclass(tp, np.generic)
+
+
+def _is_shared(obj: Any) -> bool:
+    """
+    True if the scalar may be the same object as a literal.
+
+    CPython caches small integers, booleans and short strings, so an output
+    of these values cannot be distinguished from a literal by its ID.
+    """
+    tp = type(obj)
+    if tp is bool or tp is np.bool_:
+        return True
+    if tp is int:
+        return -5 <= obj <= 256
+    if tp is str:
+        return len(obj) <= 1 or (obj.isascii() and obj.isidentifier())
+    return False
+
+
+class ScalarOutputs:
+    """
+    Side table of the scalar outputs of a macro.
+
+    Scalars are recorded without being converted into other types. Outputs
+    are looked up by their IDs, and kept alive while they are in the table so
+    that the IDs are not reused. Cached objects such as small integers cannot
+    be told from literals by ID. They are keyed by the recorded call instead,
+    and looked up by their type and value only within ``window`` calls after
+    the call that returned them. A literal of the same value given within
+    the window is therefore recorded by the name of the output, which is
+    equal to it.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of outputs. The oldest output is removed first.
+    window : int
+        Number of calls within which cached objects are referred to by name.
+    """
+
+    def __init__(self, maxsize: int = 4096, window: int = 8):
+        self._maxsize = maxsize
+        self._window = window
+        # ID -> (output, symbol, stamp)
+        self._entries: OrderedDict[
+            int, tuple[Any, Symbol, int]
+        ] = OrderedDict()
+        self._keys: dict[Symbol, int] = {}
+        # number of calls -> (output, symbol, stamp) of cached objects
+        self._recent: OrderedDict[int, tuple[Any, Symbol, int]] = OrderedDict()
+        self._ncalls = 0
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._recent)
+
+    def tick(self) -> None:
+        """Count a recorded call."""
+        self._ncalls += 1
+        oldest = self._ncalls - self._window
+        while self._recent and next(iter(self._recent)) < oldest:
+            self._recent.popitem(last=False)
+
+    def put(self, obj: Any, sym: Symbol) -> None:
+        """Register a scalar output of the current call."""
+        if _is_shared(obj):
+            self._recent[self._ncalls] = (obj, sym, next(_STAMPS))
+            return
+        key = id(obj)
+        if (old := self._entries.pop(key, None)) is not None:
+            self._keys.pop(old[1], None)
+        self._entries[key] = (obj, sym, next(_STAMPS))
+        self._keys[sym] = key
+        if len(self._entries) > self._maxsize:
+            _, (_, sym, _) = self._entries.popitem(last=False)
+            self._keys.pop(sym, None)
+
+    def lookup(self, obj: Any) -> tuple[int, Symbol] | None:
+        """Return the stamp and the symbol of a scalar output."""
+        if _is_shared(obj):
+            tp = type(obj)
+            for value, sym, stamp in reversed(self._recent.values()):
+                if type(value) is tp and value == obj:
+                    return stamp, sym
+            return None
+        entry = self._entries.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            return entry[2], entry[1]
+        return None
+
+    def discard(self, symbols: Iterable[Symbol]) -> None:
+        """Discard the outputs of given symbols."""
+        symbols = set(symbols)
+        for sym in symbols:
+            if (key := self._keys.pop(sym, None)) is not None:
+                self._entries.pop(key, None)
+        for ncalls, (_, sym, _) in list(self._recent.items()):
+            if sym in symbols:
+                del self._recent[ncalls]
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import ast
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+
+from macrokit import Expr, Symbol, store
+
+
+def load_literal(path: str, key: str) -> Any:
+    """Load a literal argument saved in a sidecar directory."""
+    with open(Path(path) / f"{key}.pkl", "rb") as f:
+        return pickle.load(f)
+
+
+store(load_literal)
+
+
+class SidecarStore:
+    """
+    A directory of large literal arguments.
+
+    Literal arguments whose code is longer than ``threshold`` characters, such
+    as long coordinate lists or lookup tables, are pickled into the directory
+    and recorded as a short loader expression.
+
+    >>> load_literal(r'path/to/sidecar', '0123456789abcdef')
+
+    Literals are keyed by the hash of their code, so that the same literal is
+    saved only once.
+
+    Parameters
+    ----------
+    path : path-like, optional
+        Directory to save the literals. A new temporary directory is used by
+        default. Note that the saved script refers to this directory.
+    threshold : int, default is 1024
+        Literals longer than this number of characters are externalized.
+    """
+
+    def __init__(self, path: str | Path | None = None, threshold: int = 1024):
+        if path is None:
+            path = tempfile.mkdtemp(prefix="napari-macrokit-sidecar-")
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._threshold = threshold
+        self._saved: set[str] = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}({str(self._path)!r}, "
+            f"threshold={self._threshold})"
+        )
+
+    @property
+    def path(self) -> Path:
+        """Path to the sidecar directory."""
+        return self._path
+
+    @property
+    def threshold(self) -> int:
+        """Threshold of the literal length."""
+        return self._threshold
+
+    def externalize(self, sym: Symbol | Expr) -> Expr | None:
+        """
+        Save the literal and return the loader expression.
+
+        None is returned if the expression is not a large literal.
+        """
+        if isinstance(sym, Symbol) and not sym.constant:
+            return None
+        code = str(sym)
+        if len(code) <= self._threshold:
+            return None
+        key = hashlib.sha1(code.encode()).hexdigest()[:16]
+        # literals already saved are not parsed again
+        if key not in self._saved:
+            try:
+                value = ast.literal_eval(code)
+            except (ValueError, SyntaxError, TypeError, MemoryError):
+                return None  # not a literal such as "viewer.layers['a']"
+            with self._lock:
+                if key not in self._saved:
+                    if not (self._path / f"{key}.pkl").exists():
+                        self._save(key, value)
+                    self._saved.add(key)
+        return Expr.parse_call(load_literal, (str(self._path), key), {})
+
+    def _save(self, key: str, value: Any) -> None:
+        # write to a temporary file first so that a broken file is never
+        # loaded.
+        tmp = self._path / f"{key}.{os.getpid()}.tmp"
+        tmp.write_bytes(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        os.replace(tmp, self._path / f"{key}.pkl")
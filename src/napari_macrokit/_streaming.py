@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import operator
+from typing import TYPE_CHECKING, Any, Generator, Iterable, Iterator
+
+import numpy as np
+
+if TYPE_CHECKING:  # pragma: no cover
+    import napari
+    from napari.layers import Image
+
+    from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def iter_blocked(
+    macro: NapariMacro, gen: Iterator[Any]
+) -> Generator[Any, None, Any]:
+    """
+    Iterate over a generator with the macro recording blocked.
+
+    Recording is blocked only while the generator is running, so that calls
+    from the consumer of the chunks are still recorded.
+    """
+    try:
+        while True:
+            with macro.blocked():
+                try:
+                    chunk = next(gen)
+                except StopIteration as e:
+                    return e.value
+            yield chunk
+    finally:
+        if hasattr(gen, "close"):
+            gen.close()
+
+
+def stream_to_layer(
+    chunks: Iterable,
+    viewer: napari.Viewer | None = None,
+    name: str | None = None,
+) -> Image:
+    """
+    Stack chunks into an image layer incrementally.
+
+    The layer is created when the first chunk is yielded and updated as the
+    following chunks arrive. The buffer grows geometrically, so that each
+    chunk is copied a constant number of times on average.
+
+    Parameters
+    ----------
+    chunks : iterable of arrays
+        Chunks of the same shape and dtype, such as the planes of a stack.
+    viewer : napari.Viewer, optional
+        If given, the layer is added to the viewer.
+    name : str, optional
+        Name of the layer.
+    """
+    from napari.layers import Image
+
+    buf: np.ndarray | None = None
+    layer: Image | None = None
+    n = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        if buf is None:
+            size = max(operator.length_hint(chunks, 1), 1)
+            buf = np.empty((size,) + chunk.shape, dtype=chunk.dtype)
+        elif n == buf.shape[0]:
+            new = np.empty((n * 2,) + buf.shape[1:], dtype=buf.dtype)
+            new[:n] = buf
+            buf = new
+        buf[n] = chunk
+        n += 1
+        if layer is None:
+            layer = Image(buf[:n], name=name)
+            if viewer is not None:
+                viewer.add_layer(layer)
+        else:
+            layer.data = buf[:n]
+    if layer is None:
+        raise ValueError("No chunk was yielded.")
+    return layer
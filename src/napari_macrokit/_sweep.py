@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Iterable, Literal, Mapping, NamedTuple
+
+import numpy as np
+import pandas as pd
+from macrokit import Expr, Head, Symbol, symbol
+
+from napari_macrokit._dependency import assigned_names, referenced_names
+from napari_macrokit._function import MacroFunction, make_function
+from napari_macrokit._process import call_in_process
+
+if TYPE_CHECKING:  # pragma: no cover
+    from napari_macrokit._macrokit_ext import NapariMacro
+
+
+class SweepParam(NamedTuple):
+    """An argument of a line to be swept."""
+
+    line: int
+    arg: int | str
+    values: list[Any]
+    label: str
+
+
+class SweepResult:
+    """
+    Results of a parameter sweep.
+
+    >>> result = macro.sweep({("labels1", "thresh"): [0.3, 0.5, 0.7]})
+    >>> result.table  # a row for each combination of the parameters
+    >>> result.stack("labels1")  # outputs stacked in the shape of the grid
+    >>> best = result.to_macro(result.table["score"].idxmax())
+    """
+
+    def __init__(
+        self,
+        macro: NapariMacro,
+        params: list[SweepParam],
+        outputs: list[str],
+        values: list[dict[str, Any]],
+    ):
+        self._macro = macro
+        self._params = params
+        self._outputs = outputs
+        self._values = values
+
+    def __repr__(self) -> str:
+        labels = ", ".join(p.label for p in self._params)
+        return (
+            f"{self.__class__.__name__}(params=[{labels}], "
+            f"outputs={self._outputs!r}, nrows={len(self._values)})"
+        )
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Shape of the parameter grid."""
+        return tuple(len(p.values) for p in self._params)
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """Table of the parameter values and the outputs of each row."""
+        data: dict[str, list[Any]] = {}
+        rows = list(itertools.product(*(p.values for p in self._params)))
+        for i, param in enumerate(self._params):
+            data[param.label] = [row[i] for row in rows]
+        for name in self._outputs:
+            column = np.empty(len(self._values), dtype=object)
+            column[:] = [values[name] for values in self._values]
+            data[name] = column
+        return pd.DataFrame(data).infer_objects()
+
+    def stack(self, output: str | None = None) -> np.ndarray:
+        """Stack the outputs into an array of shape ``(*shape, ...)``."""
+        if output is None:
+            output = self._outputs[-1]
+        arr = np.stack([np.asarray(values[output]) for values in self._values])
+        return arr.reshape(self.shape + arr.shape[1:])
+
+    def to_macro(self, row: int) -> NapariMacro:
+        """Return the macro with the parameter values of the row."""
+        index = np.unravel_index(row, self.shape)
+        lines = list(self._macro._args)
+        for param, i in zip(self._params, index):
+            lines[param.line] = _set_argument(
+                lines[param.line], param.arg, symbol(param.values[i])
+            )
+        return self._macro.__class__(
+            lines, symbol_generator=self._macro.symbol_generator
+        )
+
+
+def sweep(
+    macro: NapariMacro,
+    params: Mapping[tuple[int | str, int | str], Iterable[Any]],
+    outputs: Iterable[str] | None = None,
+    namespace: dict[str, Any] | None = None,
+    executor: Literal["thread", "process"] = "thread",
+    max_workers: int | None = None,
+) -> SweepResult:
+    """Run the macro over the grid of the parameters."""
+    if executor not in ("thread", "process"):
+        raise ValueError(
+            f"executor must be 'thread' or 'process', got {executor!r}."
+        )
+    with macro._lock:
+        lines = list(macro._args)
+    _params = _resolve_params(macro, lines, params)
+    if outputs is None:
+        outputs = next(
+            (
+                names
+                for line in reversed(lines)
+                if (names := assigned_names(line))
+            ),
+            [],
+        )
+    else:
+        outputs = [str(out) for out in outputs]
+    external = set(namespace or {})
+    nodes = _SweepGraph(lines, _params, outputs, external)
+    values = nodes.run(namespace or {}, executor, max_workers)
+    return SweepResult(macro, _params, outputs, values)
+
+
+class _SweepGraph:
+    """
+    Lines expanded for the parameter values they depend on.
+
+    Each line is executed once for each combination of the values of the
+    swept parameters upstream of it, so that the common upstream lines are
+    shared by the rows.
+    """
+
+    def __init__(
+        self,
+        lines: list[Symbol | Expr],
+        params: list[SweepParam],
+        outputs: list[str],
+        external: set[str],
+    ):
+        self._params = params
+        self._outputs = outputs
+        self._external = external
+        producers: dict[str, int] = {}
+        # index of the line -> names produced by the upstream lines
+        inputs: dict[int, dict[str, int]] = {}
+        for i, line in enumerate(lines):
+            inputs[i] = {
+                name: producers[name]
+                for name in referenced_names(line)
+                if name in producers
+            }
+            for name in assigned_names(line):
+                producers[name] = i
+        missing = [name for name in outputs if name not in producers]
+        if missing:
+            raise ValueError(f"Outputs {missing!r} are not assigned.")
+
+        needed = {producers[name] for name in outputs}
+        for i in reversed(range(len(lines))):
+            if i in needed:
+                needed.update(inputs[i].values())
+        self._lines = sorted(needed)
+        self._producers = producers
+        self._inputs = inputs
+
+        own: dict[int, list[int]] = {}
+        for k, param in enumerate(params):
+            if param.line not in needed:
+                raise ValueError(
+                    f"Line {param.line} is not needed for the outputs."
+                )
+            own.setdefault(param.line, []).append(k)
+        # index of the line -> swept parameters that the line depends on
+        self._depends: dict[int, tuple[int, ...]] = {}
+        self._levels: dict[int, int] = {}
+        # index of the line -> (function, input names, output names)
+        self._funcs: dict[int, tuple[MacroFunction, list[str], list[str]]]
+        self._funcs = {}
+        for i in self._lines:
+            deps = set(own.get(i, []))
+            level = 0
+            for j in inputs[i].values():
+                deps.update(self._depends[j])
+                level = max(level, self._levels[j] + 1)
+            self._depends[i] = tuple(sorted(deps))
+            self._levels[i] = level
+            self._funcs[i] = self._make_function(i, lines[i], own.get(i, []))
+
+    def _make_function(
+        self, i: int, line: Symbol | Expr, own: list[int]
+    ) -> tuple[MacroFunction, list[str], list[str]]:
+        # swept arguments are parameters of the function so that the code
+        # is shared by all the values
+        for k in own:
+            line = _set_argument(line, self._params[k].arg, Symbol(f"_p{k}"))
+        names = sorted(
+            name
+            for name in referenced_names(line)
+            if name in self._inputs[i] or name in self._external
+        )
+        outputs = assigned_names(line)
+        func = make_function([line], names + [f"_p{k}" for k in own], outputs)
+        return func, names, outputs
+
+    def run(
+        self,
+        namespace: dict[str, Any],
+        executor: Literal["thread", "process"],
+        max_workers: int | None,
+    ) -> list[dict[str, Any]]:
+        """Execute the lines and return the outputs of each row."""
+        # rows are indices of the values, as the values may be unhashable
+        rows = list(
+            itertools.product(*(range(len(p.values)) for p in self._params))
+        )
+        # (index of the line, indices of the values) -> assigned values
+        results: dict[tuple[int, tuple], dict[str, Any]] = {}
+
+        def _key(i: int, row: tuple) -> tuple:
+            return i, tuple(row[k] for k in self._depends[i])
+
+        def _execute(i: int, row: tuple) -> dict[str, Any]:
+            func, names, outputs = self._funcs[i]
+            kwargs: dict[str, Any] = {}
+            for name in names:
+                if (j := self._inputs[i].get(name)) is not None:
+                    kwargs[name] = results[_key(j, row)][name]
+                else:
+                    kwargs[name] = namespace[name]
+            for k in self._depends[i]:
+                if (param := self._params[k]).line == i:
+                    kwargs[f"_p{k}"] = param.values[row[k]]
+            # objects in the namespace, such as the viewer, stay in this
+            # process
+            if executor == "process" and self._external.isdisjoint(names):
+                out = call_in_process(func, (), kwargs)
+            else:
+                out = func(**kwargs)
+            if len(outputs) == 1:
+                return {outputs[0]: out}
+            return dict(zip(outputs, out))
+
+        levels = sorted(set(self._levels.values()))
+        with ThreadPoolExecutor(max_workers) as pool:
+            for level in levels:
+                tasks: dict[tuple, tuple[int, tuple]] = {}
+                for i in self._lines:
+                    if self._levels[i] != level:
+                        continue
+                    for row in rows:
+                        tasks.setdefault(_key(i, row), (i, row))
+                futures = {
+                    key: pool.submit(_execute, i, row)
+                    for key, (i, row) in tasks.items()
+                }
+                for key, fut in futures.items():
+                    results[key] = fut.result()
+
+        out: list[dict[str, Any]] = []
+        for row in rows:
+            values = {}
+            for name in self._outputs:
+                i = self._producers[name]
+                values[name] = results[_key(i, row)][name]
+            out.append(values)
+        return out
+
+
+def _resolve_params(
+    macro: NapariMacro,
+    lines: list[Symbol | Expr],
+    params: Mapping[tuple[int | str, int | str], Iterable[Any]],
+) -> list[SweepParam]:
+    out: list[SweepParam] = []
+    for (line, arg), values in params.items():
+        if isinstance(line, str):
+            index = macro.query.definition(line)
+            if index is None:
+                raise ValueError(f"No line assigns {line!r}.")
+        else:
+            index = range(len(lines))[line]
+        if _call_of(lines[index]) is None:
+            raise ValueError(f"Line {index} is not a function call.")
+        out.append(SweepParam(index, arg, list(values), str(arg)))
+    labels = [p.label for p in out]
+    for k, param in enumerate(out):
+        if labels.count(param.label) > 1:
+            names = assigned_names(lines[param.line])
+            target = names[0] if names else str(param.line)
+            out[k] = param._replace(label=f"{target}.{param.arg}")
+    return out
+
+
+def _call_of(line: Symbol | Expr) -> Expr | None:
+    if isinstance(line, Expr) and line.head is Head.assign:
+        line = line.args[1]
+    if isinstance(line, Expr) and line.head is Head.call:
+        return line
+    return None
+
+
+def _set_argument(
+    line: Symbol | Expr, arg: int | str, value: Symbol | Expr
+) -> Expr:
+    """Return a copy of the line with an argument of the call replaced."""
+    call = _call_of(line)
+    if call is None:
+        raise ValueError(f"{line} is not a function call.")
+    args = list(call.args)
+    if isinstance(arg, int):
+        if not 0 <= arg < len(args) - 1 or _is_kw(args[arg + 1]):
+            raise ValueError(f"{line} does not have argument {arg}.")
+        args[arg + 1] = value
+    else:
+        for i, a in enumerate(args):
+            if _is_kw(a) and str(a.args[0]) == arg:
+                args[i] = Expr(Head.kw, [a.args[0], value])
+                break
+        else:
+            # the default value was used in the recorded call
+            args.append(Expr(Head.kw, [Symbol(arg), value]))
+    new_call = Expr(Head.call, args)
+    if line is call:
+        return new_call
+    return Expr(Head.assign, [line.args[0], new_call])
+
+
+def _is_kw(arg: Symbol | Expr) -> bool:
+    return isinstance(arg, Expr) and arg.head is Head.kw
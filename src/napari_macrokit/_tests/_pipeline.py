@@ -0,0 +1,50 @@
+from collections import Counter
+
+import numpy as np
+
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._rename import SymbolGenerator
+
+# module-level functions decorated with ``@macro.record``, which are
+# pickled by reference to their wrappers
+MACRO = NapariMacro(symbol_generator=SymbolGenerator())
+NCALLS = Counter()
+
+
+@MACRO.record
+def load(n: int) -> np.ndarray:
+    NCALLS["load"] += 1
+    return np.arange(n, dtype=float)
+
+
+@MACRO.record
+def gaussian_filter(img: np.ndarray, sigma: float = 1.0) -> np.ndarray:
+    NCALLS["gaussian_filter"] += 1
+    return img * sigma
+
+
+@MACRO.record
+def threshold(img: np.ndarray, thresh: float = 0.5) -> np.ndarray:
+    NCALLS["threshold"] += 1
+    return img > thresh
+
+
+@MACRO.record
+def count(labels: np.ndarray) -> int:
+    return int(labels.sum())
+
+
+def make_macro() -> NapariMacro:
+    """Record the pipeline into the shared macro."""
+    MACRO.clear()
+    img = load(4)
+    labels = threshold(gaussian_filter(img, sigma=1.0))
+    count(labels)
+    assert str(MACRO) == (
+        "arr0 = load(4)\n"
+        "arr1 = gaussian_filter(arr0, sigma=1.0)\n"
+        "arr2 = threshold(arr1, thresh=0.5)\n"
+        "int0 = count(arr2)"
+    )
+    NCALLS.clear()
+    return MACRO
@@ -0,0 +1,146 @@
+import numpy as np
+from macrokit import symbol
+
+from napari_macrokit import Checkpoint
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def test_execute():
+    macro = NapariMacro()
+
+    @macro.record
+    def f(x: float) -> np.ndarray:
+        return np.full(3, x)
+
+    @macro.record
+    def g(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return a + b
+
+    a = f(1.0)
+    b = f(2.0)
+    g(a, b)
+    out = macro.execute()
+    assert len(out) == 3
+    np.testing.assert_equal(list(out.values())[-1], np.full(3, 3.0))
+
+
+def test_checkpoint(tmp_path):
+    macro = NapariMacro()
+    ncalls = []
+
+    @macro.record
+    def f(x: float) -> np.ndarray:
+        ncalls.append("f")
+        return np.full(3, x)
+
+    @macro.record
+    def g(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        ncalls.append("g")
+        return a + b
+
+    a = f(1.0)
+    b = f(2.0)
+    g(a, b)
+    ncalls.clear()
+
+    checkpoint = Checkpoint(tmp_path)
+    macro.execute(checkpoint=checkpoint)
+    assert ncalls == ["f", "f", "g"]
+    ncalls.clear()
+
+    # nothing changed
+    out = macro.execute(checkpoint=checkpoint)
+    assert ncalls == []
+    last = list(out.values())[-1]
+    assert isinstance(last, np.memmap)
+    np.testing.assert_equal(last, np.full(3, 3.0))
+
+    # edit the second line as "b = f(5.0)"
+    macro[1].args[1].args[1] = symbol(5.0)
+    out = macro.execute(checkpoint=checkpoint)
+    assert ncalls == ["f", "g"]
+    np.testing.assert_equal(list(out.values())[-1], np.full(3, 6.0))
+
+    checkpoint.clear()
+    ncalls.clear()
+    macro.execute(checkpoint=checkpoint)
+    assert ncalls == ["f", "f", "g"]
+
+
+class _Unknown:
+    """An input that cannot be identified."""
+
+    def __add__(self, other):
+        return self
+
+
+def test_checkpoint_namespace(tmp_path):
+    ncalls = []
+
+    def increment(x):
+        ncalls.append("increment")
+        return x + 1
+
+    class Layer:
+        def __init__(self, data):
+            self.data = data
+
+    macro = NapariMacro()
+    macro.append("a = increment(x)")
+    macro.append("b = increment(layer.data)")
+    macro.append("c = increment(a)")
+    checkpoint = Checkpoint(tmp_path)
+    namespace = {
+        "increment": increment,
+        "x": np.zeros(3),
+        "layer": Layer(np.zeros(2)),
+    }
+    macro.execute(namespace, checkpoint=checkpoint)
+    assert len(ncalls) == 3
+    ncalls.clear()
+
+    # same content
+    namespace.update(x=np.zeros(3), layer=Layer(np.zeros(2)))
+    macro.execute(namespace, checkpoint=checkpoint)
+    assert ncalls == []
+
+    # inputs from the namespace are changed
+    namespace["x"] = np.ones(3)
+    out = macro.execute(namespace, checkpoint=checkpoint)
+    assert len(ncalls) == 2
+    np.testing.assert_equal(out["c"], np.full(3, 3.0))
+    ncalls.clear()
+    namespace["layer"].data = np.ones(2)
+    out = macro.execute(namespace, checkpoint=checkpoint)
+    assert len(ncalls) == 1
+    np.testing.assert_equal(out["b"], np.full(2, 2.0))
+    ncalls.clear()
+
+    # inputs that cannot be identified
+    namespace["x"] = _Unknown()
+    macro.execute(namespace, checkpoint=checkpoint)
+    assert len(ncalls) == 2
+
+
+def test_default_dir_removed_at_exit(tmp_path, monkeypatch):
+    import atexit
+    import tempfile
+
+    from napari_macrokit import _checkpoint
+
+    registered = []
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(_checkpoint, "_REMOVE_AT_EXIT", set())
+    monkeypatch.setattr(
+        atexit,
+        "register",
+        lambda func, *args, **kwargs: registered.append((func, args, kwargs)),
+    )
+    checkpoint = Checkpoint()
+    Checkpoint()
+    assert checkpoint.path.is_relative_to(tmp_path)
+    assert checkpoint.save("a", np.zeros(3))
+    assert len(registered) == 1
+    func, args, kwargs = registered[0]
+    func(*args, **kwargs)
+    assert not checkpoint.path.exists()
@@ -0,0 +1,110 @@
+import numpy as np
+from macrokit import Expr, parse, symbol
+
+from napari_macrokit._compact import CompactCall, CompactLines
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._rename import SymbolGenerator
+
+
+def _new_macro(compact: bool = False) -> NapariMacro:
+    # use a new namespace not to affect the other tests
+    return NapariMacro(compact=compact, symbol_generator=SymbolGenerator())
+
+
+def _record(macro: NapariMacro):
+    @macro.record
+    def f(x: np.ndarray, sigma: float = 1.0) -> np.ndarray:
+        return x + sigma
+
+    @macro.record
+    def g(a: np.ndarray, name: str):
+        pass
+
+    x = np.zeros(3)
+    outputs = []
+    for i in range(4):
+        outputs.append(f(x, sigma=float(i % 2)))
+        g(outputs[-1], name="a")
+    macro.append("b = 1")
+    return x
+
+
+def test_same_as_default():
+    macro0 = _new_macro()
+    macro1 = _new_macro(compact=True)
+    _record(macro0)
+    x = _record(macro1)
+    assert macro1.is_compact
+    assert not macro0.is_compact
+    lines0 = str(macro0).splitlines()
+    lines1 = str(macro1).splitlines()
+    # output names are numbered differently
+    assert len(lines0) == len(lines1) == 9
+    assert all(
+        isinstance(item, CompactCall) for item in macro1._args._items[:-1]
+    )
+    out = macro1.execute({str(macro1[0].args[1].args[1]): x})
+    assert len(out) == 5
+
+
+def test_interned():
+    macro = _new_macro(compact=True)
+    _record(macro)
+    items = macro._args._items
+    assert items[0].callee is items[2].callee
+    # "name='a'" is shared
+    assert items[1].args[1] is items[3].args[1]
+    # but thawed expressions are not shared
+    assert macro[1].args[2] is not macro[3].args[2]
+
+
+def test_modify_in_place():
+    macro = _new_macro(compact=True)
+    _record(macro)
+    line = macro[1]
+    line.args[2].args[1] = symbol("b")
+    # records are not converted by indexing
+    assert isinstance(macro._args._items[1], CompactCall)
+    assert str(macro[1]).endswith("name='a')")
+    macro[1] = line
+    assert isinstance(macro._args._items[1], CompactCall)
+    assert str(macro[1]).endswith("name='b')")
+    assert str(macro[3]).endswith("name='a')")
+
+
+def test_pool_released():
+    macro = _new_macro(compact=True)
+    _record(macro)
+    pool = macro._args.pool
+    nobjs = len(pool)
+    for i in [1, 3, 5, 7]:
+        line = macro[i]
+        line.args[2].args[1] = symbol("c")
+        macro[i] = line
+    # "name='a'" is not referred to anymore
+    assert len(pool) == nobjs
+    assert ("literal", "'a'") not in pool._table
+    macro.pop()
+    macro.pop()
+    assert len(pool) < nobjs
+    macro.clear()
+    assert len(pool) == 0
+
+
+def test_pop_and_slice():
+    macro = _new_macro(compact=True)
+    _record(macro)
+    nlines = len(macro)
+    expected = [str(line) for line in macro]
+    macro.pop()
+    macro.pop()
+    assert [str(line) for line in macro] == expected[:-2]
+    assert len(macro) == nlines - 2
+    assert [str(line) for line in macro[:2]] == expected[:2]
+
+
+def test_compact_lines():
+    exprs = [parse("a = 1"), Expr.parse_call(print, ("a",), {})]
+    lines = CompactLines(exprs)
+    assert lines == exprs
+    assert isinstance(lines._items[1], CompactCall)
@@ -1,6 +1,6 @@
 import pytest
 
-from napari_macrokit import available_keys, get_macro
+from napari_macrokit import available_keys, get_macro, symbol_of
 from napari_macrokit.core import _MACROS, collect_macro, temp_macro
 
 from ._utils import macro_cleanup
@@ -85,6 +85,28 @@ def test_collect_macro_partially():
         _MACROS.pop("<collection>")
 
 
+def test_collect_macro_delete():
+    with temp_macro(["m0", "m1"]) as macros:
+        m0, m1 = macros
+        macro = collect_macro()
+        events = []
+        macro.on_deleted.append(lambda start, lines: events.append(start))
+        m1.append("y = 0")
+        for i in range(4):
+            m0.append(f"x{i} = {i}")
+        m0.pop()
+        assert [str(line) for line in macro] == [
+            "y = 0",
+            "x0 = 0",
+            "x1 = 1",
+            "x2 = 2",
+        ]
+        m0.truncate(1)
+        assert [str(line) for line in macro] == ["y = 0", "x0 = 0"]
+        assert events == [4, 2]
+        _MACROS.pop("<collection>")
+
+
 def test_collect_macro_error():
     with temp_macro(["m0", "m1", "m2"]):
         with pytest.raises(ValueError):
@@ -105,3 +127,87 @@ def test_macro_repr():
         macro.append("a = 0")
         macro.append("def f(x):\n\treturn 0")
         assert repr(macro) == ">>> a = 0\n>>> def f(x):\n...     return 0"
+
+
+def test_namespace():
+    import numpy as np
+
+    with macro_cleanup():
+        m0 = get_macro("tests:test_namespace(0)", namespace="ns0")
+        m1 = get_macro("tests:test_namespace(1)", namespace="ns1")
+        m2 = get_macro("tests:test_namespace(2)", namespace="ns1")
+        assert m0.symbol_generator is not m1.symbol_generator
+        assert m1.symbol_generator is m2.symbol_generator
+
+        @m0.record
+        def f0() -> np.ndarray:
+            return np.zeros(2)
+
+        @m1.record
+        def f1() -> np.ndarray:
+            return np.zeros(2)
+
+        @m2.record
+        def f2(x: np.ndarray) -> np.ndarray:
+            return x + 1
+
+        out0 = f0()
+        out1 = f1()
+        f2(out1)
+        assert str(m0[0]) == "arr0 = f0()"
+        assert str(m1[0]) == "arr0 = f1()"
+        assert str(m2[0]) == "arr1 = f2(arr0)"
+        assert symbol_of(out0, namespace="ns0").name == "arr0"
+        assert symbol_of(out1, namespace="ns1").name == "arr0"
+        assert symbol_of(out1).name == "arr0"
+
+
+def test_load_macro(tmp_path):
+    from types import SimpleNamespace
+
+    import numpy as np
+    from napari.layers import Image
+    from napari.types import ImageData
+
+    from napari_macrokit import JSONLinesSink, load_macro
+    from napari_macrokit._events import add_event_sink, remove_event_sink
+
+    with macro_cleanup():
+        macro = get_macro("tests:test_load_macro", namespace="ns-save")
+        sink = add_event_sink(JSONLinesSink(tmp_path / "journal.jsonl"))
+
+        @macro.record
+        def f(x: int) -> ImageData:
+            return np.full((2, 2), x)
+
+        outputs = [f(i) for i in range(3)]
+        remove_event_sink(sink)
+        macro.save(tmp_path / "script.py")
+        script = str(macro)
+
+        loaded = load_macro(
+            tmp_path / "script.py", "tests:loaded", namespace="ns-load0"
+        )
+        assert str(loaded) == script
+        out = loaded.record(f)(3)
+        assert str(loaded[-1]) == "image3 = f(3)"
+        assert symbol_of(out, namespace="ns-load0").name == "image3"
+
+        journal = load_macro(
+            tmp_path / "journal.jsonl", "tests:journal", namespace="ns-load1"
+        )
+        assert str(journal) == script
+
+        # layers are bound to the names in the script
+        layer = Image(np.zeros((2, 2)), name="image1")
+        viewer = SimpleNamespace(layers=[layer])
+        rebound = load_macro(
+            tmp_path / "script.py",
+            "tests:rebound",
+            namespace="ns-load2",
+            viewer=viewer,
+        )
+        assert symbol_of(layer.data, namespace="ns-load2").name == "image1"
+        with pytest.raises(ValueError):
+            load_macro(tmp_path / "script.py", "tests:rebound")
+        assert len(rebound) == len(outputs)
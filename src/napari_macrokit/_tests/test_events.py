@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+import numpy as np
+
+from napari_macrokit import (
+    EventSink,
+    JSONLinesSink,
+    RecordEvent,
+    add_event_sink,
+    remove_event_sink,
+    symbol_of,
+    temp_macro,
+)
+
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / "events.jsonl"
+    sink = add_event_sink(JSONLinesSink(path))
+    try:
+        with temp_macro("m0") as macro:
+
+            @macro.record
+            def f(x: float, y: int = 1) -> np.ndarray:
+                time.sleep(0.01)
+                return np.zeros(3)
+
+            @macro.record
+            def g(a: np.ndarray):
+                pass
+
+            t0 = time.time()
+            out = f(1.5)
+            g(out)
+            sink.flush()
+    finally:
+        remove_event_sink(sink)
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(events) == 2
+    e0, e1 = events
+    assert e0["qualname"].endswith("f")
+    assert e0["macro_name"] == "m0"
+    assert e0["arguments"] == ["1.5", "y=1"]
+    assert e0["output"] == symbol_of(out).name
+    assert e0["output_type"] == "ndarray"
+    assert e0["started"] >= t0
+    assert e0["duration"] >= 0.01
+    assert e0["thread_id"] == threading.get_ident()
+    assert e1["arguments"] == [symbol_of(out).name]
+    assert e1["output"] is None
+
+
+class SlowSink(EventSink):
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.events: list[RecordEvent] = []
+        self.event = threading.Event()
+
+    def handle(self, event):
+        self.event.wait()
+        self.events.append(event)
+
+
+def test_sink_does_not_block():
+    sink = add_event_sink(SlowSink(maxsize=4))
+    try:
+        with temp_macro("m0") as macro:
+
+            @macro.record
+            def f(i: int):
+                pass
+
+            for i in range(20):
+                f(i)
+            assert len(macro) == 20
+            # at most one event is being handled and 4 are queued
+            assert sink.dropped >= 15
+    finally:
+        sink.event.set()
+        remove_event_sink(sink)
+    nhandled = 20 - sink.dropped
+    assert [e.arguments for e in sink.events] == [
+        (str(i),) for i in range(nhandled)
+    ]
@@ -0,0 +1,115 @@
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def _make_macro():
+    macro = NapariMacro()
+
+    @macro.record
+    def f(name: str, sigma: float = 1.0):
+        pass
+
+    @macro.record
+    def g(i: int):
+        pass
+
+    return macro, f, g
+
+
+def test_fold_loops():
+    macro, f, g = _make_macro()
+    for name in ["a", "b", "c"]:
+        f(name)
+    g(0)
+    f("a", sigma=1.0)
+    f("a", sigma=2.0)
+    for i in range(2):
+        g(i)
+    assert len(macro) == 8
+    folded = macro.fold_loops()
+    assert len(folded) == 6
+    assert str(folded) == (
+        "for _x in ['a', 'b', 'c']:\n"
+        "    f(_x, sigma=1.0)\n"
+        "g(0)\n"
+        "f('a', sigma=1.0)\n"
+        "f('a', sigma=2.0)\n"
+        "g(0)\n"
+        "g(1)"
+    )
+    assert str(macro.fold_loops(min_repeat=2)).endswith(
+        "for _x in [0, 1]:\n    g(_x)"
+    )
+
+
+def test_fold_keyword():
+    macro, f, g = _make_macro()
+    for sigma in [1.0, 2.0, 3.0]:
+        f("a", sigma=sigma)
+    assert str(macro.fold_loops()) == (
+        "for sigma in [1.0, 2.0, 3.0]:\n    f('a', sigma=sigma)"
+    )
+
+
+def test_executable():
+    macro = NapariMacro()
+    called = []
+
+    @macro.record
+    def f(i: int):
+        called.append(i)
+
+    for i in range(5):
+        f(i)
+    called.clear()
+    macro.fold_loops().execute()
+    assert called == [0, 1, 2, 3, 4]
+
+
+def test_auto_fold():
+    macro, f, g = _make_macro()
+    macro.set_auto_fold(3)
+    f("a")
+    f("b")
+    assert len(macro) == 2
+    f("c")
+    assert len(macro) == 1
+    assert str(macro) == "for _x in ['a', 'b', 'c']:\n    f(_x, sigma=1.0)"
+    f("d")
+    assert len(macro) == 1
+    assert (
+        str(macro) == "for _x in ['a', 'b', 'c', 'd']:\n    f(_x, sigma=1.0)"
+    )
+    g(0)
+    assert len(macro) == 2
+    macro.set_auto_fold(None)
+    g(1)
+    g(2)
+    assert len(macro) == 4
+
+
+def test_loop_var_not_shadowing():
+    macro, f, g = _make_macro()
+    # names given by the namespace are only referenced in the macro
+    macro.append("show(sigma, _x)")
+    for sigma in [1.0, 2.0, 3.0]:
+        f("a", sigma=sigma)
+    for name in ["a", "b", "c"]:
+        f(name)
+    assert str(macro.fold_loops()) == (
+        "show(sigma, _x)\n"
+        "for _x0 in [1.0, 2.0, 3.0]:\n"
+        "    f('a', sigma=_x0)\n"
+        "for _x0 in ['a', 'b', 'c']:\n"
+        "    f(_x0, sigma=1.0)"
+    )
+
+
+def test_auto_fold_not_shadowing():
+    macro, f, g = _make_macro()
+    macro.set_auto_fold(3)
+    macro.append("show(sigma)")
+    for sigma in [1.0, 2.0, 3.0]:
+        f("a", sigma=sigma)
+    assert str(macro) == (
+        "show(sigma)\nfor _x in [1.0, 2.0, 3.0]:\n    f('a', sigma=_x)"
+    )
@@ -0,0 +1,75 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from napari_macrokit._function import _compile
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._rename import SymbolGenerator
+from napari_macrokit._tests._pipeline import make_macro
+
+
+def test_to_function():
+    macro = make_macro()
+    func = macro.to_function(inputs=["arr0"], outputs=["arr2"])
+    assert str(func.__signature__) == "(arr0)"
+    assert "load" not in func.source
+    assert "count" not in func.source
+    np.testing.assert_equal(func(np.array([0.0, 1.0])), [False, True])
+
+    func = macro.to_function(inputs={"x": "arr0"}, outputs=["arr1", "int0"])
+    assert str(func.__signature__) == "(x)"
+    out1, n = func(np.array([0.0, 1.0]))
+    np.testing.assert_equal(out1, [0, 1])
+    assert n == 1
+    assert len(macro) == 4
+
+
+def test_default_outputs_and_slice():
+    macro = make_macro()
+    func = macro.to_function(inputs=["arr0"])
+    assert func(np.arange(3.0)) == 2
+    func = macro[1:3].to_function(inputs=["arr0"])
+    np.testing.assert_equal(func(np.arange(3.0)), [False, True, True])
+
+
+def test_layer_input():
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    macro.append("out = viewer.layers['image'].data * 2")
+    func = macro.to_function(inputs=["viewer.layers['image']"])
+    assert str(func.__signature__) == "(image)"
+
+    class Layer:
+        data = np.ones(2)
+
+    np.testing.assert_equal(func(Layer()), [2, 2])
+    with pytest.raises(ValueError):
+        macro.to_function(inputs=["viewer.layers['image'].data"])
+    func = macro.to_function(inputs={"x": "viewer.layers['image'].data"})
+    np.testing.assert_equal(func(np.ones(2)), [2, 2])
+
+
+def test_pickle_and_cache():
+    macro = make_macro()
+    func = macro.to_function(inputs=["arr0"], outputs=["arr2"])
+    func(np.zeros(2))
+    misses = _compile.cache_info().misses
+    func2 = pickle.loads(pickle.dumps(func))
+    assert func2.source == func.source
+    with ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(func2, [np.ones(2), np.zeros(2)]))
+    np.testing.assert_equal(results, [[True, True], [False, False]])
+    # the code object is reused
+    assert _compile.cache_info().misses == misses
+
+
+def test_pickle_decorated_function():
+    macro = make_macro()
+    func = macro.to_function(inputs=["arr0"], outputs=["arr2"])
+    with ProcessPoolExecutor(1) as executor:
+        out = executor.submit(func, np.ones(2)).result()
+    np.testing.assert_equal(out, [True, True])
+    # calling the compiled function does not record
+    func(np.ones(2))
+    assert len(macro) == 4
@@ -0,0 +1,121 @@
+import numpy as np
+
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._rename import SymbolGenerator
+
+
+def _make_macro():
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+
+    @macro.record
+    def load() -> np.ndarray:
+        return np.zeros(3)
+
+    @macro.record
+    def smooth(data: np.ndarray) -> np.ndarray:
+        return data + 1
+
+    @macro.record
+    def threshold(data: np.ndarray, value: float) -> np.ndarray:
+        return data > value
+
+    return macro, load, smooth, threshold
+
+
+def test_queries():
+    macro, load, smooth, threshold = _make_macro()
+    arr = load()
+    threshold(arr, 0.5)
+    arr = smooth(arr)
+    threshold(arr, 0.5)
+    macro.append("viewer.layers['image'].data = arr1")
+    assert str(macro).splitlines() == [
+        "arr0 = load()",
+        "arr1 = threshold(arr0, 0.5)",
+        "arr2 = smooth(arr0)",
+        "arr3 = threshold(arr2, 0.5)",
+        "viewer.layers['image'].data = arr1",
+    ]
+    query = macro.query
+    assert query.calls("smooth") == [2]
+    assert query.calls(threshold) == [1, 3]
+    assert query.definition("arr0") == 0
+    assert query.definition("arr4") is None
+    assert query.usages("arr0") == [1, 2]
+    assert query.usages("arr1") == [4]
+    assert query.layer("image") == [4]
+    assert query.layer("labels") == []
+
+
+def test_incremental_update():
+    macro, load, smooth, threshold = _make_macro()
+    arr = load()
+    assert macro.query.usages("arr0") == []
+    threshold(arr, 0.5)
+    assert macro.query.usages("arr0") == [1]
+    macro.pop()
+    assert macro.query.usages("arr0") == []
+    assert macro.query.calls("threshold") == []
+    threshold(arr, 0.5)
+    smooth(arr)
+    assert macro.query.usages("arr0") == [1, 2]
+
+    macro.delete(slice(1, None))
+    assert macro.query.usages("arr0") == []
+    assert macro.query.calls("smooth") == []
+
+    macro.insert(0, "x = 0")
+    assert macro.query.calls("load") == [1]
+    assert macro.query.definition("x") == 0
+    macro.pop(0)
+    assert macro.query.calls("load") == [0]
+    assert macro.query.definition("x") is None
+
+
+def test_append_does_not_reset(monkeypatch):
+    macro, load, smooth, threshold = _make_macro()
+    arr = load()
+    for _ in range(5):
+        threshold(arr, 0.5)
+    query = macro.query
+    assert query.calls("threshold") == [1, 2, 3, 4, 5]
+    added = []
+    monkeypatch.setattr(query, "reset", lambda: added.append("reset"))
+    original_add = query._add
+    monkeypatch.setattr(
+        query, "_add", lambda i, line: (added.append(i), original_add(i, line))
+    )
+    threshold(arr, 0.5)
+    assert query._nindexed == 6
+    assert query.calls("threshold") == [1, 2, 3, 4, 5, 6]
+    macro.pop()
+    macro.append("x = arr0")
+    assert query.usages("arr0") == [1, 2, 3, 4, 5, 6]
+    # only the new lines are indexed
+    assert added == [6, 6]
+
+
+def test_compact_macro_not_thawed():
+    macro = NapariMacro(compact=True, symbol_generator=SymbolGenerator())
+
+    @macro.record
+    def f(i: int) -> np.ndarray:
+        return np.zeros(i)
+
+    for i in range(10):
+        f(i)
+    assert macro.query.calls("f") == list(range(10))
+    assert all(
+        type(item).__name__ == "CompactCall" for item in macro._args._items
+    )
+
+
+def test_text_line():
+    macro = NapariMacro()
+    macro.append("a = 0")
+    macro.append("for i in range(3):\n    print(i)")
+    macro.append("b = a")
+    query = macro.query
+    assert query.text_line(2) == 3
+    assert query.definition("b") == 2
+    assert [query.line_of_text(i) for i in range(4)] == [0, 1, 1, 2]
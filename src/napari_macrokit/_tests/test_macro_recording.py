@@ -1,5 +1,6 @@
 import datetime
 
+import numpy as np
 import pytest
 from macrokit import symbol
 
@@ -204,3 +205,294 @@ def test_same_type_name():
     assert str(macro[0]) == "xyz0 = f0()"
     assert str(macro[1]) == "xyz0_0 = f1()"
     assert str(macro[2]) == "xyz1_0 = f2()"
+
+
+def test_many_same_type_names():
+    from napari_macrokit._rename import TypeInfoMap
+
+    type_map = TypeInfoMap()
+    types = [type("Data", (), {}) for _ in range(1000)]
+    prefixes = [type_map.new_prefix(t).prefix for t in types]
+    assert prefixes[:3] == ["data", "data0_", "data1_"]
+    assert len(set(prefixes)) == len(types)
+    assert type_map._stem_counts["data"] == len(types) - 1
+
+
+def test_sidecar(tmp_path):
+    from napari_macrokit import load_literal
+
+    macro = NapariMacro()
+    sidecar = macro.use_sidecar(tmp_path, threshold=100)
+    received = []
+
+    @macro.record
+    def f(coords: list, name: str):
+        received.append((coords, name))
+
+    coords = [[i, i + 1] for i in range(100)]
+    f(coords, "a")
+    f([list(c) for c in coords], "b")
+    f([[0, 1]], "c" * 200)
+    assert len(list(sidecar.path.glob("*.pkl"))) == 2
+    assert str(macro[0]) == str(macro[1]).replace("'b'", "'a'")
+    assert str(macro[0]).startswith("f(load_literal(")
+    assert len(str(macro[2])) < 100
+    assert macro[2].args[2].eval({"load_literal": load_literal}) == "c" * 200
+
+    expected = received.copy()
+    received.clear()
+    macro.execute()
+    assert received == expected
+
+
+def test_sidecar_parse_once(tmp_path, monkeypatch):
+    import ast
+
+    from napari_macrokit import _sidecar
+
+    macro = NapariMacro()
+    macro.use_sidecar(tmp_path, threshold=100)
+    nparsed = []
+    _literal_eval = ast.literal_eval
+
+    def literal_eval(code):
+        nparsed.append(code)
+        return _literal_eval(code)
+
+    monkeypatch.setattr(_sidecar.ast, "literal_eval", literal_eval)
+
+    @macro.record
+    def f(coords: list):
+        pass
+
+    coords = [[i, i + 1] for i in range(100)]
+    f(coords)
+    f(coords)
+    f([list(c) for c in coords])
+    assert len(nparsed) == 1
+    assert str(macro[0]) == str(macro[1]) == str(macro[2])
+
+
+def test_delete():
+    from napari_macrokit._rename import SymbolGenerator
+
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    events = []
+    macro.on_deleted.append(lambda start, lines: events.append((start, lines)))
+
+    @macro.record
+    def f(x: int) -> np.ndarray:
+        return np.full(1, x)
+
+    first = f(0)
+    outputs = [first] + [f(i) for i in range(1, 6)]
+    assert str(macro[-1]) == "arr5 = f(5)"
+    deleted = macro.truncate(-3)
+    assert len(macro) == 3
+    assert [str(line) for line in deleted] == [
+        "arr3 = f(3)",
+        "arr4 = f(4)",
+        "arr5 = f(5)",
+    ]
+    assert events == [(3, deleted)]
+    # symbols are rolled back at once
+    assert not macro.symbol_generator.has_renamed(outputs[-1])
+    f(6)
+    assert str(macro[-1]) == "arr3 = f(6)"
+
+    with pytest.raises(ValueError):
+        macro.delete(slice(None, None, 2))
+    macro.delete(slice(1, 3))
+    assert [str(line) for line in macro] == ["arr0 = f(0)", "arr3 = f(6)"]
+    assert events[-1][0] == 1
+    macro.clear()
+    assert len(macro) == 0
+    assert len(events) == 3
+
+
+def test_forget_released_outputs():
+    import gc
+
+    from napari_macrokit._rename import SymbolGenerator
+
+    gen = SymbolGenerator()
+    macro = NapariMacro(symbol_generator=gen)
+
+    @macro.record
+    def f(x: int) -> np.ndarray:
+        return np.full(1, x)
+
+    a = f(0)
+    b = f(1)
+    assert len(gen._rename_map) == 2
+    del b
+    gc.collect()
+    # the recorded line is kept but the released array is forgotten
+    assert len(gen._rename_map) == 1
+    assert gen.has_renamed(a)
+    # a new array at the same address is never regarded as the old one
+    c = f(2)
+    assert str(macro[-1]) == "arr2 = f(2)"
+    assert gen.has_renamed(c)
+
+
+def test_forget_unreferable_outputs():
+    import gc
+
+    from napari_macrokit._rename import SymbolGenerator
+
+    gen = SymbolGenerator(maxsize=1)
+    macro = NapariMacro(symbol_generator=gen)
+
+    @macro.record
+    def make_list(x: float) -> list:
+        # items of a sequence output are registered globally, so they must
+        # not be cached objects such as small integers
+        return [x * 1.5]
+
+    @macro.record
+    def show_list(x):
+        pass
+
+    out = make_list(0.0)
+    address = id(out)
+    del out
+    gc.collect()
+    # lists cannot be weakly referenced, so the output is kept alive and its
+    # address is never reused by a new list
+    new = [1]
+    assert id(new) != address
+    show_list(new)
+    assert str(macro[-1]) == "show_list([1])"
+
+    # the oldest output is forgotten when too many outputs are kept
+    a = make_list(1.0)
+    b = make_list(2.0)
+    assert not gen.has_renamed(a)
+    assert gen.has_renamed(b)
+    assert len(gen._kept) == 1
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_forget_at_shutdown(monkeypatch):
+    from macrokit import Symbol
+
+    from napari_macrokit._rename import SymbolGenerator
+
+    gen = SymbolGenerator()
+    macro = NapariMacro(symbol_generator=gen)
+
+    @macro.record
+    def f(x: int) -> np.ndarray:
+        return np.full(1, x)
+
+    a = f(0)
+    # class attributes may be cleared before the objects are deleted
+    monkeypatch.setattr(Symbol, "_variables", None)
+    del a
+    assert len(gen._rename_map) == 0
+
+
+def test_scalar_outputs():
+    from napari_macrokit._rename import SymbolGenerator
+
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+
+    @macro.record
+    def mean(x: float) -> float:
+        return x / 3
+
+    @macro.record
+    def to_numpy(x: float) -> np.float64:
+        return np.float64(x)
+
+    @macro.record
+    def count(x: int) -> int:
+        return x
+
+    @macro.record
+    def is_positive(x: int) -> bool:
+        return x > 0
+
+    @macro.record
+    def get_name() -> str:
+        return "abc"
+
+    @macro.record
+    def show(x):
+        pass
+
+    a = mean(2.0)
+    b = to_numpy(a)
+    # scalars are not converted into other types
+    assert type(a) is float and type(b) is np.float64
+    show(a)
+    show(b)
+    show(2 / 3)  # same value but not the output
+    assert [str(line) for line in macro] == [
+        "float0 = mean(2.0)",
+        "float640 = to_numpy(float0)",
+        "show(float0)",
+        "show(float640)",
+        f"show({symbol(2 / 3)})",
+    ]
+
+    # cached objects such as small integers, booleans and short strings are
+    # returned as is, and referred to by name within a few calls
+    n = count(3)
+    flag = is_positive(n)
+    name = get_name()
+    assert type(n) is int and type(flag) is bool and type(name) is str
+    assert flag is True
+    show(n)
+    show(flag)
+    show(name)
+    assert [str(line) for line in macro[-6:]] == [
+        "int0 = count(3)",
+        "bool0 = is_positive(int0)",
+        "str0 = get_name()",
+        "show(int0)",
+        "show(bool0)",
+        "show(str0)",
+    ]
+    # outputs are tracked in the table, not by the rename map
+    assert macro.symbol_generator.scalar_symbol(n) is not None
+    assert not macro.symbol_generator._rename_map
+
+    # a literal of the same value is not renamed after the window
+    for _ in range(8):
+        show(None)
+    show(3)
+    show(True)
+    assert [str(line) for line in macro[-2:]] == ["show(3)", "show(True)"]
+
+    # deleted outputs are not referred to anymore
+    macro.clear()
+    show(a)
+    assert str(macro[-1]) == f"show({symbol(a)})"
+
+
+def test_scalar_outputs_bounded():
+    from macrokit import Symbol
+
+    from napari_macrokit._scalars import ScalarOutputs
+
+    table = ScalarOutputs(maxsize=2)
+    values = [1.5, 2.5, 3.5]
+    for i, value in enumerate(values):
+        table.put(value, Symbol(f"float{i}"))
+    assert len(table) == 2
+    assert table.lookup(values[0]) is None
+    assert table.lookup(values[2])[1].name == "float2"
+
+    # cached objects are kept only within the window
+    table = ScalarOutputs(window=2)
+    table.put(0, Symbol("int0"))
+    table.tick()
+    table.put(1, Symbol("int1"))
+    table.tick()
+    assert table.lookup(0)[1].name == "int0"
+    table.tick()
+    assert table.lookup(0) is None
+    assert table.lookup(1)[1].name == "int1"
+    assert len(table) == 1
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from napari_macrokit import symbol_of
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._output_store import OutputStore
+
+
+def test_value_of():
+    macro = NapariMacro()
+
+    @macro.record
+    def f(x: float) -> np.ndarray:
+        return np.full(3, x)
+
+    with pytest.raises(ValueError):
+        macro.value_of("x")
+
+    macro.keep_outputs()
+    out = f(1.0)
+    sym = symbol_of(out)
+    assert macro.value_of(sym) is out
+    assert macro.value_of(sym.name) is out
+    with pytest.raises(ValueError):
+        macro.value_of("not_a_symbol")
+
+
+def test_spill():
+    macro = NapariMacro()
+    store = macro.keep_outputs(budget=2000, threshold=500)
+
+    @macro.record
+    def f(x: float, size: int) -> np.ndarray:
+        return np.full(size, x)
+
+    a = f(1.0, 100)  # 800 bytes
+    b = f(2.0, 10)  # 80 bytes, never spilled
+    c = f(3.0, 100)  # 800 bytes
+    assert store.nbytes == 1680
+    d = f(4.0, 100)  # exceeds budget
+    assert store.is_spilled(symbol_of(a).name)
+    assert not store.is_spilled(symbol_of(b).name)
+    assert not store.is_spilled(symbol_of(c).name)
+    assert not store.is_spilled(symbol_of(d).name)
+    assert store.nbytes == 1680
+
+    value = macro.value_of(symbol_of(a))
+    assert isinstance(value, np.memmap)
+    np.testing.assert_equal(value, a)
+    assert len(store) == 4
+
+    store.clear()
+    assert len(store) == 0
+    assert list(store.path.iterdir()) == []
+
+
+def test_store_overwrite(tmp_path):
+    store = OutputStore(budget=100, threshold=0, path=tmp_path)
+    store.put("a", np.zeros(10))
+    store.put("b", np.zeros(10))
+    assert store.is_spilled("a")
+    store.put("a", np.ones(2))
+    assert not store.is_spilled("a")
+    assert not (tmp_path / "a.npy").exists()
+    np.testing.assert_equal(store.get("a"), np.ones(2))
+
+
+def test_spill_other_values(tmp_path):
+    store = OutputStore(budget=1000, threshold=500, path=tmp_path)
+    store.put("small", np.zeros(10))  # 80 bytes
+    store.put("func", lambda: None)  # not picklable
+    store.put("list", list(range(100)))  # more than 1000 bytes with items
+    # values smaller than the threshold are spilled from the least recently
+    # used one
+    assert store.is_spilled("small")
+    assert store.is_spilled("list")
+    assert "func" not in store
+    assert store.nbytes == 0
+    assert store.get("list") == list(range(100))
+    np.testing.assert_equal(store.get("small"), np.zeros(10))
+
+    # large arrays are still spilled first
+    store.put("s", "a")
+    store.put("a", np.zeros(100))
+    store.put("b", np.zeros(100))
+    assert store.is_spilled("a")
+    assert not store.is_spilled("s")
+    assert not store.is_spilled("b")
+    store.clear()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+import pytest
+from macrokit import register_type, symbol
+
+from napari_macrokit import Checkpoint, ParallelExecutor
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._rename import SymbolGenerator
+
+
+class _Log(list):
+    """A list that is recorded as "log", like a viewer."""
+
+
+register_type(_Log, lambda _: "log")
+
+
+def test_parallel_branches():
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    barrier: "list[threading.Barrier]" = []
+
+    @macro.record
+    def load(log: _Log) -> np.ndarray:
+        log.append(("load", threading.get_ident()))
+        return np.arange(4)
+
+    @macro.record
+    def filt(a: np.ndarray, x: int) -> np.ndarray:
+        if barrier:
+            # passes only if the three filters run concurrently
+            barrier[0].wait()
+        return a * x
+
+    @macro.record
+    def merge(
+        log: _Log, a: np.ndarray, b: np.ndarray, c: np.ndarray
+    ) -> np.ndarray:
+        log.append(("merge", threading.get_ident()))
+        return a + b + c
+
+    log = _Log()
+    a = load(log)
+    merge(log, filt(a, 1), filt(a, 2), filt(a, 3))
+    assert len(macro) == 5
+
+    log = _Log()
+    barrier.append(threading.Barrier(3, timeout=5))
+    executor = ParallelExecutor(max_workers=3)
+    out = macro.execute({"log": log}, parallel=executor)
+    np.testing.assert_equal(list(out.values())[-1], np.arange(4) * 6)
+    # lines referring to the namespace are executed on this thread in order
+    assert log == [
+        ("load", threading.get_ident()),
+        ("merge", threading.get_ident()),
+    ]
+    timings = executor.timings
+    assert [t.index for t in timings] == list(range(5))
+    assert len({t.thread_id for t in timings[1:4]}) == 3
+    assert "filt" in executor.report()
+
+
+def test_parallel_error():
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+
+    @macro.record
+    def f(x: int) -> np.ndarray:
+        if x < 0:
+            raise ValueError("negative")
+        return np.full(2, x)
+
+    a = f(1)
+    b = f(2)
+    macro[-1].args[1].args[1] = symbol(-1)
+    with pytest.raises(ValueError):
+        macro.execute(parallel=True)
+    with pytest.raises(ValueError):
+        macro.execute(parallel=True, checkpoint=Checkpoint())
+    del a, b
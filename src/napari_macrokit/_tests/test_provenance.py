@@ -0,0 +1,121 @@
+import numpy as np
+
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._provenance import ProvenanceStore, content_id
+from napari_macrokit._rename import SymbolGenerator
+
+
+def test_provenance(tmp_path):
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    provenance = macro.track_provenance(tmp_path / "inputs")
+
+    @macro.record
+    def f(x: np.ndarray, y: int = 0) -> np.ndarray:
+        return x + y
+
+    a = np.zeros((3, 3))
+    f(a)
+    f(y=1, x=a)  # same content
+    # arrays are read by the writer thread
+    provenance.flush()
+    a[0, 0] = 5  # modified in place
+    f(a)
+    f(np.ones(3), 2)
+
+    records = provenance.records()
+    assert [r.expr for r in records] == [
+        "arr0",
+        "arr0",
+        str(macro[3].args[1].args[1]),
+    ]
+    assert len(set(r.content_id for r in records)) == 3
+    assert len(list(provenance.path.glob("*.npy"))) == 3
+    np.testing.assert_equal(provenance.load(records[1].content_id), a)
+    assert records[0].content_id == content_id(np.zeros((3, 3)))
+
+    macro.save(tmp_path / "macro.py")
+    text = (tmp_path / "macro.py").read_text()
+    for r in records:
+        assert r.content_id in text
+    assert text.endswith(str(macro) + "\n")
+    provenance.close()
+
+
+def test_unmodified_array_not_copied(tmp_path):
+    provenance = ProvenanceStore(tmp_path)
+    writes = []
+    write = provenance._write
+    provenance._write = lambda arr: writes.append(arr) or write(arr)
+
+    a = np.zeros(3)
+    provenance.snapshot("a", a)
+    provenance.flush()
+    provenance.snapshot("b", a)
+    assert len(provenance.records()) == 2
+    assert len(writes) == 1
+
+    a[0] = 1
+    provenance.snapshot("a", a)
+    records = provenance.records()
+    assert len(writes) == 2
+    assert [r.expr for r in records] == ["a", "b", "a"]
+    assert records[0].content_id == records[1].content_id
+    assert records[2].content_id == content_id(a)
+    provenance.close()
+
+
+def test_failed_save_does_not_stop_writer(tmp_path):
+    provenance = ProvenanceStore(tmp_path, max_pending=1)
+    write = provenance._write
+
+    def _write(arr):
+        if arr[0] == 0:
+            raise OSError("disk full")
+        return write(arr)
+
+    provenance._write = _write
+    for i in range(5):
+        provenance.snapshot(f"x{i}", np.full(3, i))
+    assert [r.expr for r in provenance.records()] == ["x1", "x2", "x3", "x4"]
+    provenance.close()
+
+
+def test_layer_data(tmp_path):
+    from napari.layers import Image
+
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    provenance = macro.track_provenance(tmp_path)
+
+    @macro.record
+    def measure(layer: Image) -> float:
+        return float(layer.data.mean())
+
+    layer = Image(np.arange(9.0).reshape(3, 3))
+    measure(layer)
+    layer_sym = str(macro[0].args[1].args[1])
+    records = provenance.records()
+    assert [r.expr for r in records] == [f"{layer_sym}.data"]
+    np.testing.assert_equal(provenance.load(records[0].content_id), layer.data)
+    provenance.close()
+
+
+def test_writer_stops(tmp_path, monkeypatch):
+    from napari_macrokit import _provenance
+
+    monkeypatch.setattr(_provenance, "_IDLE_TIMEOUT", 0.01)
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    provenance = macro.track_provenance(tmp_path / "first")
+    provenance.snapshot("a", np.zeros(3))
+    thread = provenance._thread
+    assert thread is not None
+    # replacing the store stops the writer of the old one
+    macro.track_provenance(tmp_path / "second")
+    assert not thread.is_alive()
+    assert provenance._thread is None
+    # the writer is started again when needed
+    provenance.snapshot("b", np.ones(3))
+    assert len(provenance.records()) == 2
+    thread = provenance._thread
+    if thread is not None:
+        thread.join()
+    assert provenance._thread is None
@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+
+from napari_macrokit import symbol_of
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def test_async_function():
+    macro = NapariMacro()
+
+    @macro.record
+    async def read(i: int, delay: int) -> np.ndarray:
+        await asyncio.sleep(delay * 1e-2)
+        await inner()
+        return np.full(3, i)
+
+    @macro.record
+    async def inner():
+        pass
+
+    async def main():
+        return await asyncio.gather(read(0, 3), read(1, 1), read(2, 2))
+
+    outputs = asyncio.run(main())
+    # ordered by call start, not by completion, and nested calls are not
+    # recorded
+    assert str(macro) == "\n".join(
+        f"{symbol_of(out)} = (await read({i}, {d}))"
+        for i, (out, d) in enumerate(zip(outputs, [3, 1, 2]))
+    )
+    out = macro.execute()
+    np.testing.assert_equal(list(out.values()), outputs)
+
+
+def test_async_lines_share_loop():
+    macro = NapariMacro()
+    loops = []
+
+    @macro.record
+    async def read_in_loop(i: int) -> np.ndarray:
+        loops.append(asyncio.get_running_loop())
+        return np.full(3, i)
+
+    async def main():
+        return [await read_in_loop(0), await read_in_loop(1)]
+
+    asyncio.run(main())
+    loops.clear()
+    macro.execute()
+    # one event loop per execution, closed afterwards
+    assert len(loops) == 2 and loops[0] is loops[1]
+    assert loops[0].is_closed()
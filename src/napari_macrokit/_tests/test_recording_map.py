@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from napari_macrokit import symbol_of
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def test_map():
+    macro = NapariMacro()
+
+    @macro.record
+    def f(x: np.ndarray) -> np.ndarray:
+        g(0)
+        return x + 1
+
+    @macro.record
+    def g(a: int, b: int = 0):
+        pass
+
+    stack = np.zeros((8, 3, 3))
+    outputs = f.map(stack)
+    assert len(outputs) == 8
+    np.testing.assert_equal(np.stack(outputs), stack + 1)
+    assert len(macro) == 1  # nested calls are not recorded
+    assert str(macro[0]) == (
+        f"{symbol_of(outputs)} = [f(_x) for _x in {symbol_of(stack)}]"
+    )
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        g.map([1, 2, 1], (3, 4, 5), executor=executor)
+    assert str(macro[1]) == (
+        "for (_x0, _x1) in zip([1, 2, 1], [3, 4, 5]):\n    g(_x0, _x1)"
+    )
+    out = macro.execute({str(symbol_of(stack)): stack})
+    np.testing.assert_equal(out[str(symbol_of(outputs))], outputs)
+
+
+# functions called in worker processes must be defined at the top level
+_PROCESS_MACRO = NapariMacro()
+
+
+@_PROCESS_MACRO.record
+def _double(x: np.ndarray) -> np.ndarray:
+    return x * 2
+
+
+def test_map_process_pool():
+    _PROCESS_MACRO.clear()
+    stack = np.arange(12).reshape(4, 3)
+    outputs = _PROCESS_MACRO.map(_double, list(stack), executor="process")
+    np.testing.assert_equal(np.stack(outputs), stack * 2)
+    assert len(_PROCESS_MACRO) == 1
+    assert _PROCESS_MACRO[0].args[1].head.name == "list"
+    _PROCESS_MACRO.clear()
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+from napari.types import ImageData
+
+from napari_macrokit import symbol_of
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._process import get_process_pool
+
+# functions called in worker processes must be defined at the top level
+_MACRO = NapariMacro()
+
+
+@_MACRO.record(process=True)
+def _scale_in_process(image: ImageData, factor: float) -> ImageData:
+    return image * factor
+
+
+@_MACRO.record(process=True)
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def test_record_in_process():
+    _MACRO.clear()
+    image = np.arange(256 * 256, dtype=np.float32).reshape(256, 256)
+    out = _scale_in_process(image, 2.0)
+    np.testing.assert_equal(out, image * 2)
+    assert str(_MACRO[0]) == (
+        f"{symbol_of(out)} = _scale_in_process({symbol_of(image)}, 2.0)"
+    )
+    small = _scale_in_process(image[:2, :2], 3.0)
+    np.testing.assert_equal(small, image[:2, :2] * 3)
+
+    pool = get_process_pool()
+    pid = _worker_pid()
+    assert pid != os.getpid()
+    _worker_pid()
+    # workers are reused
+    assert get_process_pool() is pool
+    assert pid in {p.pid for p in pool._processes.values()}
+    assert len(_MACRO) == 4
+    _MACRO.clear()
+
+
+def _ones(n: int) -> np.ndarray:
+    return np.ones(n)
+
+
+def test_output_block_kept_until_received():
+    import time
+
+    from napari_macrokit import _process
+
+    # run the worker side in this process
+    out = _process._run_in_worker(_ones, (1 << 14,), {})
+    assert isinstance(out, _process.SharedArray)
+    # the worker keeps the block open until the caller copies it out
+    assert [shm.name for shm in _process._PENDING] == [out.name]
+    arr = _process._receive(out)
+    np.testing.assert_equal(arr, np.ones(1 << 14))
+    for _ in range(100):
+        if not _process._PENDING:
+            break
+        time.sleep(0.01)
+    assert not _process._PENDING
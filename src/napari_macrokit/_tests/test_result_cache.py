@@ -0,0 +1,122 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from napari_macrokit import ResultCache
+from napari_macrokit._macrokit_ext import NapariMacro
+from napari_macrokit._rename import SymbolGenerator
+from napari_macrokit._result_cache import argument_id, function_fingerprint
+
+_NCALLS = Counter()
+
+
+def denoise(img: np.ndarray, sigma: float = 1.0) -> np.ndarray:
+    _NCALLS["denoise"] += 1
+    return img * sigma
+
+
+def measure(img: np.ndarray) -> dict:
+    _NCALLS["measure"] += 1
+    return {"mean": float(img.mean())}
+
+
+class _Factor:
+    """An argument that cannot be fingerprinted."""
+
+    def __rmul__(self, other):
+        return other
+
+
+def _record(cache: ResultCache):
+    # a new macro for each session
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    return macro, macro.record(denoise, cache=cache)
+
+
+def test_cache_across_sessions(tmp_path):
+    cache = ResultCache(tmp_path)
+    _NCALLS.clear()
+    img = np.arange(6, dtype=float).reshape(2, 3)
+    macro0, f0 = _record(cache)
+    out0 = f0(img, sigma=2.0)
+    assert _NCALLS["denoise"] == 1
+
+    macro1, f1 = _record(ResultCache(tmp_path))
+    out1 = f1(img.copy(), sigma=2.0)
+    assert _NCALLS["denoise"] == 1
+    np.testing.assert_equal(out1, out0)
+    # memory-mapped but a plain ndarray
+    assert type(out1) is np.ndarray
+    assert not out1.flags.owndata
+    assert str(macro1) == "arr1 = denoise(arr0, sigma=2.0)"
+
+    f1(img, sigma=3.0)
+    f1(img + 1, sigma=2.0)
+    assert _NCALLS["denoise"] == 3
+
+
+def test_pickled_output(tmp_path):
+    cache = ResultCache(tmp_path)
+    _NCALLS.clear()
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    f = macro.record(measure, cache=cache)
+    assert f(np.ones(3)) == {"mean": 1.0}
+    assert f(np.ones(3)) == {"mean": 1.0}
+    assert _NCALLS["measure"] == 1
+    assert len(macro) == 2
+
+
+def test_argument_id(tmp_path):
+    assert argument_id(np.zeros(3)) == argument_id(np.zeros(3))
+    assert argument_id(np.zeros(3)) != argument_id(np.zeros(3, dtype=int))
+    assert argument_id([1, "a", (2.0, None)]) is not None
+    assert argument_id(object()) is None
+    assert argument_id([1, object()]) is None
+    path = tmp_path / "a.txt"
+    path.write_text("a")
+    id0 = argument_id(path)
+    str_id0 = argument_id(str(path))
+    assert str_id0 not in (id0, argument_id("a.txt"))
+    path.write_text("ab")
+    assert argument_id(path) != id0
+    assert argument_id(str(path)) != str_id0
+    assert argument_id(str(tmp_path / "b.txt")) == (
+        f"str:{str(tmp_path / 'b.txt')!r}"
+    )
+    assert function_fingerprint(denoise) != function_fingerprint(measure)
+
+
+def test_uncacheable_argument(tmp_path):
+    cache = ResultCache(tmp_path)
+    _NCALLS.clear()
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+    f = macro.record(denoise, cache=cache)
+    f(np.ones(2), sigma=_Factor())
+    f(np.ones(2), sigma=_Factor())
+    assert _NCALLS["denoise"] == 2
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_eviction(tmp_path):
+    # each array is about 1 kB
+    cache = ResultCache(tmp_path, max_bytes=4000)
+    for i in range(10):
+        cache.save(f"key{i}", np.full(100, i, dtype=np.float64))
+        assert sum(f.stat().st_size for f in tmp_path.iterdir()) <= 4000
+    # the latest outputs are kept
+    np.testing.assert_equal(cache.load("key9"), np.full(100, 9.0))
+    with pytest.raises(KeyError):
+        cache.load("key0")
+    cache.clear()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_not_supported():
+    macro = NapariMacro(symbol_generator=SymbolGenerator())
+
+    def gen():
+        yield 0
+
+    with pytest.raises(TypeError):
+        macro.record(gen, cache=True)
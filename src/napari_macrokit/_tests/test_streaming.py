@@ -0,0 +1,54 @@
+from typing import Iterator
+
+import numpy as np
+
+from napari_macrokit import symbol_of
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def _make_macro():
+    macro = NapariMacro()
+    produced = []
+
+    @macro.record
+    def g(i: int):
+        pass
+
+    @macro.record
+    def planes(stack: np.ndarray) -> Iterator[np.ndarray]:
+        for i, plane in enumerate(stack):
+            g(-1)
+            produced.append(i)
+            yield plane * 2
+
+    return macro, g, planes, produced
+
+
+def test_generator_is_lazy():
+    macro, g, planes, produced = _make_macro()
+    stack = np.arange(12).reshape(3, 2, 2)
+    gen = planes(stack)
+    assert len(macro) == 1
+    assert str(macro[0]) == f"{symbol_of(gen)} = planes({symbol_of(stack)})"
+    assert produced == []
+    for i, chunk in enumerate(gen):
+        assert produced == list(range(i + 1))
+        g(i)
+    # calls from the generator are not recorded but calls from the consumer
+    # are recorded
+    assert len(macro) == 4
+    assert [str(line) for line in macro[1:]] == ["g(0)", "g(1)", "g(2)"]
+
+
+def test_stream_to_layer():
+    macro, g, planes, _ = _make_macro()
+    stack = np.arange(60).reshape(5, 3, 4)
+    layer = macro.stream_to_layer(planes(stack), name="out")
+    assert layer.name == "out"
+    np.testing.assert_equal(layer.data, stack * 2)
+    assert len(macro) == 2
+    assert str(macro[1]).endswith(
+        f"stream_to_layer({macro[0].args[0]}, None, 'out')"
+    )
+    out = macro.execute({str(symbol_of(stack)): stack})
+    np.testing.assert_equal(list(out.values())[-1].data, stack * 2)
@@ -0,0 +1,53 @@
+import pytest
+
+from napari_macrokit._tests._pipeline import NCALLS, make_macro
+
+
+def test_sweep():
+    macro = make_macro()
+    result = macro.sweep(
+        {("arr1", "sigma"): [1.0, 2.0], (2, "thresh"): [0.5, 2.5, 4.5]}
+    )
+    assert result.shape == (2, 3)
+    table = result.table
+    assert list(table.columns) == ["sigma", "thresh", "int0"]
+    assert table["int0"].tolist() == [3, 1, 0, 3, 2, 1]
+    # upstream lines are shared
+    assert NCALLS == {"load": 1, "gaussian_filter": 2, "threshold": 6}
+    assert result.stack("int0").shape == (2, 3)
+
+    best = result.to_macro(table.index[table["int0"] == 2][0])
+    assert str(best).splitlines()[1:3] == [
+        "arr1 = gaussian_filter(arr0, sigma=2.0)",
+        "arr2 = threshold(arr1, thresh=2.5)",
+    ]
+    # the original macro is not changed
+    assert (
+        str(macro).splitlines()[1] == "arr1 = gaussian_filter(arr0, sigma=1.0)"
+    )
+
+
+def test_sweep_outputs():
+    macro = make_macro()
+    result = macro.sweep({(0, 0): [3, 5]}, outputs=["arr1"])
+    assert NCALLS == {"load": 2, "gaussian_filter": 2}
+    stack = [arr.tolist() for arr in result.table["arr1"]]
+    assert stack == [[0, 1, 2], [0, 1, 2, 3, 4]]
+    with pytest.raises(ValueError):
+        macro.sweep({("int0", 0): [1]}, outputs=["arr1"])
+    with pytest.raises(ValueError):
+        macro.sweep({("arr1", "sigma"): [1]}, outputs=["arr4"])
+
+
+def test_sweep_in_process():
+    macro = make_macro()
+    result = macro.sweep(
+        {("arr1", "sigma"): [0.1, 2.0]}, executor="process", max_workers=2
+    )
+    assert result.table["int0"].tolist() == [0, 3]
+
+
+def test_sweep_unhashable_values():
+    macro = make_macro()
+    result = macro.sweep({(2, "thresh"): [[0.5], [2.5]]})
+    assert result.table["int0"].tolist() == [3, 1]
@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from napari_macrokit import symbol_of
+from napari_macrokit._macrokit_ext import NapariMacro
+
+
+def test_record_from_thread_pool():
+    macro = NapariMacro()
+    n_calls = 400
+
+    @macro.record
+    def f(i: int) -> np.ndarray:
+        time.sleep(np.random.random() * 1e-3)
+        return np.full(3, i)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outputs = list(executor.map(f, range(n_calls)))
+
+    assert len(macro) == n_calls
+    names = [str(line.args[0]) for line in macro]
+    assert len(set(names)) == n_calls
+    assert {symbol_of(out).name for out in outputs} == set(names)
+
+    # symbols are numbered in the order of lines
+    prefix = names[0].rstrip("0123456789")
+    start = int(names[0][len(prefix) :])
+    assert names == [f"{prefix}{start + i}" for i in range(n_calls)]
+
+
+def test_thread_pool_with_merge():
+    macro = NapariMacro()
+
+    @macro.record(merge=True)
+    def f(i: int) -> np.ndarray:
+        time.sleep(np.random.random() * 1e-3)
+        return np.full(3, i)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outputs = list(executor.map(f, range(200)))
+
+    assert len(macro) == 1
+    names = [symbol_of(out).name for out in outputs]
+    assert str(macro[0].args[0]) in names
+
+
+def test_exception_does_not_block():
+    macro = NapariMacro()
+
+    @macro.record
+    def f(i: int):
+        if i % 3 == 0:
+            raise ValueError
+        return None
+
+    def _run(i):
+        try:
+            f(i)
+        except ValueError:
+            pass
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_run, range(30)))
+
+    assert len(macro) == 20
+
+
+def test_nested_call_not_recorded():
+    macro = NapariMacro()
+
+    @macro.record
+    def inner(i: int):
+        pass
+
+    @macro.record
+    def outer(i: int):
+        inner(i)
+
+    outer(0)
+    assert len(macro) == 1
+    assert str(macro[0]) == "outer(0)"
+
+
+def test_callback_records_call():
+    import threading
+
+    macro = NapariMacro()
+
+    @macro.record
+    def f(i: int):
+        pass
+
+    def _on_appended(expr):
+        if str(expr) == "f(0)":
+            f(1)
+
+    macro.on_appended.append(_on_appended)
+    # run in a thread not to hang the test if it deadlocks
+    thread = threading.Thread(target=f, args=(0,), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert [str(line) for line in macro] == ["f(0)", "f(1)"]
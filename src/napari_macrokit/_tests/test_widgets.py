@@ -1,7 +1,7 @@
 from pytestqt.qtbot import QtBot
 from qtpy.QtCore import QPoint, Qt
 
-from napari_macrokit import available_keys, temp_macro
+from napari_macrokit import available_keys, get_macro, temp_macro
 from napari_macrokit._widgets import QMacroView
 
 
@@ -40,6 +40,35 @@ def test_construction_after_adding_macro(qtbot: QtBot):
         assert wdt._tabwidget.widget(1).text() == str(m1)
 
 
+def test_lazy_tabs(qtbot: QtBot):
+    from napari_macrokit._widgets._code_editor import QCodeEditor
+    from napari_macrokit._widgets._tab_widget import QMacroTabPlaceholder
+
+    with temp_macro(["m0", "m1", "m2"]) as macros:
+        wdt = QMacroView()
+        qtbot.addWidget(wdt)
+        tab = wdt._tabwidget
+        assert tab.count() == 3
+        assert tab.currentIndex() == 2
+        assert isinstance(tab.widget(0), QMacroTabPlaceholder)
+        assert isinstance(tab.widget(1), QMacroTabPlaceholder)
+        assert isinstance(tab.widget(2), QCodeEditor)
+
+        # changes are not rendered until the tab is activated
+        macros[0].append("a = 0")
+        macros[0].append("b = 0")
+        macros[0].pop()
+        assert tab.widget(0).text() == str(macros[0])
+        tab.setCurrentIndex(0)
+        assert isinstance(tab.widget(0), QCodeEditor)
+        assert tab.currentIndex() == 0
+        assert tab.tabText(0) == "m0"
+        assert tab.widget(0).text() == str(macros[0])
+        macros[0].append("c = 0")
+        assert tab.widget(0).text() == str(macros[0])
+        assert isinstance(tab.widget(1), QMacroTabPlaceholder)
+
+
 def test_erase_last(qtbot: QtBot):
     with temp_macro("m0") as macro:
         wdt = QMacroView()
@@ -56,6 +85,49 @@ def test_erase_last(qtbot: QtBot):
         assert wdt._tabwidget.widget(0).text() == str(macro)
 
 
+def test_erase_folded_loop(qtbot: QtBot):
+    with temp_macro("m0") as macro:
+        wdt = QMacroView()
+        qtbot.addWidget(wdt)
+        macro.set_auto_fold(3)
+
+        @macro.record
+        def f(x: int):
+            pass
+
+        @macro.record
+        def g():
+            pass
+
+        g()
+        for i in range(5):
+            f(i)
+        assert len(macro) == 2
+        assert wdt._tabwidget.widget(0).text() == str(macro)
+        macro.pop()
+        assert wdt._tabwidget.widget(0).text() == str(macro)
+
+
+def test_delete_lines(qtbot: QtBot):
+    with temp_macro("m0") as macro:
+        wdt = QMacroView()
+        qtbot.addWidget(wdt)
+        for i in range(6):
+            macro.append(f"a{i} = {i}")
+        macro.append("for i in range(3):\n    print(i)")
+        macro.append("b = 0")
+        editor = wdt._tabwidget.widget(0)
+        assert editor.text() == str(macro)
+        macro.delete(slice(2, 4))
+        assert editor.text() == str(macro)
+        macro.truncate(-2)
+        assert editor.text() == str(macro)
+        macro.delete(0)
+        assert editor.text() == str(macro)
+        macro.clear()
+        assert editor.text() == ""
+
+
 def test_duplicate(qtbot: QtBot):
     wdt = QMacroView()
     qtbot.addWidget(wdt)
@@ -87,3 +159,165 @@ def test_left_area(qtbot: QtBot):
             pos=topleft + QPoint(2, 2),
         )
         qtbot.mouseMove(editor._line_number_area, pos=topleft + QPoint(2, 5))
+
+
+def test_virtual_view(qtbot: QtBot):
+    from napari_macrokit._widgets._macro_list_view import QMacroListView
+
+    wdt = QMacroView()
+    qtbot.addWidget(wdt)
+    wdt._tabwidget.virtual_view_threshold = 10
+    with temp_macro("m0") as macro:
+        for i in range(20):
+            macro.append(f"a{i} = {i}")
+        wdt._tabwidget.add_macro(macro, "m0-virtual")
+        view = wdt._tabwidget.widget(wdt._tabwidget.count() - 1)
+        assert isinstance(view, QMacroListView)
+        assert view.model().rowCount() == 20
+        macro.append("b = 0")
+        assert view.model().rowCount() == 21
+        macro.pop()
+        assert view.model().rowCount() == 20
+        macro.truncate(18)
+        assert view.model().rowCount() == 18
+        assert view.text() == str(macro)
+        view.selectAll()
+        assert view.selectedText() == str(macro)
+        wdt._tabwidget.add_duplicate(wdt._tabwidget.count() - 1)
+        view.grab()
+
+
+def test_virtual_view_on_append(qtbot: QtBot):
+    from napari_macrokit._widgets._code_editor import QCodeEditor
+    from napari_macrokit._widgets._macro_list_view import QMacroListView
+
+    wdt = QMacroView()
+    qtbot.addWidget(wdt)
+    tabs = wdt._tabwidget
+    tabs.virtual_view_threshold = 10
+    with temp_macro("m0") as macro:
+        for i in range(5):
+            macro.append(f"a{i} = {i}")
+        tabs.add_macro(macro, "m0-grow")
+        index = tabs.count() - 1
+        assert isinstance(tabs.widget(index), QCodeEditor)
+        for i in range(10):
+            macro.append(f"b{i} = {i}")
+        qtbot.waitUntil(lambda: isinstance(tabs.widget(index), QMacroListView))
+        assert tabs.tabText(index) == "m0-grow"
+        assert tabs.widget(index).model().rowCount() == 15
+        macro.append("c = 0")
+        assert tabs.widget(index).model().rowCount() == 16
+
+
+def test_rows_removed_before_lines(qtbot: QtBot):
+    from napari_macrokit._widgets._macro_list_view import QMacroListModel
+
+    with temp_macro("m0") as macro:
+        for i in range(10):
+            macro.append(f"a{i} = {i}")
+        model = QMacroListModel(macro)
+        removing = []
+        model.rowsAboutToBeRemoved.connect(
+            lambda _, first, last: removing.append((first, last, len(macro)))
+        )
+        macro.pop()
+        macro.truncate(5)
+        assert removing == [(9, 9, 10), (5, 8, 9)]
+        assert model.rowCount() == 5
+
+
+def test_highlight_fallback(qtbot: QtBot):
+    from qtpy.QtWidgets import QWidget
+
+    from napari_macrokit._widgets._code_editor import QCodeEditor
+
+    parent = QWidget()
+    qtbot.addWidget(parent)
+    editor = QCodeEditor(parent)
+    editor.syntaxHighlight(max_lines=5)
+    assert editor._highlight.document() is editor.document()
+    editor.setText("\n".join(f"a{i} = f({i})" for i in range(4)))
+    assert editor._highlight.document() is editor.document()
+    editor.appendPlainText("b = 0\nc = 1")
+    assert editor._highlight.document() is None
+
+
+def test_detach_on_exit(qtbot: QtBot):
+    wdt = QMacroView()
+    qtbot.addWidget(wdt)
+    tabs = wdt._tabwidget
+    with temp_macro("m0") as macro:
+        macro.append("a = 0")
+        assert get_macro("m0") is macro
+        assert tabs.count() == 1
+        editor = tabs.widget(0)
+        assert len(macro.on_appended) == 1
+    # the editor keeps the text but does not follow the macro anymore
+    assert len(macro.on_appended) == 0
+    assert editor._macro is None
+    assert editor.toPlainText() == "a = 0"
+    tabs.remove_editor(0)
+    assert tabs.count() == 0
+
+    with temp_macro("m1") as macro:
+        index = tabs.index_of(macro)
+        tabs.remove_macro(index)
+        assert tabs.count() == 0
+        assert len(macro.on_appended) == 0
+
+
+def test_go_to_definition(qtbot: QtBot):
+    with temp_macro("m0") as macro:
+        wdt = QMacroView()
+        qtbot.addWidget(wdt)
+        macro.append("a = 0")
+        macro.append("for i in range(3):\n    print(i)")
+        macro.append("b = a")
+        macro.append("c = a + b")
+        editor = wdt._tabwidget.widget(0)
+        assert editor.goToDefinition("b")
+        assert editor.textCursor().blockNumber() == 3
+        assert editor.textCursor().selectedText() == "b = a"
+        assert not editor.goToDefinition("d")
+        assert editor.highlightUsages("a") == [0, 3, 4]
+        assert len(editor.extraSelections()) == 3
+        # the word under the cursor is used
+        editor.setTextCursor(editor.textCursor())
+        qtbot.keyClick(editor, Qt.Key.Key_End)
+        qtbot.keyClick(editor, Qt.Key.Key_F12)
+        assert editor.textCursor().blockNumber() == 0
+
+
+def test_update_from_thread(qtbot: QtBot):
+    import threading
+
+    from qtpy.QtWidgets import QWidget
+
+    from napari_macrokit._macrokit_ext import NapariMacro
+    from napari_macrokit._widgets._code_editor import QCodeEditor
+    from napari_macrokit._widgets._macro_list_view import QMacroListView
+
+    macro = NapariMacro()
+    parent = QWidget()
+    qtbot.addWidget(parent)
+    editor = QCodeEditor(parent, macro=macro)
+    view = QMacroListView(parent, macro=macro)
+    threads = []
+    macro.on_appended.append(
+        lambda expr: threads.append(threading.get_ident())
+    )
+
+    @macro.record
+    def f(i: int):
+        pass
+
+    worker = threading.Thread(target=lambda: [f(i) for i in range(3)])
+    worker.start()
+    worker.join()
+    # widgets are updated in the main thread
+    assert editor.toPlainText() == ""
+    qtbot.waitUntil(lambda: editor.toPlainText() == str(macro))
+    qtbot.waitUntil(lambda: view.model().rowCount() == 3)
+    assert threads == [worker.ident] * 3
+    assert view.text() == "f(0)\nf(1)\nf(2)"
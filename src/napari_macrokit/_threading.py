@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import itertools
+import threading
+from typing import Callable
+
+
+class OrderedCommitter:
+    """
+    Commit callbacks in the order of tickets.
+
+    A ticket is reserved when a recorded function is called and the line is
+    committed when the function returns. Lines of calls that finished earlier
+    than the preceding calls are staged until all the preceding calls are
+    committed or canceled, so that the macro is always ordered by call start.
+    Reserving a ticket does not acquire any lock.
+
+    Callbacks are run out of the lock by one thread at a time, so a callback
+    may call a recorded function. Its line is committed after the callback.
+    """
+
+    def __init__(self):
+        self._counter = itertools.count()
+        self._next = 0
+        self._staged: dict[int, Callable[[], None] | None] = {}
+        self._draining = False
+        self._lock = threading.Lock()
+
+    def reserve(self) -> int:
+        """Reserve a new ticket."""
+        # next() of itertools.count is atomic
+        return next(self._counter)
+
+    def commit(self, ticket: int, callback: Callable[[], None] | None) -> None:
+        """Stage a callback and run all the callbacks that are ready."""
+        with self._lock:
+            self._staged[ticket] = callback
+            if self._draining:
+                # the draining thread runs the callback in order
+                return
+            self._draining = True
+        try:
+            while True:
+                with self._lock:
+                    if self._next not in self._staged:
+                        self._draining = False
+                        return
+                    cb = self._staged.pop(self._next)
+                    self._next += 1
+                if cb is not None:
+                    cb()
+        except BaseException:
+            with self._lock:
+                self._draining = False
+            raise
+
+    def cancel(self, ticket: int) -> None:
+        """Cancel a ticket so that it will not block the following ones."""
+        return self.commit(ticket, None)
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import sys
+import threading
+from functools import partial
+from typing import Callable
 
 from macrokit import BaseMacro
 from qtpy import QtCore, QtGui
@@ -8,6 +11,20 @@ from qtpy import QtWidgets as QtW
 from qtpy.QtCore import Qt
 
 
+def get_monospace_font(size: int) -> QtGui.QFont:
+    """Return a platform-dependent monospace font."""
+    if sys.platform == "win32":
+        _font = "Consolas"
+    elif sys.platform == "darwin":
+        _font = "Menlo"
+    else:
+        _font = "Monospace"
+    font = QtGui.QFont(_font, size)
+    font.setStyleHint(QtGui.QFont.StyleHint.Monospace)
+    font.setFixedPitch(True)
+    return font
+
+
 class QLineNumberArea(QtW.QWidget):
     def __init__(self, editor: QCodeEditor):
         super().__init__(editor)
@@ -58,16 +75,7 @@ class QCodeEditor(QtW.QPlainTextEdit):
         self, parent: QtW.QWidget | None = None, macro: BaseMacro | None = None
     ):
         super().__init__(parent)
-        if sys.platform == "win32":
-            _font = "Consolas"
-        elif sys.platform == "darwin":
-            _font = "Menlo"
-        else:
-            _font = "Monospace"
-        font = QtGui.QFont(_font, self.font().pointSize())
-        font.setStyleHint(QtGui.QFont.StyleHint.Monospace)
-        font.setFixedPitch(True)
-        self.setFont(font)
+        self.setFont(get_monospace_font(self.font().pointSize()))
 
         self._line_number_area = QLineNumberArea(self)
 
@@ -81,28 +89,46 @@ class QCodeEditor(QtW.QPlainTextEdit):
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.customContextMenuRequested.connect(self._show_context_menu)
 
+        self._highlight = None
         self.syntaxHighlight()
 
         self._macro = macro
+        self._macro_callbacks: list[tuple[list, Callable]] = []
+        self._usage_selections: list[QtW.QTextEdit.ExtraSelection] = []
         if macro is not None:
             self.connectMacro(macro)
 
         self.setMinimumHeight(100)
 
     def connectMacro(self, macro: BaseMacro):
-        @macro.on_appended.append
         def _on_appended(expr):
             self.appendPlainText(str(expr))
             cursor = self.textCursor()
             cursor.movePosition(QtGui.QTextCursor.MoveOperation.Start)
             self.setTextCursor(cursor)
 
-        @macro.on_popped.append
         def _on_removed(expr):
-            self.eraseLast()
-
+            self.eraseLast(str(expr).count("\n") + 1)
+
+        def _on_deleted(start: int, lines):
+            # macro is already updated at this point
+            first = sum(_count_lines(line) for line in macro.args[:start])
+            nblocks = sum(_count_lines(line) for line in lines)
+            self.eraseBlocks(first, nblocks)
+
+        pairs = [
+            (macro.on_appended, _on_appended),
+            (macro.on_popped, _on_removed),
+        ]
+        if (on_deleted := getattr(macro, "on_deleted", None)) is not None:
+            pairs.append((on_deleted, _on_deleted))
+        self._macro_callbacks = connect_callbacks(self, pairs)
         return self.setPlainText(str(macro))
 
+    def disconnectMacro(self):
+        """Stop following the macro."""
+        disconnect_callbacks(self._macro_callbacks)
+
     def tabSize(self):
         metrics = self.fontMetrics()
         return self.tabStopWidth() // metrics.width(" ")
@@ -159,9 +185,93 @@ class QCodeEditor(QtW.QPlainTextEdit):
         menu.addAction("Undo", self.undo, "Ctrl+Z").setEnabled(not self.isReadOnly())
         menu.addAction("Redo", self.redo, "Ctrl+Y").setEnabled(not self.isReadOnly())
         # fmt: on
+        if self._macro_query() is not None:
+            word = _word_under(cursor)
+            menu.addSeparator()
+            menu.addAction(
+                "Go to Definition", partial(self.goToDefinition, word), "F12"
+            ).setEnabled(bool(word))
+            menu.addAction(
+                "Highlight Usages",
+                partial(self.highlightUsages, word),
+                "Shift+F12",
+            ).setEnabled(bool(word))
 
         return menu.exec(self.mapToGlobal(pos))
 
+    def keyPressEvent(self, e: QtGui.QKeyEvent) -> None:
+        if e.key() == Qt.Key.Key_F12:
+            if e.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+                self.highlightUsages()
+            else:
+                self.goToDefinition()
+            return None
+        return super().keyPressEvent(e)
+
+    def _macro_query(self):
+        return getattr(self._macro, "query", None)
+
+    def goToDefinition(self, name: str | None = None) -> bool:
+        """
+        Move the cursor to the line that assigns the name.
+
+        If ``name`` is not given, the word under the cursor is used. Return
+        true if the definition is found.
+        """
+        if (query := self._macro_query()) is None:
+            return False
+        if name is None:
+            name = _word_under(self.textCursor())
+        if (index := query.definition(name)) is None:
+            return False
+        block = self.document().findBlockByNumber(query.text_line(index))
+        cursor = self.textCursor()
+        cursor.setPosition(block.position())
+        cursor.select(QtGui.QTextCursor.SelectionType.LineUnderCursor)
+        self.setTextCursor(cursor)
+        self.centerCursor()
+        return True
+
+    def highlightUsages(self, name: str | None = None) -> list[int]:
+        """
+        Highlight the lines that assign or refer to the name.
+
+        If ``name`` is not given, the word under the cursor is used. The
+        highlight is cleared when the cursor is moved. Return the numbers of
+        the highlighted lines in the text.
+        """
+        if (query := self._macro_query()) is None:
+            return []
+        if name is None:
+            name = _word_under(self.textCursor())
+        bgcolor = self.palette().color(self.backgroundRole())
+        colors = {
+            "usage": QtGui.QColor(
+                bgcolor.red() - 20, bgcolor.green(), bgcolor.blue() - 20
+            ),
+            "definition": QtGui.QColor(
+                bgcolor.red(), bgcolor.green() - 20, bgcolor.blue() - 40
+            ),
+        }
+        kinds = dict.fromkeys(query.usages(name), "usage")
+        kinds.update(dict.fromkeys(query.definitions(name), "definition"))
+        doc = self.document()
+        selections = []
+        linenos = []
+        for index in sorted(kinds):
+            lineno = query.text_line(index)
+            selection = QtW.QTextEdit.ExtraSelection()
+            selection.format.setBackground(colors[kinds[index]])
+            selection.format.setProperty(
+                QtGui.QTextFormat.Property.FullWidthSelection, True
+            )
+            selection.cursor = QtGui.QTextCursor(doc.findBlockByNumber(lineno))
+            selections.append(selection)
+            linenos.append(lineno)
+        self._usage_selections = selections
+        self.setExtraSelections(selections)
+        return linenos
+
     def _iter_visible_blocks(self, rect: QtCore.QRect = None):
         if rect is None:
             rect = self.viewport().rect()
@@ -218,6 +328,7 @@ class QCodeEditor(QtW.QPlainTextEdit):
 
     def _highlight_current_line(self):
         extraSelections = []
+        self._usage_selections = []
 
         bgcolor = self.palette().color(self.parentWidget().backgroundRole())
         _highlight_color = QtGui.QColor(
@@ -235,11 +346,26 @@ class QCodeEditor(QtW.QPlainTextEdit):
             extraSelections.append(selection)
         self.setExtraSelections(extraSelections)
 
-    def syntaxHighlight(self, lang: str = "python", theme: str = "default"):
-        """Highlight syntax."""
-        from superqt.utils import CodeSyntaxHighlight
-
-        highlight = CodeSyntaxHighlight(self.document(), lang, theme=theme)
+    def syntaxHighlight(
+        self,
+        lang: str = "python",
+        theme: str = "default",
+        max_lines: int | None = None,
+    ):
+        """
+        Highlight syntax.
+
+        Formats are cached per line and shared between editors. If the number
+        of lines exceeds ``max_lines``, text will be rendered without
+        highlighting.
+        """
+        from ._highlight import QCachedSyntaxHighlight
+
+        if self._highlight is not None:
+            self._highlight.setDocument(None)
+        highlight = QCachedSyntaxHighlight(
+            self.document(), lang, theme=theme, max_lines=max_lines
+        )
         self._highlight = highlight
         return None
 
@@ -256,11 +382,114 @@ class QCodeEditor(QtW.QPlainTextEdit):
         """Set the text."""
         self.setPlainText(text.replace("\n", "\u2029"))
 
-    def eraseLast(self):
-        """Erase the last line."""
+    def eraseLast(self, nlines: int = 1):
+        """Erase the last line(s)."""
         cursor = self.textCursor()
         cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
-        cursor.select(QtGui.QTextCursor.SelectionType.LineUnderCursor)
+        if nlines > 1:
+            cursor.movePosition(
+                QtGui.QTextCursor.MoveOperation.PreviousBlock,
+                QtGui.QTextCursor.MoveMode.KeepAnchor,
+                nlines - 1,
+            )
+        cursor.movePosition(
+            QtGui.QTextCursor.MoveOperation.StartOfBlock,
+            QtGui.QTextCursor.MoveMode.KeepAnchor,
+        )
         cursor.removeSelectedText()
         cursor.deletePreviousChar()
         self.setTextCursor(cursor)
+
+    def eraseBlocks(self, start: int, nblocks: int):
+        """Erase ``nblocks`` lines from the ``start``-th line in one edit."""
+        doc = self.document()
+        stop = start + nblocks
+        cursor = QtGui.QTextCursor(doc)
+        if stop < doc.blockCount():
+            # remove the lines with their trailing line breaks
+            cursor.setPosition(doc.findBlockByNumber(start).position())
+            cursor.setPosition(
+                doc.findBlockByNumber(stop).position(),
+                QtGui.QTextCursor.MoveMode.KeepAnchor,
+            )
+        else:
+            # remove the line break before the lines
+            if start > 0:
+                block = doc.findBlockByNumber(start - 1)
+                cursor.setPosition(block.position() + block.length() - 1)
+            cursor.movePosition(
+                QtGui.QTextCursor.MoveOperation.End,
+                QtGui.QTextCursor.MoveMode.KeepAnchor,
+            )
+        cursor.removeSelectedText()
+
+
+def _word_under(cursor: QtGui.QTextCursor) -> str:
+    cursor = QtGui.QTextCursor(cursor)
+    cursor.select(QtGui.QTextCursor.SelectionType.WordUnderCursor)
+    return cursor.selectedText()
+
+
+def _count_lines(line) -> int:
+    return str(line).count("\n") + 1
+
+
+class _ThreadCaller(QtCore.QObject):
+    """Call functions in the GUI thread."""
+
+    _called = QtCore.Signal(object, object, object)
+
+    def __init__(self):
+        super().__init__()
+        self._called.connect(self._call, Qt.ConnectionType.QueuedConnection)
+
+    def _call(self, callbacks: list, cb: Callable, args: tuple):
+        # the widget may have been destroyed while the call was queued
+        if cb in callbacks:
+            cb(*args)
+
+
+_CALLER: _ThreadCaller | None = None
+
+
+def _in_gui_thread(callbacks: list, cb: Callable) -> Callable:
+    """Wrap a callback so that calls from other threads are queued."""
+    global _CALLER
+    if _CALLER is None:
+        _CALLER = _ThreadCaller()
+
+    def _cb(*args):
+        if threading.current_thread() is threading.main_thread():
+            cb(*args)
+        else:
+            _CALLER._called.emit(callbacks, _cb, args)
+
+    return _cb
+
+
+def connect_callbacks(
+    widget: QtCore.QObject, pairs: list[tuple[list, Callable]]
+) -> list[tuple[list, Callable]]:
+    """
+    Append callbacks to the callback lists of a macro.
+
+    Callbacks called from other threads, such as when a recorded function is
+    called in a thread pool, are queued to the GUI thread. The callbacks are
+    removed when the widget is destroyed, so that the macro does not keep
+    calling (and referring to) a deleted widget.
+    """
+    pairs = [
+        (callbacks, _in_gui_thread(callbacks, cb)) for callbacks, cb in pairs
+    ]
+    for callbacks, cb in pairs:
+        callbacks.append(cb)
+    widget.destroyed.connect(partial(disconnect_callbacks, pairs))
+    return pairs
+
+
+def disconnect_callbacks(pairs: list[tuple[list, Callable]], *_) -> None:
+    """Remove callbacks from the callback lists of a macro."""
+    for callbacks, cb in pairs:
+        if cb in callbacks:
+            callbacks.remove(cb)
+    pairs.clear()
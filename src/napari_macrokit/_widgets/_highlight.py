@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import TYPE_CHECKING, NamedTuple
+
+from qtpy import QtGui
+
+if TYPE_CHECKING:  # pragma: no cover
+    from pygments.lexer import Lexer
+
+
+class Segment(NamedTuple):
+    """A run of characters that share the same style."""
+
+    start: int
+    text: str
+    color: str | None
+    bold: bool
+    italic: bool
+
+
+@lru_cache(maxsize=None)
+def get_lexer(lang: str = "python") -> Lexer:
+    """Return a lexer shared by all the editors."""
+    from pygments.lexers import find_lexer_class, get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        return get_lexer_by_name(lang)
+    except ClassNotFound as e:
+        if cls := find_lexer_class(lang):
+            return cls()
+        raise ValueError(f"Could not find lexer for language {lang!r}.") from e
+
+
+@lru_cache(maxsize=16384)
+def highlight_segments(
+    line: str, lang: str = "python", theme: str = "default"
+) -> tuple[Segment, ...]:
+    """Split a line into styled segments. Results are cached per line."""
+    from pygments.styles import get_style_by_name
+
+    style = get_style_by_name(theme)
+    out: list[Segment] = []
+    start = 0
+    for token, value in get_lexer(lang).get_tokens(line):
+        value = value.rstrip("\n")
+        if not value:
+            continue
+        st = style.style_for_token(token)
+        color = f"#{st['color']}" if st["color"] else None
+        out.append(Segment(start, value, color, st["bold"], st["italic"]))
+        start += len(value)
+    return tuple(out)
+
+
+@lru_cache(maxsize=1024)
+def _char_format(
+    color: str | None, bold: bool, italic: bool
+) -> QtGui.QTextCharFormat:
+    fmt = QtGui.QTextCharFormat()
+    if color is not None:
+        fmt.setForeground(QtGui.QColor(color))
+    if bold:
+        fmt.setFontWeight(QtGui.QFont.Weight.Bold)
+    if italic:
+        fmt.setFontItalic(True)
+    return fmt
+
+
+class QCachedSyntaxHighlight(QtGui.QSyntaxHighlighter):
+    """
+    A syntax highlighter with per-line format cache.
+
+    Qt only calls ``highlightBlock`` for the blocks that are appended or
+    replaced, and the formats of each line are looked up from a cache shared
+    by all the documents. Once the document grows beyond ``max_lines``, the
+    highlighter detaches itself and the text is rendered plainly.
+    """
+
+    max_lines: int = 20000
+
+    def __init__(
+        self,
+        parent: QtGui.QTextDocument,
+        lang: str = "python",
+        theme: str = "default",
+        max_lines: int | None = None,
+    ):
+        super().__init__(parent)
+        self._lang = lang
+        self._theme = theme
+        get_lexer(lang)  # check if the language is supported
+        if max_lines is not None:
+            self.max_lines = max_lines
+        parent.blockCountChanged.connect(self._on_block_count_changed)
+        self._on_block_count_changed(parent.blockCount())
+
+    def _on_block_count_changed(self, count: int):
+        if count > self.max_lines and self.document() is not None:
+            self.setDocument(None)
+
+    def highlightBlock(self, text: str | None) -> None:
+        if not text:
+            return
+        for seg in highlight_segments(text, self._lang, self._theme):
+            if seg.color is None and not (seg.bold or seg.italic):
+                continue
+            fmt = _char_format(seg.color, seg.bold, seg.italic)
+            self.setFormat(seg.start, len(seg.text), fmt)
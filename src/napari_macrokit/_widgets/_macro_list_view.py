@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from qtpy import QtCore, QtGui
+from qtpy import QtWidgets as QtW
+from qtpy.QtCore import Qt
+
+from ._code_editor import (
+    connect_callbacks,
+    disconnect_callbacks,
+    get_monospace_font,
+)
+from ._highlight import highlight_segments
+
+if TYPE_CHECKING:  # pragma: no cover
+    from macrokit import BaseMacro
+
+
+class QMacroListModel(QtCore.QAbstractListModel):
+    """A list model that exposes each line of a macro as a row."""
+
+    def __init__(self, macro: BaseMacro, parent: QtCore.QObject | None = None):
+        super().__init__(parent)
+        self._macro = macro
+        pairs = [
+            (macro.on_appended, self._on_appended),
+            (macro.on_popped, self._on_popped),
+        ]
+        if (on_deleted := getattr(macro, "on_deleted", None)) is not None:
+            pairs.append((on_deleted, self._on_deleted))
+        if (on_deleting := getattr(macro, "on_deleting", None)) is not None:
+            pairs.append((on_deleting, self._on_deleting))
+        self._macro_callbacks = connect_callbacks(self, pairs)
+        # Rows are counted by the model, as the notifications from other
+        # threads are delivered after the macro is updated.
+        self._nrows = len(macro)
+        self._removing = 0
+
+    def disconnectMacro(self):
+        """Stop following the macro."""
+        disconnect_callbacks(self._macro_callbacks)
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._nrows
+
+    def data(
+        self,
+        index: QtCore.QModelIndex,
+        role: int = Qt.ItemDataRole.DisplayRole,
+    ):
+        if not index.isValid() or index.row() >= len(self._macro):
+            return None
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return str(self._macro[index.row()])
+        return None
+
+    def flags(self, index: QtCore.QModelIndex):
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+
+    def _on_appended(self, expr):
+        nrows = self._nrows
+        self.beginInsertRows(QtCore.QModelIndex(), nrows, nrows)
+        self._nrows += 1
+        self.endInsertRows()
+
+    def _on_deleting(self, start: int, stop: int):
+        self.beginRemoveRows(QtCore.QModelIndex(), start, stop - 1)
+        self._removing = stop - start
+
+    def _on_popped(self, expr):
+        self._end_remove_rows()
+
+    def _on_deleted(self, start: int, lines):
+        self._end_remove_rows()
+
+    def _end_remove_rows(self):
+        if self._removing:
+            self._nrows -= self._removing
+            self._removing = 0
+            self.endRemoveRows()
+        else:
+            # NOTE: macros without "on_deleting" notify only after the lines
+            # are removed, so the rows cannot be removed one by one.
+            self.beginResetModel()
+            self._nrows = len(self._macro)
+            self.endResetModel()
+
+
+class _QMacroLineDelegate(QtW.QStyledItemDelegate):
+    """Paint line numbers and lazily highlighted code of visible rows."""
+
+    def __init__(self, view: QMacroListView):
+        super().__init__(view)
+        self._view = view
+
+    def sizeHint(self, option, index: QtCore.QModelIndex) -> QtCore.QSize:
+        return QtCore.QSize(0, self._view.fontMetrics().height() + 2)
+
+    def paint(
+        self,
+        painter: QtGui.QPainter,
+        option: QtW.QStyleOptionViewItem,
+        index: QtCore.QModelIndex,
+    ):
+        view = self._view
+        rect = option.rect
+        metrics = view.fontMetrics()
+        gutter = view.lineNumberAreaWidth()
+        painter.save()
+        painter.setFont(view.font())
+
+        palette = view.palette()
+        bgcolor = palette.color(view.backgroundRole())
+        painter.fillRect(
+            QtCore.QRect(rect.left(), rect.top(), gutter, rect.height()),
+            QtGui.QColor(
+                bgcolor.red() - 14, bgcolor.green() - 14, bgcolor.blue() + 14
+            ),
+        )
+        if option.state & QtW.QStyle.StateFlag.State_Selected:
+            painter.fillRect(
+                rect.adjusted(gutter, 0, 0, 0),
+                palette.color(QtGui.QPalette.ColorRole.Highlight),
+            )
+
+        text_color = palette.color(view.foregroundRole())
+        painter.setPen(text_color)
+        painter.drawText(
+            QtCore.QRect(rect.left(), rect.top(), gutter - 2, rect.height()),
+            Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter,
+            str(index.row() + 1),
+        )
+
+        text: str = index.data()
+        line, *rest = text.split("\n", 1)
+        if rest:
+            line += " ..."
+        x = rect.left() + gutter + 4
+        baseline = rect.top() + (rect.height() + metrics.ascent()) // 2 - 1
+        for segment in highlight_segments(line):
+            font = painter.font()
+            font.setBold(segment.bold)
+            font.setItalic(segment.italic)
+            painter.setFont(font)
+            if segment.color is None:
+                painter.setPen(text_color)
+            else:
+                painter.setPen(QtGui.QColor(segment.color))
+            painter.drawText(x, baseline, segment.text)
+            x += metrics.horizontalAdvance(segment.text)
+            if x > rect.right():
+                break
+        painter.restore()
+
+
+class QMacroListView(QtW.QListView):
+    """
+    A read-only, virtualized view of a macro.
+
+    Only the visible rows are rendered and highlighted, so that macros with
+    very many lines can be displayed without building a text document.
+    """
+
+    def __init__(
+        self, parent: QtW.QWidget | None = None, macro: BaseMacro | None = None
+    ):
+        super().__init__(parent)
+        self.setFont(get_monospace_font(self.font().pointSize()))
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(
+            QtW.QAbstractItemView.SelectionMode.ExtendedSelection
+        )
+        self.setItemDelegate(_QMacroLineDelegate(self))
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.customContextMenuRequested.connect(self._show_context_menu)
+        self.setMinimumHeight(100)
+
+        self._macro = macro
+        if macro is not None:
+            self.connectMacro(macro)
+
+    def connectMacro(self, macro: BaseMacro):
+        model = QMacroListModel(macro, self)
+        self.setModel(model)
+
+    def disconnectMacro(self):
+        """Stop following the macro."""
+        if (model := self.model()) is not None:
+            model.disconnectMacro()
+
+    def lineNumberAreaWidth(self) -> int:
+        model = self.model()
+        count = max(1, model.rowCount() if model is not None else 0)
+        return 8 + self.fontMetrics().horizontalAdvance("9") * len(str(count))
+
+    def tabSize(self) -> int:
+        return 4
+
+    def _show_context_menu(self, pos: QtCore.QPoint):
+        menu = QtW.QMenu(self.viewport())
+        has_selection = len(self.selectedIndexes()) > 0
+        menu.addAction("Select All", self.selectAll, "Ctrl+A")
+        menu.addAction("Copy", self.copy, "Ctrl+C").setEnabled(has_selection)
+        return menu.exec(self.mapToGlobal(pos))
+
+    def keyPressEvent(self, e: QtGui.QKeyEvent) -> None:
+        if e.matches(QtGui.QKeySequence.StandardKey.Copy):
+            return self.copy()
+        return super().keyPressEvent(e)
+
+    def selectedText(self) -> str:
+        """Return selected lines."""
+        rows = sorted(idx.row() for idx in self.selectedIndexes())
+        return "\n".join(str(self._macro[i]) for i in rows)
+
+    def copy(self):
+        """Copy selected lines to the clipboard."""
+        clipboard = QtW.QApplication.clipboard()
+        clipboard.setText(self.selectedText())
+
+    def text(self) -> str:
+        """Return the text."""
+        if self._macro is None:
+            return ""
+        return str(self._macro)
+
+    toPlainText = text
+
+    def isReadOnly(self) -> bool:
+        return True
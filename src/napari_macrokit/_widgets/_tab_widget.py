@@ -1,10 +1,13 @@
 from __future__ import annotations
 
+from functools import partial
 from typing import TYPE_CHECKING, Callable
 
+from qtpy import QtCore
 from qtpy import QtWidgets as QtW
 
 from ._code_editor import QCodeEditor
+from ._macro_list_view import QMacroListView
 
 if TYPE_CHECKING:  # pragma: no cover
     from napari_macrokit._macrokit_ext import NapariMacro
@@ -66,31 +69,117 @@ def _push_button(text: str, slot: Callable, tooltip: str | None = None):
 
 
 class QMacroViewTabWidget(QtW.QTabWidget):
+    # macros longer than this are shown in a virtualized list view
+    virtual_view_threshold: int = 5000
+
     def __init__(self, parent: QtW.QWidget | None = None):
         super().__init__(parent)
+        self._adding_placeholders = False
+        self.currentChanged.connect(self._on_current_changed)
 
         self.add_all_editors()
 
-    def add_macro(self, macro: NapariMacro, name: str):
-        editor = QCodeEditor(parent=self, macro=macro)
-        editor.setReadOnly(True)
+    def add_macro(self, macro: NapariMacro, name: str, lazy: bool = False):
+        """
+        Add a tab for the macro.
+
+        If ``lazy`` is true, a placeholder is added and the editor will be
+        created when the tab is activated for the first time.
+        """
+        if lazy:
+            widget = QMacroTabPlaceholder(parent=self, macro=macro)
+            self.addTab(widget, name)
+            return widget
+        editor = self._create_editor(macro)
         self.addTab(editor, name)
         self.setCurrentIndex(self.count() - 1)
         return editor
 
-    def add_editor(self, name: str = "main"):
+    def add_editor(self, name: str = "main", lazy: bool = False):
         from napari_macrokit import get_macro
 
         macro = get_macro(name)
-        return self.add_macro(macro, name)
+        return self.add_macro(macro, name, lazy=lazy)
 
     def add_all_editors(self):
         from napari_macrokit import available_keys
 
         existing_names = {self.tabText(i) for i in range(self.count())}
-        for name in available_keys():
-            if name not in existing_names:
-                self.add_editor(name)
+        self._adding_placeholders = True
+        try:
+            for name in available_keys():
+                if name not in existing_names:
+                    self.add_editor(name, lazy=True)
+        finally:
+            self._adding_placeholders = False
+        if self.count() > 0:
+            self.setCurrentIndex(self.count() - 1)
+            self.materialize(self.currentIndex())
+
+    def materialize(self, index: int):
+        """Replace the placeholder at the index with an editor."""
+        placeholder = self.widget(index)
+        if not isinstance(placeholder, QMacroTabPlaceholder):
+            return placeholder
+        editor = self._create_editor(placeholder._macro)
+        name = self.tabText(index)
+        # removing the current tab changes the current index
+        self._adding_placeholders = True
+        try:
+            self.removeTab(index)
+            self.insertTab(index, editor, name)
+        finally:
+            self._adding_placeholders = False
+        placeholder.deleteLater()
+        self.setCurrentIndex(index)
+        return editor
+
+    def _create_editor(self, macro: NapariMacro):
+        if len(macro) > self.virtual_view_threshold:
+            editor = QMacroListView(parent=self, macro=macro)
+        else:
+            editor = QCodeEditor(parent=self, macro=macro)
+            editor.setReadOnly(True)
+            # switch to the virtualized view when the macro grows
+            editor.blockCountChanged.connect(
+                partial(self._on_block_count_changed, editor)
+            )
+        return editor
+
+    def _on_block_count_changed(self, editor: QCodeEditor, *_):
+        macro = editor._macro
+        if (
+            macro is None
+            or len(macro) <= self.virtual_view_threshold
+            or getattr(editor, "_swap_scheduled", False)
+        ):
+            return
+        editor._swap_scheduled = True
+        # callbacks of the macro cannot be disconnected while they are called
+        QtCore.QTimer.singleShot(0, partial(self._swap_to_list_view, editor))
+
+    def _swap_to_list_view(self, editor: QCodeEditor):
+        """Replace a code editor with a virtualized view of the same macro."""
+        index = self.indexOf(editor)
+        if index < 0 or editor._macro is None:
+            return  # removed or detached
+        view = QMacroListView(parent=self, macro=editor._macro)
+        name = self.tabText(index)
+        is_current = self.currentIndex() == index
+        editor.disconnectMacro()
+        self._adding_placeholders = True
+        try:
+            self.removeTab(index)
+            self.insertTab(index, view, name)
+        finally:
+            self._adding_placeholders = False
+        editor.deleteLater()
+        if is_current:
+            self.setCurrentIndex(index)
+
+    def _on_current_changed(self, index: int):
+        if index >= 0 and not self._adding_placeholders:
+            self.materialize(index)
 
     def add_duplicate(self, index: int):
         name = self.tabText(index) + "-copy"
@@ -100,8 +189,50 @@ class QMacroViewTabWidget(QtW.QTabWidget):
         return None
 
     def remove_editor(self, index: int):
-        if self.widget(index)._macro is None:
-            return self.removeTab(index)
+        widget = self.widget(index)
+        if widget._macro is None:
+            self.removeTab(index)
+            # removeTab does not delete the widget
+            widget.deleteLater()
+
+    def index_of(self, macro: NapariMacro) -> int:
+        """Return the index of the tab of the macro, or -1 if not found."""
+        for i in range(self.count()):
+            if getattr(self.widget(i), "_macro", None) is macro:
+                return i
+        return -1
+
+    def remove_macro(self, index: int):
+        """Remove the tab of a macro and stop following the macro."""
+        widget = self.widget(index)
+        if disconnect := getattr(widget, "disconnectMacro", None):
+            disconnect()
+        self.removeTab(index)
+        widget.deleteLater()
+
+    def detach_macro(self, macro: NapariMacro):
+        """Stop following the macro but keep its tabs as static text."""
+        for index in range(self.count()):
+            widget = self.widget(index)
+            if getattr(widget, "_macro", None) is not macro:
+                continue
+            if isinstance(widget, QMacroTabPlaceholder):
+                editor = QCodeEditor(parent=self)
+                editor.setPlainText(widget.text())
+                editor.setReadOnly(True)
+                name = self.tabText(index)
+                self._adding_placeholders = True
+                try:
+                    self.removeTab(index)
+                    self.insertTab(index, editor, name)
+                finally:
+                    self._adding_placeholders = False
+                widget.deleteLater()
+            else:
+                widget.disconnectMacro()
+                if isinstance(widget, QCodeEditor):
+                    # the text is kept by the editor
+                    widget._macro = None
 
     def save_text(self, index: int):
         out, _ = QtW.QFileDialog.getSaveFileName(
@@ -114,5 +245,26 @@ class QMacroViewTabWidget(QtW.QTabWidget):
 
     if TYPE_CHECKING:  # pragma: no cover
 
-        def widget(self, index: int) -> QCodeEditor:
+        def widget(
+            self, index: int
+        ) -> QCodeEditor | QMacroListView | QMacroTabPlaceholder:
             ...
+
+
+class QMacroTabPlaceholder(QtW.QWidget):
+    """
+    A lightweight placeholder of a macro tab.
+
+    The placeholder does not listen to the macro. The editor is created from
+    the latest macro when the tab is activated.
+    """
+
+    def __init__(self, parent: QtW.QWidget | None = None, macro=None):
+        super().__init__(parent)
+        self._macro = macro
+
+    def text(self) -> str:
+        return str(self._macro)
+
+    def toPlainText(self) -> str:
+        return self.text()
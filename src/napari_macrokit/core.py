@@ -13,28 +13,108 @@ from typing import (
 from macrokit import Symbol
 
 if TYPE_CHECKING:  # pragma: no cover
+    from pathlib import Path
+
+    import napari
+
     from ._macrokit_ext import NapariMacro
+    from ._rename import SymbolGenerator
 
 
 _MACROS: dict[str, NapariMacro] = {}
+_NAMESPACES: dict[str, SymbolGenerator] = {}
 
 
-def get_macro(name: str = "main") -> NapariMacro:
-    """Get the macro object of given name."""
-    from ._macrokit_ext import NapariMacro
+def get_macro(name: str = "main", namespace: str | None = None) -> NapariMacro:
+    """
+    Get the macro object of given name.
+
+    Parameters
+    ----------
+    name : str, default is "main"
+        Name of the macro.
+    namespace : str, optional
+        Name of the symbol namespace used when the macro is created. Macros
+        in the same namespace share the symbol names and their counters, while
+        macros in different namespaces are numbered independently. All the
+        macros share the global namespace by default.
+    """
     from ._widgets import QMacroView
 
     if not isinstance(name, str):
         raise TypeError(f"Macro name must be a string, got {type(name)}.")
     macro = _MACROS.get(name, None)
     if macro is None:
-        macro = _MACROS[name] = NapariMacro()
+        macro = _new_macro(name, namespace)
 
+    if widget := QMacroView.current():
+        if widget._tabwidget.index_of(macro) < 0:
+            widget._tabwidget.add_macro(macro, name)
+    return macro
+
+
+def load_macro(
+    path: str | Path,
+    name: str = "main",
+    namespace: str | None = None,
+    viewer: napari.Viewer | None = None,
+) -> NapariMacro:
+    """
+    Load a saved script as a macro to resume recording.
+
+    The names assigned in the script are reserved in the symbol namespace, so
+    that new recordings continue the numbering (such as ``image3`` after
+    ``image2``) instead of restarting from ``image0``.
+
+    Parameters
+    ----------
+    path : path-like
+        Path to the script saved by ``NapariMacro.save``, or a JSON lines
+        journal written by ``JSONLinesSink`` (``.jsonl``).
+    name : str, default is "main"
+        Name of the new macro.
+    namespace : str, optional
+        Name of the symbol namespace, same as ``get_macro``.
+    viewer : napari.Viewer, optional
+        If given, layers whose names are the same as the names assigned in
+        the script are bound to the names, so that the new recordings refer
+        to them by the names.
+    """
+    from ._restore import read_lines, restore_symbols
+    from ._widgets import QMacroView
+
+    if name in _MACROS:
+        raise ValueError(f"Macro of name {name!r} already exists.")
+    lines = read_lines(path)
+    macro = _new_macro(name, namespace, lines)
+    restore_symbols(macro.symbol_generator, lines, viewer)
     if widget := QMacroView.current():
         widget._tabwidget.add_macro(macro, name)
     return macro
 
 
+def _new_macro(
+    name: str, namespace: str | None, lines: Iterable[Any] = ()
+) -> NapariMacro:
+    from ._macrokit_ext import NapariMacro
+
+    gen = None if namespace is None else _get_namespace(namespace)
+    macro = _MACROS[name] = NapariMacro(lines, symbol_generator=gen)
+    macro._name = name
+    return macro
+
+
+def _get_namespace(namespace: str) -> SymbolGenerator:
+    from ._rename import SymbolGenerator
+
+    if not isinstance(namespace, str):
+        raise TypeError(f"Namespace must be a string, got {type(namespace)}.")
+    gen = _NAMESPACES.get(namespace, None)
+    if gen is None:
+        gen = _NAMESPACES[namespace] = SymbolGenerator()
+    return gen
+
+
 def _safe_get_macro(name: str) -> NapariMacro:
     if name in _MACROS:
         raise ValueError(f"Macro of name {name!r} already exists.")
@@ -64,9 +144,20 @@ def temp_macro(name: str = "temp") -> ContextManager[NapariMacro]:
     finally:
         if is_sequence:
             for n in name:
-                _MACROS.pop(n, None)
+                _discard_macro(n)
         else:
-            _MACROS.pop(name, None)
+            _discard_macro(name)
+
+
+def _discard_macro(name: str) -> None:
+    """Remove a macro and detach its tabs, so that it can be released."""
+    from ._widgets import QMacroView
+
+    macro = _MACROS.pop(name, None)
+    if macro is None:
+        return
+    if widget := QMacroView.current():
+        widget._tabwidget.detach_macro(macro)
 
 
 def _merge_macros(macros: Iterable[NapariMacro], name) -> NapariMacro:
@@ -78,7 +169,8 @@ def _merge_macros(macros: Iterable[NapariMacro], name) -> NapariMacro:
     new = get_macro(name)
     for macro in macros:
         macro.on_appended.append(new.append)
-        macro.on_popped.append(lambda: new.pop())
+        macro.on_popped.append(lambda expr: new._remove_lines([expr]))
+        macro.on_deleted.append(lambda _, lines: new._remove_lines(lines))
     return new
 
 
@@ -114,8 +206,18 @@ def available_keys() -> list[str]:
     return list(_MACROS.keys())
 
 
-def symbol_of(obj: Any) -> Symbol:
-    """Get the symbol object used to represent the input object."""
+def symbol_of(obj: Any, namespace: str | None = None) -> Symbol:
+    """
+    Get the symbol object used to represent the input object.
+
+    If ``namespace`` is not given, the global namespace is searched first and
+    then all the other namespaces.
+    """
     from napari_macrokit._macrokit_ext import SymbolGen
 
+    if namespace is not None:
+        return _get_namespace(namespace).as_renamed_symbol(obj)
+    for gen in [SymbolGen, *_NAMESPACES.values()]:
+        if gen.has_renamed(obj):
+            return gen.as_renamed_symbol(obj)
     return SymbolGen.as_renamed_symbol(obj)